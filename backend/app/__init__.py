@@ -1,55 +1,256 @@
 from flask import Flask
 from flask_jwt_extended import JWTManager
-from .routes.user import bp as user_bp
+from .routes.user import bp as user_bp, APPROVAL_STAGES
 from .routes.qr_code import bp as qr_code_bp
 from .routes.whatsapp import bp as whatsapp_bp
-from .routes.auth import bp as auth_bp
-from .utils.whatsapp import WhatsAppBot
+from .routes.dashboard import bp as dashboard_bp
+from .routes.health import bp as health_bp
+from .routes.jobs import bp as jobs_bp
+from .auth import bp as auth_bp
+from .config import Config
+from .backends import create_store
+from .cli import register_cli
+from .utils.transports import create_transport
+from .utils.outbox import WhatsAppOutbox
+from .utils.broadcast import BroadcastCampaigns
+from .utils.jobs import JobQueue
+from .utils.qr_code import configure_qr_cache
+from .utils.qr_signing import QRSigner
+from .utils.roster import CheckInRoster, connect_roster_signals
+from .utils.roster_feed import RosterFeed, connect_roster_feed_signals
+from .utils.change_counter import ChangeCounter
+from .utils.dashboard import LiveDashboard, connect_dashboard_signals
+from .utils.search import AttendeeIndex, connect_search_signals
+from .utils.metrics import init_metrics
+from .utils.passwords import PasswordVerifier
+from .utils.throttle import LoginThrottle
+from .utils.ttl_cache import TTLCache
+from .utils.registrations import RegistrationIndex
+from .utils.http_pool import pool_supabase_client
+from .utils.leader import BackgroundLeader
+from .utils.subsystems import Subsystems, STANDBY, DISABLED
+from .utils.log import configure_logging, init_request_logging
+from .database import UserLoader, connect_loader_signals
+import atexit
 import logging
 
-# Configure logging with a file handler for persistence
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler('app.log'), logging.StreamHandler()]
-)
 logger = logging.getLogger(__name__)
 
 def create_app():
     app = Flask(__name__)
-    app.config.from_pyfile('config.py')
+    app.config.from_object(Config)
 
-    # Initialize Supabase
+    # One queue-based logging pipeline per process (JSON records, rotation, rate limiting)
+    configure_logging(app.config)
+
+    # Anything that waits on the network or a browser starts in the background (see /healthz)
+    app.subsystems = Subsystems(app.config['STARTUP_RETRY_BASE_DELAY'], app.config['STARTUP_RETRY_MAX_DELAY'])
+    atexit.register(app.subsystems.stop)
+
+    # Initialize Supabase (optional with the sqlite backend, where it is only used for storage uploads).
+    # Building the client does no network I/O; reachability is checked by the database subsystem below
     from supabase import create_client, Client
+    app.supabase = None
+    if app.config['DATABASE_BACKEND'] == 'supabase' or app.config['SUPABASE_URL']:
+        try:
+            supabase = create_client(app.config['SUPABASE_URL'], app.config['SUPABASE_KEY'])
+            if isinstance(supabase, Client):
+                pool_supabase_client(supabase, app.config['HTTP_POOL_MAX_CONNECTIONS'],
+                                     app.config['HTTP_POOL_MAX_KEEPALIVE'])
+            app.supabase = supabase
+            logger.info("Supabase client initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize Supabase client: {str(e)}")
+            raise
+
+    # Initialize the storage backend behind app.database
     try:
-        supabase = create_client(app.config['SUPABASE_URL'], app.config['SUPABASE_KEY'])
-        app.supabase = supabase
-        logger.info("Supabase client initialized successfully")
+        app.db = create_store(app.config, app.supabase)
+        atexit.register(app.db.close)
+        logger.info(f"Database backend '{app.db.name}' initialized successfully")
     except Exception as e:
-        logger.error(f"Failed to initialize Supabase client: {str(e)}")
+        logger.error(f"Failed to initialize database backend: {str(e)}")
         raise
+    # Scans and registrations are served once the database answers
+    app.subsystems.start('database', lambda: app.db.list_users('user_id', limit=1), required=True)
+
+    # Batched, cached user lookups for app.database.get_user_by_id
+    app.user_loader = UserLoader(
+        app.db, cache_ttl=app.config['USER_CACHE_TTL'], cache_size=app.config['USER_CACHE_SIZE'],
+        batch_window=app.config['USER_LOADER_BATCH_WINDOW'], max_batch_size=app.config['USER_LOADER_MAX_BATCH'],
+        retry_attempts=app.config['DB_READ_RETRY_ATTEMPTS'], retry_base_delay=app.config['DB_READ_RETRY_BASE_DELAY'],
+    )
+    connect_loader_signals(app, app.user_loader)
 
     # Initialize JWT
     jwt = JWTManager(app)
 
-    # Initialize WhatsApp bot
+    # Login path: cached admin lookups, throttling and a bounded pool for bcrypt
+    app.admin_cache = TTLCache(app.config['ADMIN_CACHE_TTL'])
+    app.login_throttle = LoginThrottle(
+        app.config['LOGIN_RATE_PER_IP'], app.config['LOGIN_BURST_PER_IP'],
+        app.config['LOGIN_RATE_PER_EMAIL'], app.config['LOGIN_BURST_PER_EMAIL'],
+    )
+    app.password_verifier = PasswordVerifier(app.config['LOGIN_VERIFY_WORKERS'], app.config['LOGIN_VERIFY_QUEUE'])
+    atexit.register(app.password_verifier.close)
+
+    configure_qr_cache(app.config['QR_CACHE_SIZE'])
+    app.qr_signer = QRSigner(app.config['SECRET_KEY'], app.config['EVENT_ID'],
+                             accept_unsigned=app.config['QR_ACCEPT_UNSIGNED'])
+
+    # Initialize the messaging transport selected by MESSAGING_TRANSPORT
+    try:
+        app.messaging_transport = create_transport(app.config)
+        logger.info(f"Messaging transport '{app.messaging_transport.name}' initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize messaging transport: {str(e)}")
+        raise
+
+    # Initialize the WhatsApp outbox; routes in every worker enqueue, one process sends
     try:
-        app.whatsapp_bot = WhatsAppBot()
-        logger.info("WhatsApp bot initialized successfully")
+        app.whatsapp_outbox = WhatsAppOutbox(
+            app.messaging_transport.send,
+            db_path=app.config['OUTBOX_DB_PATH'],
+            rate_per_minute=app.config['OUTBOX_RATE_PER_MINUTE'],
+            burst=app.config['OUTBOX_BURST'],
+            max_attempts=app.config['OUTBOX_MAX_ATTEMPTS'],
+            retry_base_delay=app.config['OUTBOX_RETRY_BASE_DELAY'],
+            retry_max_delay=app.config['OUTBOX_RETRY_MAX_DELAY'],
+            workers=app.messaging_transport.concurrency,
+            lease_seconds=app.config['OUTBOX_CLAIM_LEASE_SECONDS'],
+        )
+        logger.info("WhatsApp outbox initialized successfully")
     except Exception as e:
-        logger.error(f"Failed to initialize WhatsApp bot: {str(e)}")
+        logger.error(f"Failed to initialize WhatsApp outbox: {str(e)}")
         raise
 
+    # Writes to the users table, counted next to the outbox so /users/pending can answer a 304 without a query
+    app.users_changes = ChangeCounter(app.whatsapp_outbox, 'users')
+
+    # Broadcast campaigns are stored next to the outbox; any worker creates them, the runner below queues them
+    app.broadcasts = BroadcastCampaigns(
+        app.whatsapp_outbox,
+        app.db,
+        rate_per_minute=app.config['BROADCAST_RATE_PER_MINUTE'],
+        page_size=app.config['BROADCAST_PAGE_SIZE'],
+        max_in_flight=app.config['BROADCAST_MAX_IN_FLIGHT'],
+        poll_interval=app.config['BROADCAST_POLL_INTERVAL'],
+    )
+
+    # Durable approval jobs; every process runs workers, so a click is picked up right away
+    app.jobs = JobQueue(
+        app,
+        app.whatsapp_outbox,
+        workers=app.config['JOB_WORKERS'],
+        max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+        retry_base_delay=app.config['JOB_RETRY_BASE_DELAY'],
+        retry_max_delay=app.config['JOB_RETRY_MAX_DELAY'],
+        lease_seconds=app.config['JOB_LEASE_SECONDS'],
+        poll_interval=app.config['JOB_POLL_INTERVAL'],
+    )
+    app.jobs.register('approve_user', APPROVAL_STAGES)
+    atexit.register(app.jobs.stop)
+    app.subsystems.start('jobs', app.jobs.start, after=('database',))
+
+    # Only the elected process opens the WhatsApp sessions and drains the outbox (see gunicorn.conf.py).
+    # Messages queue up in the outbox until the transport is ready
+    def start_messaging():
+        app.messaging_transport.start()
+        app.whatsapp_outbox.start()
+        app.broadcasts.start()
+
+    def start_background_services():
+        # The transport lives for the whole process; atexit runs in reverse, so the broadcast
+        # runner stops first, then the outbox
+        atexit.register(app.messaging_transport.close)
+        atexit.register(app.whatsapp_outbox.stop)
+        atexit.register(app.broadcasts.stop)
+        app.subsystems.start('messaging', start_messaging)
+
+    app.subsystems.set_state('messaging', STANDBY)
+
+    app.background_leader = BackgroundLeader(
+        app.config['BACKGROUND_LOCK_PATH'] or f"{app.config['OUTBOX_DB_PATH']}.lock",
+        start_background_services,
+    )
+    app.background_leader.start()
+    atexit.register(app.background_leader.stop)
+
+    # Initialize the registration duplicate index; until it is loaded, duplicates are
+    # caught by the database's unique constraints
+    app.registration_index = RegistrationIndex(idempotency_ttl=app.config['IDEMPOTENCY_KEY_TTL'])
+    app.subsystems.start('registration_index', lambda: app.registration_index.load(app.db), after=('database',))
+
+    # Initialize the desk search index of approved users
+    app.attendee_index = AttendeeIndex()
+    connect_search_signals(app, app.attendee_index)
+    app.subsystems.start('attendee_index', lambda: app.attendee_index.load(app.db), after=('database',))
+
+    # Initialize the in-memory check-in roster; until it is loaded, scans go to the database
+    if app.config['ROSTER_CACHE_ENABLED']:
+        app.roster = CheckInRoster(
+            app.db,
+            flush_interval=app.config['ROSTER_FLUSH_INTERVAL'],
+            flush_batch_size=app.config['ROSTER_FLUSH_BATCH_SIZE'],
+        )
+        connect_roster_signals(app, app.roster)
+        atexit.register(app.roster.stop)
+
+        def start_roster():
+            app.roster.load()
+            app.roster.start()
+
+        app.subsystems.start('roster', start_roster, after=('database',))
+    else:
+        app.subsystems.set_state('roster', DISABLED)
+
+    # Versioned change log behind the offline scanner feed (/qr_codes/roster)
+    app.roster_feed = RosterFeed(
+        app.whatsapp_outbox,
+        app.db,
+        page_size=app.config['ROSTER_FEED_PAGE_SIZE'],
+        snapshot_ttl=app.config['ROSTER_FEED_SNAPSHOT_TTL'],
+        flush_interval=app.config['ROSTER_FEED_FLUSH_INTERVAL'],
+    )
+    connect_roster_feed_signals(app, app.roster_feed)
+    app.roster_feed.start()
+    atexit.register(app.roster_feed.stop)
+
+    # Initialize the live dashboard aggregates
+    app.dashboard = None
+    if app.config['DASHBOARD_ENABLED']:
+        app.dashboard = LiveDashboard(
+            app.db,
+            client_queue_size=app.config['DASHBOARD_CLIENT_QUEUE'],
+            history_size=app.config['DASHBOARD_HISTORY_SIZE'],
+            max_subscribers=app.config['DASHBOARD_MAX_SUBSCRIBERS'],
+            resync_interval=app.config['DASHBOARD_RESYNC_INTERVAL'],
+        )
+        connect_dashboard_signals(app, app.dashboard)
+        atexit.register(app.dashboard.stop)
+
+        def start_dashboard():
+            app.dashboard.load()
+            app.dashboard.start()
+
+        app.subsystems.start('dashboard', start_dashboard, after=('database',))
+    else:
+        app.subsystems.set_state('dashboard', DISABLED)
+
     # Register blueprints
     app.register_blueprint(user_bp)
     app.register_blueprint(qr_code_bp)
     app.register_blueprint(whatsapp_bp)
     app.register_blueprint(auth_bp)
+    app.register_blueprint(health_bp)
+    app.register_blueprint(jobs_bp)
+    if app.dashboard is not None:
+        app.register_blueprint(dashboard_bp)
+
+    init_request_logging(app)
+    if app.config['METRICS_ENABLED']:
+        init_metrics(app)
 
-    @app.teardown_appcontext
-    def shutdown_whatsapp_bot(exception=None):
-        if hasattr(app, 'whatsapp_bot'):
-            app.whatsapp_bot.close()
-            logger.info("WhatsApp bot shutdown completed")
+    register_cli(app)
 
     return app
\ No newline at end of file
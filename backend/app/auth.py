@@ -1,16 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from werkzeug.exceptions import abort
-from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required
-from .database import get_admin_by_email
+from flask_jwt_extended import create_access_token, create_refresh_token, get_jwt_identity, jwt_required
+from .database import get_admin_by_email, invalidate_admin
+from .utils.metrics import REGISTRY, span
+from .utils.passwords import VerifierBusy
 import logging
-import bcrypt
+import math
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+LOGIN_THROTTLED = REGISTRY.counter('login_throttled_total', 'Login attempts rejected before any password check', ('scope',))
+
 @bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
@@ -20,24 +22,51 @@ def login():
     if not email or not password:
         return abort(400, description='Missing email or password')
 
+    # Throttle per client and per account before touching the database or bcrypt
+    throttled = current_app.login_throttle.check(request.remote_addr or 'unknown', email)
+    if throttled:
+        scope, retry_after = throttled
+        LOGIN_THROTTLED.inc(scope=scope)
+        logger.warning(f"Login throttled by {scope} for {email} from {request.remote_addr}")
+        return abort(429, description='Too many login attempts, try again later', retry_after=math.ceil(retry_after))
+
     try:
         admin = get_admin_by_email(email)
-        if not admin:
-            logger.warning(f"Login attempt with non-existent email: {email}")
-            return abort(401, description='Invalid credentials')
-
-        # Verify hashed password
-        if not bcrypt.checkpw(password.encode('utf-8'), admin['password'].encode('utf-8')):
-            logger.warning(f"Invalid password attempt for admin: {email}")
-            return abort(401, description='Invalid credentials')
-
-        access_token = create_access_token(identity=admin['admin_id'], expires_delta=False)  # No expiration
-        logger.info(f"Admin {admin['admin_id']} logged in successfully")
-        return jsonify({'access_token': access_token}), 200
+        if admin:
+            with span('bcrypt', 'checkpw'):
+                valid = current_app.password_verifier.verify(password, admin['password'],
+                                                             timeout=current_app.config['LOGIN_VERIFY_TIMEOUT'])
+    except VerifierBusy as e:
+        logger.warning(f"Login for {email} rejected: {str(e)}")
+        return abort(503, description='Login service busy, try again shortly', retry_after=1)
     except Exception as e:
         logger.error(f"Error during login for {email}: {str(e)}")
         return abort(500, description=f'Login error: {str(e)}')
 
+    if not admin:
+        logger.warning(f"Login attempt with non-existent email: {email}")
+        return abort(401, description='Invalid credentials')
+    if not valid:
+        # The cached record may predate a password change
+        invalidate_admin(email)
+        logger.warning(f"Invalid password attempt for admin: {email}")
+        return abort(401, description='Invalid credentials')
+
+    # Short-lived access token; clients renew it through /auth/refresh instead of logging in again
+    access_token = create_access_token(identity=admin['admin_id'], fresh=True)
+    refresh_token = create_refresh_token(identity=admin['admin_id'])
+    logger.info(f"Admin {admin['admin_id']} logged in successfully")
+    return jsonify({'access_token': access_token, 'refresh_token': refresh_token}), 200
+
+# Exchange a refresh token for a new access token (no database or bcrypt work)
+@bp.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    current_admin_id = get_jwt_identity()
+    access_token = create_access_token(identity=current_admin_id, fresh=False)
+    logger.debug(f"Access token refreshed for admin: {current_admin_id}")
+    return jsonify({'access_token': access_token}), 200
+
 @bp.route('/protected', methods=['GET'])
 @jwt_required()
 def protected():
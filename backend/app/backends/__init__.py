@@ -0,0 +1,14 @@
+from .base import UserStore, DuplicateRecordError
+
+
+def create_store(config, supabase=None):
+    backend = config['DATABASE_BACKEND']
+    if backend == 'supabase':
+        from .supabase_backend import SupabaseStore
+        if supabase is None:
+            raise ValueError('The supabase backend needs a Supabase client')
+        return SupabaseStore(supabase)
+    if backend == 'sqlite':
+        from .sqlite_backend import SQLiteStore
+        return SQLiteStore(config['SQLITE_PATH'])
+    raise ValueError(f'Unknown database backend: {backend}')
@@ -0,0 +1,74 @@
+class DuplicateRecordError(Exception):
+    """Raised when a write violates a uniqueness constraint."""
+
+
+# Columns of the users table, in a stable order
+USER_COLUMNS = ('user_id', 'name', 'batch', 'branch', 'phone_number', 'transaction_id',
+                'approval_status', 'check_in_status', 'qr_code_image_url', 'created_at')
+ADMIN_COLUMNS = ('admin_id', 'email', 'password', 'created_at')
+
+
+class UserStore:
+    """Storage interface behind the functions in ``app.database``.
+
+    ``columns`` arguments use the Supabase select syntax (``'*'`` or a
+    comma-separated list). ``filters`` is a dict of column equality checks.
+    ``after`` is a ``(created_at, user_id)`` keyset cursor.
+    """
+
+    name = 'base'
+
+    def get_user(self, user_id, columns='*'):
+        raise NotImplementedError
+
+    def get_users(self, user_ids, columns='*'):
+        raise NotImplementedError
+
+    def list_users(self, columns='*', filters=None, after=None, limit=None):
+        raise NotImplementedError
+
+    def insert_user(self, fields):
+        raise NotImplementedError
+
+    def insert_users(self, rows):
+        # All-or-nothing bulk insert; returns the inserted rows
+        raise NotImplementedError
+
+    def update_user(self, user_id, fields):
+        raise NotImplementedError
+
+    def upsert_users(self, rows):
+        raise NotImplementedError
+
+    def approve_users(self, qr_code_urls, from_statuses=('pending',)):
+        # Conditional: sets approval_status = 'approved' and each user's qr_code_image_url
+        # ({user_id: url}) only where approval_status is in from_statuses; returns the rows changed
+        raise NotImplementedError
+
+    def reject_user(self, user_id):
+        # Conditional: only rejects a user who is still pending; returns the changed row or None
+        raise NotImplementedError
+
+    def check_in_user(self, user_id):
+        # Conditional: only flips an approved, not yet checked-in user; returns True if it did
+        raise NotImplementedError
+
+    def check_in_users(self, user_ids):
+        # Set-based check_in_user; returns the set of IDs that were flipped
+        raise NotImplementedError
+
+    def get_admin_by_email(self, email):
+        raise NotImplementedError
+
+    def list_admins(self):
+        raise NotImplementedError
+
+    def upsert_admins(self, rows):
+        raise NotImplementedError
+
+    def is_transient(self, error):
+        # Whether a failed read is worth retrying (timeouts, dropped connections, overload)
+        return False
+
+    def close(self):
+        pass
@@ -0,0 +1,302 @@
+from datetime import datetime, timezone
+import sqlite3
+import threading
+import uuid
+from .base import UserStore, DuplicateRecordError, USER_COLUMNS, ADMIN_COLUMNS
+from ..utils.registrations import normalize_phone_number
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Under gevent workers threading.local is per greenlet, which would open a connection per
+    # request. SQLite calls never yield to the hub, so greenlets on one OS thread can share one
+    from gevent.monkey import get_original
+    _thread_local = get_original('threading', 'local')
+except ImportError:
+    _thread_local = threading.local
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    batch TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    transaction_id TEXT NOT NULL,
+    approval_status TEXT NOT NULL DEFAULT 'pending',
+    check_in_status TEXT NOT NULL DEFAULT 'not_checked_in',
+    qr_code_image_url TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_approval_status ON users (approval_status, created_at, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_phone_number ON users (phone_number);
+CREATE TABLE IF NOT EXISTS admins (
+    admin_id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    created_at TEXT
+);
+'''
+
+# Created one by one so that a database which already holds duplicates still opens; where
+# registration lookups need the index, a plain one is created instead until they are resolved
+UNIQUE_INDEXES = (
+    ('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_transaction_id_unique ON users (transaction_id)',
+     'CREATE INDEX IF NOT EXISTS idx_users_transaction_id ON users (transaction_id)'),
+    ('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_phone_key ON users (phone_key(phone_number))', None),
+)
+
+# SQLite's default limit on bound parameters is 999 on older builds
+_IN_CHUNK_SIZE = 500
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _select_list(columns, allowed):
+    if columns.strip() == '*':
+        return list(allowed)
+    selected = [column.strip() for column in columns.split(',') if column.strip()]
+    unknown = [column for column in selected if column not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return selected
+
+
+class SQLiteStore(UserStore):
+    """Embedded SQLite backend for running a gate fully offline.
+
+    Each OS thread gets its own connection; the database runs in WAL mode so
+    readers never block on the writer.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = _thread_local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._conn.executescript(SCHEMA)
+        for statement, fallback in UNIQUE_INDEXES:
+            try:
+                self._conn.execute(statement)
+            except sqlite3.IntegrityError as e:
+                logger.warning(f"Could not create unique index, resolve duplicate registrations first: {str(e)}")
+                if fallback:
+                    self._conn.execute(fallback)
+
+    @property
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            # Used by the phone number unique index
+            conn.create_function('phone_key', 1, normalize_phone_number, deterministic=True)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _fetch(self, sql, params=(), columns=None):
+        rows = self._conn.execute(sql, params).fetchall()
+        return [{column: row[column] for column in (columns or row.keys())} for row in rows]
+
+    def is_transient(self, error):
+        # Another process holding the write lock past the busy timeout
+        return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+    def get_user(self, user_id, columns='*'):
+        selected = _select_list(columns, USER_COLUMNS)
+        rows = self._fetch(f"SELECT {', '.join(selected)} FROM users WHERE user_id = ?", (user_id,))
+        return rows[0] if rows else None
+
+    def get_users(self, user_ids, columns='*'):
+        selected = _select_list(columns, USER_COLUMNS)
+        user_ids = list(user_ids)
+        rows = []
+        for start in range(0, len(user_ids), _IN_CHUNK_SIZE):
+            chunk = user_ids[start:start + _IN_CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            rows.extend(self._fetch(
+                f"SELECT {', '.join(selected)} FROM users WHERE user_id IN ({placeholders})", chunk
+            ))
+        return rows
+
+    def list_users(self, columns='*', filters=None, after=None, limit=None):
+        selected = _select_list(columns, USER_COLUMNS)
+        clauses, params = [], []
+        for column, value in (filters or {}).items():
+            if column not in USER_COLUMNS:
+                raise ValueError(f'Unknown column: {column}')
+            clauses.append(f'{column} = ?')
+            params.append(value)
+        if after:
+            clauses.append('(created_at, user_id) > (?, ?)')
+            params.extend(after)
+        sql = f"SELECT {', '.join(selected)} FROM users"
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY created_at, user_id'
+        if limit:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return self._fetch(sql, params)
+
+    def _insert(self, conn, fields):
+        row = {'user_id': str(uuid.uuid4()), 'approval_status': 'pending',
+               'check_in_status': 'not_checked_in', 'created_at': _now()}
+        row.update({column: value for column, value in fields.items() if column in USER_COLUMNS})
+        columns = list(row)
+        conn.execute(
+            f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [row[column] for column in columns],
+        )
+        return row
+
+    def insert_user(self, fields):
+        try:
+            return self._insert(self._conn, fields)
+        except sqlite3.IntegrityError as e:
+            raise DuplicateRecordError(str(e)) from e
+
+    def insert_users(self, rows):
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            inserted = [self._insert(conn, fields) for fields in rows]
+            conn.execute('COMMIT')
+        except sqlite3.IntegrityError as e:
+            conn.execute('ROLLBACK')
+            raise DuplicateRecordError(str(e)) from e
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return inserted
+
+    def update_user(self, user_id, fields):
+        assignments = [column for column in fields if column in USER_COLUMNS and column != 'user_id']
+        if assignments:
+            self._conn.execute(
+                f"UPDATE users SET {', '.join(f'{column} = ?' for column in assignments)} WHERE user_id = ?",
+                [fields[column] for column in assignments] + [user_id],
+            )
+        return self.get_user(user_id)
+
+    def upsert_users(self, rows):
+        conn = self._conn
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fields in rows:
+                row = {column: value for column, value in fields.items() if column in USER_COLUMNS}
+                row.setdefault('created_at', _now())
+                columns = list(row)
+                updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'user_id')
+                conn.execute(
+                    f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT (user_id) DO UPDATE SET {updates}",
+                    [row[column] for column in columns],
+                )
+            conn.execute('COMMIT')
+        except sqlite3.IntegrityError as e:
+            conn.execute('ROLLBACK')
+            raise DuplicateRecordError(str(e)) from e
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get_users([row['user_id'] for row in rows])
+
+    def approve_users(self, qr_code_urls, from_statuses=('pending',)):
+        approved = []
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for user_id, url in qr_code_urls.items():
+                cursor = conn.execute(
+                    "UPDATE users SET approval_status = 'approved', qr_code_image_url = ? "
+                    f"WHERE user_id = ? AND approval_status IN ({', '.join('?' * len(from_statuses))})",
+                    [url, user_id, *from_statuses],
+                )
+                if cursor.rowcount:
+                    approved.append(user_id)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.get_users(approved)
+
+    def reject_user(self, user_id):
+        cursor = self._conn.execute(
+            "UPDATE users SET approval_status = 'rejected' WHERE user_id = ? AND approval_status = 'pending'",
+            (user_id,),
+        )
+        return self.get_user(user_id) if cursor.rowcount == 1 else None
+
+    def check_in_user(self, user_id):
+        cursor = self._conn.execute(
+            "UPDATE users SET check_in_status = 'checked_in' "
+            "WHERE user_id = ? AND approval_status = 'approved' AND check_in_status = 'not_checked_in'",
+            (user_id,),
+        )
+        return cursor.rowcount == 1
+
+    def check_in_users(self, user_ids):
+        user_ids = list(user_ids)
+        checked_in = set()
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for start in range(0, len(user_ids), _IN_CHUNK_SIZE):
+                chunk = user_ids[start:start + _IN_CHUNK_SIZE]
+                placeholders = ', '.join('?' * len(chunk))
+                condition = (f"user_id IN ({placeholders}) AND approval_status = 'approved' "
+                             f"AND check_in_status = 'not_checked_in'")
+                eligible = [row[0] for row in conn.execute(f'SELECT user_id FROM users WHERE {condition}', chunk)]
+                if eligible:
+                    conn.execute(f"UPDATE users SET check_in_status = 'checked_in' WHERE {condition}", chunk)
+                    checked_in.update(eligible)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return checked_in
+
+    def get_admin_by_email(self, email):
+        rows = self._fetch('SELECT * FROM admins WHERE email = ?', (email,))
+        return rows[0] if rows else None
+
+    def list_admins(self):
+        return self._fetch('SELECT * FROM admins')
+
+    def upsert_admins(self, rows):
+        conn = self._conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for fields in rows:
+                row = {column: value for column, value in fields.items() if column in ADMIN_COLUMNS}
+                row.setdefault('admin_id', str(uuid.uuid4()))
+                columns = list(row)
+                updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'admin_id')
+                conn.execute(
+                    f"INSERT INTO admins ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT (admin_id) DO UPDATE SET {updates}",
+                    [row[column] for column in columns],
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
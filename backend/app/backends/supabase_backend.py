@@ -0,0 +1,142 @@
+from .base import UserStore, DuplicateRecordError
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+
+# Postgres/PostgREST error codes for conditions that clear up on their own: connection
+# failures (08xxx), serialization failures and deadlocks, too many connections,
+# admin shutdown, and PostgREST unable to reach the database
+TRANSIENT_ERROR_CODES = {'40001', '40P01', '53300', '57P01', 'PGRST000', 'PGRST001', 'PGRST002', '502', '503', '504'}
+
+URL_WRITE_CONCURRENCY = 8  # Per-user QR code URL updates in flight during a batch approval
+
+
+def _raise_duplicate(e):
+    # PostgREST reports unique violations with Postgres error code 23505
+    if getattr(e, 'code', None) == '23505':
+        raise DuplicateRecordError(str(e)) from e
+    raise e
+
+
+class SupabaseStore(UserStore):
+    name = 'supabase'
+
+    def __init__(self, client):
+        self.client = client
+
+    def is_transient(self, error):
+        if isinstance(error, httpx.TransportError):
+            return True
+        code = str(getattr(error, 'code', None) or '')
+        return code in TRANSIENT_ERROR_CODES or code.startswith('08')
+
+    def get_user(self, user_id, columns='*'):
+        response = self.client.table('users').select(columns).eq('user_id', user_id).execute()
+        return response.data[0] if response.data else None
+
+    def get_users(self, user_ids, columns='*'):
+        if not user_ids:
+            return []
+        return self.client.table('users').select(columns).in_('user_id', list(user_ids)).execute().data
+
+    def list_users(self, columns='*', filters=None, after=None, limit=None):
+        query = self.client.table('users').select(columns)
+        for column, value in (filters or {}).items():
+            query = query.eq(column, value)
+        if after:
+            created_at, user_id = after
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",user_id.gt."{user_id}")')
+        query = query.order('created_at').order('user_id')
+        if limit:
+            query = query.limit(limit)
+        return query.execute().data
+
+    def insert_user(self, fields):
+        try:
+            return self.client.table('users').insert(fields).execute().data[0]
+        except Exception as e:
+            _raise_duplicate(e)
+
+    def insert_users(self, rows):
+        if not rows:
+            return []
+        try:
+            return self.client.table('users').insert(list(rows)).execute().data
+        except Exception as e:
+            _raise_duplicate(e)
+
+    def update_user(self, user_id, fields):
+        response = self.client.table('users').update(fields).eq('user_id', user_id).execute()
+        return response.data[0] if response.data else None
+
+    def upsert_users(self, rows):
+        if not rows:
+            return []
+        try:
+            return self.client.table('users').upsert(rows, on_conflict='user_id').execute().data
+        except Exception as e:
+            _raise_duplicate(e)
+
+    def approve_users(self, qr_code_urls, from_statuses=('pending',)):
+        if not qr_code_urls:
+            return []
+        from_statuses = list(from_statuses)
+        if len(qr_code_urls) == 1:
+            (user_id, url), = qr_code_urls.items()
+            return self.client.table('users').update({'approval_status': 'approved', 'qr_code_image_url': url}) \
+                .eq('user_id', user_id) \
+                .in_('approval_status', from_statuses) \
+                .execute().data
+
+        # PostgREST applies one body to every matched row, so the per-user URLs go first (a
+        # user left unapproved by the next step keeps an unused URL), then one conditional
+        # update flips the status of every user still eligible
+        def write_url(item):
+            user_id, url = item
+            self.client.table('users').update({'qr_code_image_url': url}) \
+                .eq('user_id', user_id) \
+                .in_('approval_status', from_statuses) \
+                .execute()
+
+        with ThreadPoolExecutor(max_workers=min(URL_WRITE_CONCURRENCY, len(qr_code_urls))) as executor:
+            list(executor.map(write_url, qr_code_urls.items()))
+        return self.client.table('users').update({'approval_status': 'approved'}) \
+            .in_('user_id', list(qr_code_urls)) \
+            .in_('approval_status', from_statuses) \
+            .execute().data
+
+    def reject_user(self, user_id):
+        response = self.client.table('users').update({'approval_status': 'rejected'}) \
+            .eq('user_id', user_id) \
+            .eq('approval_status', 'pending') \
+            .execute()
+        return response.data[0] if response.data else None
+
+    def check_in_user(self, user_id):
+        response = self.client.table('users').update({'check_in_status': 'checked_in'}) \
+            .eq('user_id', user_id) \
+            .eq('approval_status', 'approved') \
+            .eq('check_in_status', 'not_checked_in') \
+            .execute()
+        return bool(response.data)
+
+    def check_in_users(self, user_ids):
+        if not user_ids:
+            return set()
+        response = self.client.table('users').update({'check_in_status': 'checked_in'}) \
+            .in_('user_id', list(user_ids)) \
+            .eq('approval_status', 'approved') \
+            .eq('check_in_status', 'not_checked_in') \
+            .execute()
+        return {row['user_id'] for row in response.data}
+
+    def get_admin_by_email(self, email):
+        response = self.client.table('admins').select('*').eq('email', email).execute()
+        return response.data[0] if response.data else None
+
+    def list_admins(self):
+        return self.client.table('admins').select('*').execute().data
+
+    def upsert_admins(self, rows):
+        if not rows:
+            return []
+        return self.client.table('admins').upsert(rows, on_conflict='admin_id').execute().data
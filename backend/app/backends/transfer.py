@@ -0,0 +1,79 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Export format: one JSON object per line, {"table": "users" | "admins", "row": {...}}
+
+def export_data(store, fp, page_size=1000):
+    counts = {'users': 0, 'admins': 0}
+    after = None
+    while True:
+        rows = store.list_users(after=after, limit=page_size)
+        for row in rows:
+            fp.write(json.dumps({'table': 'users', 'row': row}) + '\n')
+        counts['users'] += len(rows)
+        if len(rows) < page_size:
+            break
+        after = (rows[-1]['created_at'], rows[-1]['user_id'])
+    for row in store.list_admins():
+        fp.write(json.dumps({'table': 'admins', 'row': row}) + '\n')
+        counts['admins'] += 1
+    logger.info(f"Exported {counts['users']} users and {counts['admins']} admins from {store.name}")
+    return counts
+
+
+def _merge(existing, incoming):
+    # Reconciliation: rows missing from the target are added as-is; for rows it
+    # already has, only check-ins are carried over (a check-in is never undone)
+    if existing is None:
+        return incoming
+    if incoming.get('check_in_status') == 'checked_in' and existing.get('check_in_status') != 'checked_in':
+        return {**existing, 'check_in_status': 'checked_in'}
+    return None
+
+
+def import_data(store, fp, mode='merge', chunk_size=500):
+    """Load an export into ``store``.
+
+    ``mode='replace'`` upserts every row as exported. ``mode='merge'``
+    reconciles a gate's local database back into the main one (see _merge).
+    """
+    if mode not in ('merge', 'replace'):
+        raise ValueError(f'Unknown import mode: {mode}')
+    counts = {'users': 0, 'admins': 0}
+    users, admins = [], []
+
+    def flush_users():
+        if not users:
+            return
+        if mode == 'merge':
+            existing = {row['user_id']: row for row in store.get_users([row['user_id'] for row in users])}
+            rows = [merged for merged in (_merge(existing.get(row['user_id']), row) for row in users) if merged]
+        else:
+            rows = list(users)
+        if rows:
+            store.upsert_users(rows)
+        counts['users'] += len(rows)
+        users.clear()
+
+    for line in fp:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if record['table'] == 'users':
+            users.append(record['row'])
+            if len(users) >= chunk_size:
+                flush_users()
+        elif record['table'] == 'admins':
+            admins.append(record['row'])
+    flush_users()
+
+    if admins:
+        if mode == 'merge':
+            known = {row['admin_id'] for row in store.list_admins()}
+            admins = [row for row in admins if row['admin_id'] not in known]
+        store.upsert_admins(admins)
+        counts['admins'] = len(admins)
+    logger.info(f"Imported {counts['users']} users and {counts['admins']} admins into {store.name} ({mode})")
+    return counts
@@ -0,0 +1,35 @@
+import click
+from flask import current_app
+from .backends import create_store
+from .backends.transfer import export_data, import_data
+
+
+def _store(backend):
+    # The configured backend unless another one is named explicitly
+    if backend is None or backend == current_app.config['DATABASE_BACKEND']:
+        return current_app.db
+    return create_store({**current_app.config, 'DATABASE_BACKEND': backend}, current_app.supabase)
+
+
+def register_cli(app):
+    @app.cli.command('export-data')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True))
+    @click.option('--backend', type=click.Choice(['supabase', 'sqlite']), help='Defaults to DATABASE_BACKEND.')
+    def export_data_command(path, backend):
+        """Export users and admins to an NDJSON file."""
+        with open(path, 'w', encoding='utf-8') as fp:
+            counts = export_data(_store(backend), fp)
+        click.echo(f"Exported {counts['users']} users and {counts['admins']} admins to {path}")
+
+    @app.cli.command('import-data')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--backend', type=click.Choice(['supabase', 'sqlite']), help='Defaults to DATABASE_BACKEND.')
+    @click.option('--mode', type=click.Choice(['merge', 'replace']), default='merge', show_default=True,
+                  help='merge only adds missing rows and carries over check-ins; replace overwrites rows.')
+    def import_data_command(path, backend, mode):
+        """Import an NDJSON export, e.g. to reconcile a gate's local database."""
+        with open(path, encoding='utf-8') as fp:
+            counts = import_data(_store(backend), fp, mode=mode)
+        current_app.admin_cache.invalidate()
+        current_app.users_changes.bump()
+        click.echo(f"Imported {counts['users']} users and {counts['admins']} admins ({mode})")
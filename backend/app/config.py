@@ -1,8 +1,7 @@
 import os
 import logging
+from datetime import timedelta
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class Config:
@@ -10,6 +9,164 @@ class Config:
     SUPABASE_KEY = os.environ.get('SUPABASE_KEY')
     SECRET_KEY = os.environ.get('SECRET_KEY')  # For JWT
 
+    # Admin sessions: short-lived access tokens, renewed with a refresh token via /auth/refresh
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=int(os.environ.get('JWT_ACCESS_TOKEN_MINUTES', '15')))
+    JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=int(os.environ.get('JWT_REFRESH_TOKEN_DAYS', '7')))
+
+    # Login hardening
+    ADMIN_CACHE_TTL = float(os.environ.get('ADMIN_CACHE_TTL', '300'))  # Seconds
+    LOGIN_VERIFY_WORKERS = int(os.environ.get('LOGIN_VERIFY_WORKERS', '2'))  # Concurrent bcrypt checks
+    LOGIN_VERIFY_QUEUE = int(os.environ.get('LOGIN_VERIFY_QUEUE', '16'))  # Waiting checks before 503
+    LOGIN_VERIFY_TIMEOUT = float(os.environ.get('LOGIN_VERIFY_TIMEOUT', '10'))  # Seconds
+    LOGIN_RATE_PER_IP = float(os.environ.get('LOGIN_RATE_PER_IP', '30'))  # Attempts per minute
+    LOGIN_BURST_PER_IP = int(os.environ.get('LOGIN_BURST_PER_IP', '10'))
+    LOGIN_RATE_PER_EMAIL = float(os.environ.get('LOGIN_RATE_PER_EMAIL', '10'))  # Attempts per minute
+    LOGIN_BURST_PER_EMAIL = int(os.environ.get('LOGIN_BURST_PER_EMAIL', '5'))
+
+    # Instrumentation: Prometheus /metrics and a log line with the time breakdown of slow requests
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'false').lower() == 'true'  # Serve /metrics without an admin token
+    SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', '0'))  # 0 disables the log
+
+    # Shared HTTP connection pool for the Supabase table and storage clients
+    HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get('HTTP_POOL_MAX_CONNECTIONS', '100'))
+    HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get('HTTP_POOL_MAX_KEEPALIVE', '20'))
+
+    # Lock file electing the one worker process that runs the outbox and WhatsApp sessions
+    # (defaults to OUTBOX_DB_PATH + '.lock')
+    BACKGROUND_LOCK_PATH = os.environ.get('BACKGROUND_LOCK_PATH')
+
+    # Logging: records go through a queue to a background writer (stderr plus an optional
+    # rotating file). With several gunicorn workers, give each its own LOG_FILE or set it
+    # empty and collect stderr.
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+    LOG_FILE = os.environ.get('LOG_FILE', 'app.log')
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+    LOG_RATE_LIMIT_BURST = int(os.environ.get('LOG_RATE_LIMIT_BURST', '50'))  # INFO/DEBUG records per call site, 0 = unlimited
+    LOG_RATE_LIMIT_INTERVAL = float(os.environ.get('LOG_RATE_LIMIT_INTERVAL', '10'))  # Seconds
+    LOG_REQUESTS = os.environ.get('LOG_REQUESTS', 'true').lower() == 'true'  # One record per request with its latency
+
+    # Background startup of the database checks, caches and messaging (see /healthz and /readyz)
+    STARTUP_RETRY_BASE_DELAY = float(os.environ.get('STARTUP_RETRY_BASE_DELAY', '1'))  # Seconds
+    STARTUP_RETRY_MAX_DELAY = float(os.environ.get('STARTUP_RETRY_MAX_DELAY', '60'))  # Seconds
+
+    # Storage backend: 'supabase' or 'sqlite' (embedded, for fully local gate deployments)
+    DATABASE_BACKEND = os.environ.get('DATABASE_BACKEND', 'supabase')
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'registration.db')
+
+    # In-memory check-in roster for /qr_codes/scan
+    ROSTER_CACHE_ENABLED = os.environ.get('ROSTER_CACHE_ENABLED', 'false').lower() == 'true'
+    ROSTER_FLUSH_INTERVAL = float(os.environ.get('ROSTER_FLUSH_INTERVAL', '1.0'))  # Seconds
+    ROSTER_FLUSH_BATCH_SIZE = int(os.environ.get('ROSTER_FLUSH_BATCH_SIZE', '200'))
+
+    # User lookups by ID: a per-request memo, a short shared cache and batching of concurrent lookups
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '2'))  # Seconds, 0 disables the shared cache
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+    USER_LOADER_BATCH_WINDOW = float(os.environ.get('USER_LOADER_BATCH_WINDOW', '0.002'))  # Seconds, 0 disables batching
+    USER_LOADER_MAX_BATCH = int(os.environ.get('USER_LOADER_MAX_BATCH', '200'))  # IDs per in_() query
+    DB_READ_RETRY_ATTEMPTS = int(os.environ.get('DB_READ_RETRY_ATTEMPTS', '3'))  # Tries on transient errors
+    DB_READ_RETRY_BASE_DELAY = float(os.environ.get('DB_READ_RETRY_BASE_DELAY', '0.1'))  # Seconds, doubled per retry
+
+    # Offline scanner roster feed at /qr_codes/roster
+    ROSTER_FEED_PAGE_SIZE = int(os.environ.get('ROSTER_FEED_PAGE_SIZE', '1000'))  # Users per query when building a snapshot
+    ROSTER_FEED_SNAPSHOT_TTL = float(os.environ.get('ROSTER_FEED_SNAPSHOT_TTL', '300'))  # Seconds a snapshot base is reused
+    ROSTER_FEED_FLUSH_INTERVAL = float(os.environ.get('ROSTER_FEED_FLUSH_INTERVAL', '0.5'))  # Seconds between change log writes
+
+    # Live admin dashboard at /dashboard/stream (server-sent events)
+    DASHBOARD_ENABLED = os.environ.get('DASHBOARD_ENABLED', 'true').lower() == 'true'
+    DASHBOARD_MAX_SUBSCRIBERS = int(os.environ.get('DASHBOARD_MAX_SUBSCRIBERS', '50'))
+    DASHBOARD_CLIENT_QUEUE = int(os.environ.get('DASHBOARD_CLIENT_QUEUE', '1000'))  # Events buffered per client
+    DASHBOARD_HISTORY_SIZE = int(os.environ.get('DASHBOARD_HISTORY_SIZE', '1000'))  # Events replayed on reconnect
+    DASHBOARD_HEARTBEAT_INTERVAL = float(os.environ.get('DASHBOARD_HEARTBEAT_INTERVAL', '15'))  # Seconds
+    DASHBOARD_AGGREGATE_INTERVAL = float(os.environ.get('DASHBOARD_AGGREGATE_INTERVAL', '1'))  # Seconds between aggregate pushes
+    # A single worker sees every change through the signals; with several (WEB_CONCURRENCY, as in
+    # gunicorn.conf.py) each re-reads the users table this often to pick up the others' changes
+    DASHBOARD_RESYNC_INTERVAL = float(os.environ.get(
+        'DASHBOARD_RESYNC_INTERVAL', '60' if int(os.environ.get('WEB_CONCURRENCY', '1')) > 1 else '0'))  # Seconds, 0 disables
+
+    # Desk lookup of approved users via /users/search
+    SEARCH_DEFAULT_LIMIT = int(os.environ.get('SEARCH_DEFAULT_LIMIT', '10'))
+    SEARCH_MAX_LIMIT = int(os.environ.get('SEARCH_MAX_LIMIT', '50'))
+
+    # Offline scanner uploads to /qr_codes/scan/batch
+    SCAN_BATCH_MAX_SIZE = int(os.environ.get('SCAN_BATCH_MAX_SIZE', '1000'))
+
+    # Page size for /users/pending
+    PENDING_PAGE_SIZE = int(os.environ.get('PENDING_PAGE_SIZE', '100'))
+    PENDING_PAGE_MAX_SIZE = int(os.environ.get('PENDING_PAGE_MAX_SIZE', '1000'))
+
+    # Streaming exports at /users/export
+    EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '1000'))  # Users per query while streaming
+
+    # Signed QR payloads (HMAC with SECRET_KEY); unsigned codes stay valid while QR_ACCEPT_UNSIGNED is on
+    EVENT_ID = os.environ.get('EVENT_ID', 'iftar')
+    QR_SIGNING_ENABLED = os.environ.get('QR_SIGNING_ENABLED', 'true').lower() == 'true'
+    QR_ACCEPT_UNSIGNED = os.environ.get('QR_ACCEPT_UNSIGNED', 'true').lower() == 'true'
+
+    # QR rendering: smaller box size/border or 'svg' output mean fewer bytes per user
+    QR_BOX_SIZE = int(os.environ.get('QR_BOX_SIZE', '10'))
+    QR_BORDER = int(os.environ.get('QR_BORDER', '4'))
+    QR_IMAGE_FORMAT = os.environ.get('QR_IMAGE_FORMAT', 'png')  # 'png' or 'svg'
+    QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', '1024'))  # Rendered images kept in memory
+    QR_CACHE_DIR = os.environ.get('QR_CACHE_DIR')  # Optional on-disk cache tier
+
+    # QR images served by GET /qr_codes/<user_id>.png; with QR_STORAGE_UPLOAD_ENABLED off, approval
+    # messages link there instead of uploading to the qr_codes storage bucket
+    QR_STORAGE_UPLOAD_ENABLED = os.environ.get('QR_STORAGE_UPLOAD_ENABLED', 'true').lower() == 'true'
+    QR_PUBLIC_BASE_URL = os.environ.get('QR_PUBLIC_BASE_URL')  # e.g. https://api.example.com; defaults to the request host
+    QR_HTTP_MAX_AGE = int(os.environ.get('QR_HTTP_MAX_AGE', '604800'))  # Seconds clients and proxies may cache an image
+
+    # Bulk approval via /users/approve/batch
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', '86400'))  # Seconds a /users/register key is remembered
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '500'))  # Rows per insert in /users/import
+    IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', '50000'))
+    APPROVE_BATCH_MAX_SIZE = int(os.environ.get('APPROVE_BATCH_MAX_SIZE', '500'))
+    QR_RENDER_PROCESSES = int(os.environ.get('QR_RENDER_PROCESSES', str(os.cpu_count() or 2)))
+    QR_UPLOAD_CONCURRENCY = int(os.environ.get('QR_UPLOAD_CONCURRENCY', '8'))
+
+    # Messaging transport: 'selenium' (WhatsApp Web), 'http' (WhatsApp Cloud API) or 'fake'
+    MESSAGING_TRANSPORT = os.environ.get('MESSAGING_TRANSPORT', 'selenium')
+    WHATSAPP_API_URL = os.environ.get('WHATSAPP_API_URL', 'https://graph.facebook.com/v17.0')
+    WHATSAPP_API_TOKEN = os.environ.get('WHATSAPP_API_TOKEN')
+    WHATSAPP_PHONE_NUMBER_ID = os.environ.get('WHATSAPP_PHONE_NUMBER_ID')
+    MESSAGING_HTTP_CONCURRENCY = int(os.environ.get('MESSAGING_HTTP_CONCURRENCY', '4'))
+    MESSAGING_HTTP_TIMEOUT = float(os.environ.get('MESSAGING_HTTP_TIMEOUT', '10'))  # Seconds
+    FAKE_TRANSPORT_LATENCY = float(os.environ.get('FAKE_TRANSPORT_LATENCY', '0'))  # Seconds
+    FAKE_TRANSPORT_START_DELAY = float(os.environ.get('FAKE_TRANSPORT_START_DELAY', '0'))  # Seconds, simulates a browser start
+
+    # WhatsApp Web sessions; each gets its own Chrome profile and cookie file
+    WHATSAPP_SESSIONS = int(os.environ.get('WHATSAPP_SESSIONS', '1'))
+    WHATSAPP_PROFILE_DIR = os.environ.get('WHATSAPP_PROFILE_DIR', 'whatsapp_profiles')
+    WHATSAPP_SESSION_RATE_PER_MINUTE = float(os.environ.get('WHATSAPP_SESSION_RATE_PER_MINUTE', '7'))
+    WHATSAPP_HEALTH_CHECK_INTERVAL = float(os.environ.get('WHATSAPP_HEALTH_CHECK_INTERVAL', '60'))  # Seconds
+    WHATSAPP_LOGIN_TIMEOUT = float(os.environ.get('WHATSAPP_LOGIN_TIMEOUT', '120'))  # Seconds to scan the login QR code
+
+    # WhatsApp outbox worker (rate limit applies across all sessions)
+    OUTBOX_DB_PATH = os.environ.get('OUTBOX_DB_PATH', 'outbox.db')
+    OUTBOX_RATE_PER_MINUTE = float(os.environ.get('OUTBOX_RATE_PER_MINUTE', '10'))
+    OUTBOX_BURST = int(os.environ.get('OUTBOX_BURST', '1'))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '5'))
+    OUTBOX_RETRY_BASE_DELAY = float(os.environ.get('OUTBOX_RETRY_BASE_DELAY', '30'))  # Seconds
+    OUTBOX_RETRY_MAX_DELAY = float(os.environ.get('OUTBOX_RETRY_MAX_DELAY', '1800'))  # Seconds
+    OUTBOX_CLAIM_LEASE_SECONDS = float(os.environ.get('OUTBOX_CLAIM_LEASE_SECONDS', '120'))  # Above the longest send; a crashed sender's message is requeued after this
+
+    # Background jobs (approvals), stored in the outbox file and run by every worker process
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))  # Threads per process
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))  # Per stage
+    JOB_RETRY_BASE_DELAY = float(os.environ.get('JOB_RETRY_BASE_DELAY', '5'))  # Seconds
+    JOB_RETRY_MAX_DELAY = float(os.environ.get('JOB_RETRY_MAX_DELAY', '300'))  # Seconds
+    JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', '300'))  # A crashed process's jobs are resumed after this
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))  # Seconds; picks up jobs queued by other processes
+
+    # Broadcast campaigns via /whatsapp/broadcasts; keep the rate below OUTBOX_RATE_PER_MINUTE so
+    # approval messages still get through while a broadcast runs
+    BROADCAST_RATE_PER_MINUTE = float(os.environ.get('BROADCAST_RATE_PER_MINUTE', '6'))
+    BROADCAST_PAGE_SIZE = int(os.environ.get('BROADCAST_PAGE_SIZE', '200'))  # Recipients fetched per query
+    BROADCAST_MAX_IN_FLIGHT = int(os.environ.get('BROADCAST_MAX_IN_FLIGHT', '5'))  # Campaign messages waiting in the outbox
+    BROADCAST_POLL_INTERVAL = float(os.environ.get('BROADCAST_POLL_INTERVAL', '5'))  # Seconds
+
     def __init__(self):
         # Validate environment variables
         required_vars = ['SUPABASE_URL', 'SUPABASE_KEY', 'SECRET_KEY']
@@ -1,56 +1,422 @@
-from flask import current_app
+from flask import current_app, g, has_app_context
+from .utils.metrics import timed
+from .utils.registrations import normalize_phone_number
+from .utils.ttl_cache import TTLCache
+from .backends.base import DuplicateRecordError
+import threading
+import time
 import logging
+import uuid
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def get_user_by_id(user_id):
-    supabase = current_app.supabase
+# All functions go through current_app.db, the storage backend selected by
+# DATABASE_BACKEND (see app.backends)
+
+
+class _Batch:
+    def __init__(self):
+        self.user_ids = set()
+        self.columns = set()  # None once any caller asks for every column
+        self.closed = False
+        self.done = threading.Event()
+        self.rows = None
+        self.error = None
+
+    def add(self, user_ids, columns):
+        self.user_ids.update(user_ids)
+        if columns is None or self.columns is None:
+            self.columns = None
+        else:
+            self.columns |= columns
+
+
+class UserLoader:
+    """Batched, cached lookups of users by ID (current_app.user_loader).
+
+    A lookup is answered from, in order: a memo on ``flask.g`` for the rest of
+    the request, a short-TTL cache shared by the worker's threads (entries are
+    dropped on writes and on the user signals), and the database. Misses that
+    arrive within ``batch_window`` seconds of each other, from any request in
+    the worker, are merged into one ``in_`` query for the union of the columns
+    asked for; a miss with no other lookup in flight queries at once. Reads are retried with exponential backoff on errors the store
+    reports as transient.
+    """
+
+    def __init__(self, store, cache_ttl=2.0, cache_size=10000, batch_window=0.002, max_batch_size=200,
+                 retry_attempts=3, retry_base_delay=0.1):
+        self.store = store
+        self.cache = TTLCache(cache_ttl, cache_size)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_base_delay = retry_base_delay
+        self._pending = None
+        self._fetching = 0  # Lookups between a miss and their rows arriving
+        self._lock = threading.Lock()
+        self._counts = {'lookups': 0, 'memo_hits': 0, 'cache_hits': 0, 'joined_batches': 0, 'queries': 0, 'retries': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    @staticmethod
+    def _memo():
+        if not has_app_context():
+            return None
+        if '_user_memo' not in g:
+            g._user_memo = {}
+        return g._user_memo
+
+    def load_many(self, user_ids, columns='*', fresh=False):
+        """Returns {user_id: row} for the users that exist, each row with the
+        requested ``columns`` (a select list or ``'*'``). ``fresh`` skips the
+        memo and the cache, for reads that decide a write."""
+        wanted = None if columns.strip() == '*' else {column.strip() for column in columns.split(',')}
+        memo = self._memo()
+        found, missing = {}, []
+        for user_id in dict.fromkeys(user_ids):
+            self._count('lookups')
+            if not fresh:
+                entry = memo.get(user_id) if memo is not None else None
+                if entry is not None and _has_columns(entry, wanted):
+                    self._count('memo_hits')
+                    found[user_id] = _project(entry[0], wanted)
+                    continue
+                entry = self.cache.get(user_id)
+                if entry is not None and _has_columns(entry, wanted):
+                    self._count('cache_hits')
+                    found[user_id] = _project(entry[0], wanted)
+                    if memo is not None:
+                        memo[user_id] = entry
+                    continue
+            missing.append(user_id)
+
+        if missing:
+            rows, complete = self._fetch(missing, wanted)
+            for user_id, row in rows.items():
+                # Entries remember whether the row has every column, i.e. can answer a '*' lookup
+                entry = (row, complete)
+                if memo is not None:
+                    memo[user_id] = entry
+                self.cache.set(user_id, entry)
+                found[user_id] = _project(row, wanted)
+        return found
+
+    def _fetch(self, user_ids, wanted):
+        if self.batch_window <= 0 or len(user_ids) >= self.max_batch_size:
+            return self._query(user_ids, wanted), wanted is None
+
+        with self._lock:
+            self._fetching += 1
+            batch = self._pending
+            leader = batch is None or batch.closed
+            if leader:
+                batch = self._pending = _Batch()
+            batch.add(user_ids, wanted)
+            if len(batch.user_ids) >= self.max_batch_size:
+                batch.closed = True
+                self._pending = None
+            # Alone there is nobody to wait for; with other lookups in flight, more are likely to follow
+            wait = leader and not batch.closed and self._fetching > 1
+
+        try:
+            if leader:
+                if wait:
+                    # Give lookups from other requests in this worker a moment to join the query
+                    time.sleep(self.batch_window)
+                with self._lock:
+                    batch.closed = True
+                    if self._pending is batch:
+                        self._pending = None
+                try:
+                    batch.rows = self._query(batch.user_ids, batch.columns)
+                except Exception as e:
+                    batch.error = e
+                finally:
+                    batch.done.set()
+            else:
+                self._count('joined_batches')
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._fetching -= 1
+
+        if batch.error is not None:
+            raise batch.error
+        rows = {user_id: batch.rows[user_id] for user_id in user_ids if user_id in batch.rows}
+        return rows, batch.columns is None
+
+    def _query(self, user_ids, wanted):
+        columns = '*' if wanted is None else ', '.join(sorted(wanted | {'user_id'}))
+        delay = self.retry_base_delay
+        for attempt in range(1, self.retry_attempts + 1):
+            try:
+                rows = self.store.get_users(list(user_ids), columns)
+                self._count('queries')
+                return {row['user_id']: row for row in rows}
+            except Exception as e:
+                if attempt == self.retry_attempts or not self.store.is_transient(e):
+                    raise
+                self._count('retries')
+                logger.warning(f"Transient error fetching {len(user_ids)} users (attempt {attempt}), "
+                               f"retrying in {delay:.2f}s: {str(e)}")
+                time.sleep(delay)
+                delay *= 2
+
+    def invalidate(self, user_id):
+        self.cache.invalidate(user_id)
+        memo = self._memo()
+        if memo is not None:
+            memo.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        # Each lookup would have been one request without the memo, cache and batching
+        return {**counts, 'round_trips_saved': counts['lookups'] - counts['queries'],
+                'cached_users': self.cache.stats()['entries']}
+
+
+def _has_columns(entry, wanted):
+    row, complete = entry
+    return complete or (wanted is not None and wanted <= row.keys())
+
+
+def _project(row, wanted):
+    # A copy, so callers can modify what they get without touching the cache
+    if wanted is None:
+        return dict(row)
+    return {column: row[column] for column in wanted}
+
+
+def connect_loader_signals(app, loader):
+    from .signals import user_approved, user_rejected, user_checked_in
+
+    # Writes made outside this module (roster write-back, other code paths) announce themselves here
+    def on_change(sender, user, **extra):
+        loader.invalidate(user['user_id'])
+
+    for signal in (user_approved, user_rejected, user_checked_in):
+        signal.connect(on_change, sender=app, weak=False)
+
+
+def _invalidate(*user_ids):
+    loader = getattr(current_app, 'user_loader', None)
+    if loader is not None:
+        for user_id in user_ids:
+            loader.invalidate(user_id)
+
+def _count_change():
+    # Writes that can change the pending list (see ChangeCounter); check-ins only touch approved users
+    changes = getattr(current_app, 'users_changes', None)
+    if changes is not None:
+        changes.bump()
+
+@timed('database')
+def get_user_by_id(user_id, columns='*', fresh=False):
+    # Malformed IDs cannot match; with Supabase they would fail the whole in_() query
+    if not _is_uuid(user_id):
+        return None
     try:
-        response = supabase.table('users').select('*').eq('user_id', user_id).execute()
-        user = response.data[0] if response.data else None
-        logger.debug(f"User fetched: {user_id if user else 'Not found'}")
+        user = current_app.user_loader.load_many([user_id], columns, fresh).get(user_id)
+        logger.debug("User fetched: %s", user_id if user else 'Not found')
         return user
     except Exception as e:
         logger.error(f"Error fetching user by ID {user_id}: {str(e)}")
         raise
 
-def get_pending_users():
-    supabase = current_app.supabase
+def _is_uuid(value):
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+@timed('database')
+def get_users_by_ids(user_ids, columns='*', fresh=False):
+    # Malformed IDs cannot match and would make the whole in_() query fail
+    valid_ids = [user_id for user_id in user_ids if _is_uuid(user_id)]
+    if not valid_ids:
+        return []
+    try:
+        users = list(current_app.user_loader.load_many(valid_ids, columns, fresh).values())
+        logger.debug("Fetched %s of %s users by ID", len(users), len(user_ids))
+        return users
+    except Exception as e:
+        logger.error(f"Error fetching {len(user_ids)} users by ID: {str(e)}")
+        raise
+
+@timed('database')
+def list_users(columns='*', filters=None, after=None, limit=None):
+    # Keyset pagination on (created_at, user_id): `after` is the pair from the last row of the previous page
+    try:
+        users = current_app.db.list_users(columns, filters=filters, after=after, limit=limit)
+        logger.debug("Listed %s users", len(users))
+        return users
+    except Exception as e:
+        logger.error(f"Error listing users: {str(e)}")
+        raise
+
+@timed('database')
+def get_pending_users(columns='*', batch=None, branch=None, after=None, limit=None):
+    filters = {'approval_status': 'pending'}
+    if batch:
+        filters['batch'] = batch
+    if branch:
+        filters['branch'] = branch
     try:
-        response = supabase.table('users').select('*').eq('approval_status', 'pending').execute()
-        logger.debug(f"Fetched {len(response.data)} pending users")
-        return response.data
+        users = current_app.db.list_users(columns, filters=filters, after=after, limit=limit)
+        logger.debug("Fetched %s pending users", len(users))
+        return users
     except Exception as e:
         logger.error(f"Error fetching pending users: {str(e)}")
         raise
 
+@timed('database')
+def create_user(fields):
+    try:
+        user = current_app.db.insert_user(fields)
+        _count_change()
+        logger.info("User created: %s", user['user_id'])
+        return user
+    except DuplicateRecordError:
+        # Expected when a registration is retried; the caller resolves it
+        logger.info("Duplicate user not created: %s", fields.get('transaction_id'))
+        raise
+    except Exception as e:
+        logger.error(f"Error creating user: {str(e)}")
+        raise
+
+@timed('database')
+def create_users(rows):
+    # One round trip for the whole chunk; a duplicate fails all of it
+    try:
+        users = current_app.db.insert_users(rows)
+        _count_change()
+        logger.info("Created %s users", len(users))
+        return users
+    except Exception as e:
+        logger.error(f"Error creating {len(rows)} users: {str(e)}")
+        raise
+
+@timed('database')
+def find_registration(transaction_id, phone_number):
+    # Database-side duplicate lookup, used when an insert hits a unique constraint.
+    # Phone numbers are stored as entered, so try each accepted spelling of the number
+    try:
+        rows = current_app.db.list_users('user_id, phone_number, transaction_id',
+                                         filters={'transaction_id': transaction_id}, limit=1)
+        if rows:
+            return rows[0], 'transaction_id'
+        national = normalize_phone_number(phone_number)
+        for candidate in dict.fromkeys([phone_number, f'0{national}', f'+88{national}', f'+880{national}']):
+            rows = current_app.db.list_users('user_id, phone_number, transaction_id',
+                                             filters={'phone_number': candidate}, limit=1)
+            if rows:
+                return rows[0], 'phone_number'
+        return None, None
+    except Exception as e:
+        logger.error(f"Error looking up registration {transaction_id}: {str(e)}")
+        raise
+
+@timed('database')
+def update_user(user_id, fields):
+    try:
+        user = current_app.db.update_user(user_id, fields)
+        _invalidate(user_id)
+        _count_change()
+        logger.debug("User %s updated: %s", user_id, ', '.join(fields))
+        return user
+    except Exception as e:
+        logger.error(f"Error updating user {user_id}: {str(e)}")
+        raise
+
+@timed('database')
 def approve_user(user_id):
-    supabase = current_app.supabase
     try:
-        supabase.table('users').update({'approval_status': 'approved'}).eq('user_id', user_id).execute()
-        logger.info(f"User {user_id} approved")
+        current_app.db.update_user(user_id, {'approval_status': 'approved'})
+        _invalidate(user_id)
+        _count_change()
+        logger.info("User %s approved", user_id)
     except Exception as e:
         logger.error(f"Error approving user {user_id}: {str(e)}")
         raise
 
+@timed('database')
+def approve_users(qr_code_urls, from_statuses=('pending',)):
+    # Conditional: only users whose approval_status is still in from_statuses are approved, so a
+    # concurrent reject or check-in is never overwritten. Returns the rows that changed
+    try:
+        users = current_app.db.approve_users(qr_code_urls, from_statuses)
+        _invalidate(*qr_code_urls)
+        if users:
+            _count_change()
+        logger.info("Approved %s of %s users", len(users), len(qr_code_urls))
+        return users
+    except Exception as e:
+        logger.error(f"Error approving {len(qr_code_urls)} users: {str(e)}")
+        # Some of the users' URLs may have been written before the failure
+        _count_change()
+        raise
+
+@timed('database')
+def reject_user(user_id):
+    # Conditional, like approve_users: a user approved in the meantime stays approved.
+    # Returns the rejected row, or None if the user was no longer pending
+    try:
+        user = current_app.db.reject_user(user_id)
+        _invalidate(user_id)
+        if user:
+            _count_change()
+            logger.info("User %s rejected", user_id)
+        return user
+    except Exception as e:
+        logger.error(f"Error rejecting user {user_id}: {str(e)}")
+        raise
+
+@timed('database')
 def check_in_user(user_id):
-    supabase = current_app.supabase
+    # Conditional update: only flips a row that is still approved and not checked in,
+    # so two gates scanning the same code cannot both succeed
     try:
-        supabase.table('users').update({'check_in_status': 'checked_in'}).eq('user_id', user_id).execute()
-        logger.info(f"User {user_id} checked in")
+        checked_in = current_app.db.check_in_user(user_id)
+        _invalidate(user_id)
+        if checked_in:
+            logger.info("User %s checked in", user_id)
+        return checked_in
     except Exception as e:
         logger.error(f"Error checking in user {user_id}: {str(e)}")
         raise
 
-def get_admin_by_email(email):
-    supabase = current_app.supabase
+@timed('database')
+def check_in_users(user_ids):
+    # Set-based version of check_in_user; returns the IDs that were actually flipped
     try:
-        response = supabase.table('admins').select('*').eq('email', email).execute()
-        admin = response.data[0] if response.data else None
-        logger.debug(f"Admin fetched: {email if admin else 'Not found'}")
+        checked_in = current_app.db.check_in_users(user_ids)
+        _invalidate(*checked_in)
+        logger.info("Checked in %s of %s users", len(checked_in), len(user_ids))
+        return checked_in
+    except Exception as e:
+        logger.error(f"Error checking in {len(user_ids)} users: {str(e)}")
+        raise
+
+@timed('database')
+def get_admin_by_email(email):
+    # Served from current_app.admin_cache for ADMIN_CACHE_TTL seconds; misses are not cached
+    admin = current_app.admin_cache.get(email)
+    if admin is not None:
         return admin
+    try:
+        admin = current_app.db.get_admin_by_email(email)
+        logger.debug("Admin fetched: %s", email if admin else 'Not found')
     except Exception as e:
         logger.error(f"Error fetching admin by email {email}: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+    if admin:
+        current_app.admin_cache.set(email, admin)
+    return admin
+
+def invalidate_admin(email=None):
+    # Drop one cached admin record, or all of them; call after changing admins
+    current_app.admin_cache.invalidate(email)
\ No newline at end of file
@@ -0,0 +1,40 @@
+from flask import Blueprint, request, jsonify, current_app, Response
+from werkzeug.exceptions import abort
+from flask_jwt_extended import jwt_required
+import logging
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
+
+# Current aggregates by batch, branch, approval and check-in status (admin-only)
+@bp.route('/summary', methods=['GET'])
+@jwt_required()
+def dashboard_summary():
+    return jsonify(current_app.dashboard.snapshot()), 200
+
+# Live feed of registrations, approvals, rejections and check-ins (admin-only).
+# EventSource cannot set headers, so the token may also be passed as ?jwt=...
+@bp.route('/stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+def dashboard_stream():
+    dashboard = current_app.dashboard
+    config = current_app.config
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscriber = dashboard.subscribe(last_event_id)
+    if subscriber is None:
+        return abort(503, description='Too many dashboard connections')
+    logger.info("Dashboard stream opened (%s subscribers)", dashboard.stats()['subscribers'])
+
+    def generate():
+        try:
+            yield from subscriber.events(config['DASHBOARD_HEARTBEAT_INTERVAL'], config['DASHBOARD_AGGREGATE_INTERVAL'])
+        finally:
+            # Runs when the client disconnects and the server closes the generator
+            dashboard.unsubscribe(subscriber)
+            logger.info("Dashboard stream closed")
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Stop nginx from buffering the stream
+    })
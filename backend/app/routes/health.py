@@ -0,0 +1,25 @@
+from flask import Blueprint, jsonify, current_app
+import time
+
+bp = Blueprint('health', __name__)
+
+# Liveness probe: the process is up and serving; reports the state of every subsystem
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    subsystems = current_app.subsystems
+    return jsonify({
+        'status': 'ok',
+        'ready': subsystems.is_ready(),
+        'uptime_seconds': round(time.time() - subsystems.created_at, 3),
+        'subsystems': subsystems.report(),
+    }), 200
+
+# Readiness probe: 503 until the subsystems scans and registrations need are up
+@bp.route('/readyz', methods=['GET'])
+def readyz():
+    subsystems = current_app.subsystems
+    ready = subsystems.is_ready()
+    return jsonify({
+        'status': 'ready' if ready else 'starting',
+        'subsystems': {name: status['state'] for name, status in subsystems.report().items()},
+    }), 200 if ready else 503
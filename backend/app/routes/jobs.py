@@ -0,0 +1,26 @@
+from flask import Blueprint, jsonify, current_app
+from werkzeug.exceptions import abort
+from flask_jwt_extended import jwt_required
+import logging
+
+logger = logging.getLogger(__name__)
+
+bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+# Status and per-stage progress of a background job, e.g. an approval (admin-only)
+@bp.route('/<job_id>', methods=['GET'])
+@jwt_required()
+def job_status(job_id):
+    job = current_app.jobs.get(job_id)
+    if job is None:
+        return abort(404, description='Job not found')
+    return jsonify(job), 200
+
+# Run a failed job again from the stage that failed (admin-only)
+@bp.route('/<job_id>/retry', methods=['POST'])
+@jwt_required()
+def retry_job(job_id):
+    if not current_app.jobs.retry(job_id):
+        return abort(409, description='Job has not failed')
+    logger.info(f"Job {job_id} re-queued")
+    return jsonify(current_app.jobs.get(job_id)), 202
@@ -1,34 +1,263 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response
+from flask_jwt_extended import jwt_required
 from werkzeug.exceptions import abort
-from ..database import get_user_by_id, check_in_user
+from ..utils.qr_signing import InvalidQRPayload
+from ..utils.qr_code import generate_qr_code_image, qr_render_options, qr_code_payload, qr_code_etag, QR_CONTENT_TYPES
+from ..signals import user_checked_in, send_signal
+from ..database import get_user_by_id, get_users_by_ids, check_in_user, check_in_users
+from datetime import datetime, timezone
+import uuid
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('qr_code', __name__, url_prefix='/qr_codes')
 
+def _parse_scanned_at(value):
+    # Epoch seconds (or milliseconds) or an ISO 8601 string; naive times are taken as UTC
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # As seconds, values this large would be past the year 5138, so they are milliseconds
+        seconds = value / 1000 if abs(value) >= 1e11 else value
+        try:
+            return datetime.fromtimestamp(seconds, tz=timezone.utc)
+        except (OverflowError, OSError) as e:
+            raise ValueError(str(e))
+    if not isinstance(value, str):
+        raise ValueError(f'Unsupported scanned_at {value!r}')
+    text = value.strip()
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    scanned_at = datetime.fromisoformat(text)
+    return scanned_at if scanned_at.tzinfo else scanned_at.replace(tzinfo=timezone.utc)
+
 @bp.route('/scan', methods=['POST'])
 def scan_qr_code():
     data = request.get_json()
-    user_id = data.get('user_id')
+    # Scanners post the code contents; older clients send it as user_id
+    qr_data = data.get('qr_data') or data.get('user_id')
 
-    if not user_id:
+    if not qr_data:
         return abort(400, description='Missing user_id')
 
-    user = get_user_by_id(user_id)
+    # Reject forged and wrong-event codes before touching the roster or database
+    try:
+        user_id = current_app.qr_signer.verify(str(qr_data))
+    except InvalidQRPayload as e:
+        logger.warning(f"Rejected QR code: {str(e)}")
+        return abort(400, description=f'Invalid QR code: {str(e)}')
+
+    return _check_in(user_id)
+
+# Manual check-in at the desk for attendees found with /users/search (admin-only)
+@bp.route('/check_in/<user_id>', methods=['POST'])
+@jwt_required()
+def desk_check_in(user_id):
+    logger.info("Desk check-in requested for %s", user_id)
+    return _check_in(user_id)
+
+# Check-in logic shared by QR scans and desk check-ins
+def _check_in(user_id):
+    # Answer from the in-memory roster when it is enabled; users it does not
+    # know about fall through to the database checks below
+    roster = getattr(current_app, 'roster', None)
+    if roster is not None:
+        result = roster.check_in(user_id)
+        if result == 'already_checked_in':
+            return abort(400, description='User already checked in')
+        if result == 'checked_in':
+            send_signal(user_checked_in, current_app._get_current_object(), user={'user_id': user_id})
+            logger.info("User checked in: %s", user_id)
+            return jsonify({'message': 'User checked in successfully'}), 200
+
+    # Single round trip: the conditional update only succeeds for an approved user
+    # who is not checked in yet
+    try:
+        checked_in = check_in_user(user_id)
+    except Exception as e:
+        logger.error(f"Error checking in user {user_id}: {str(e)}")
+        return abort(500, description=f'Error checking in user: {str(e)}')
+
+    if checked_in:
+        if roster is not None:
+            roster.add(user_id, checked_in=True)
+        send_signal(user_checked_in, current_app._get_current_object(), user={'user_id': user_id})
+        logger.info("User checked in: %s", user_id)
+        return jsonify({'message': 'User checked in successfully'}), 200
+
+    # Nothing was updated; look the user up to report why
+    user = get_user_by_id(user_id, 'user_id, approval_status, check_in_status')
     if not user:
         return abort(404, description='User not found')
     if user['approval_status'] != 'approved':
         return abort(400, description='User not approved')
-    if user['check_in_status'] == 'checked_in':
-        return abort(400, description='User already checked in')
+    return abort(400, description='User already checked in')
+
+# Replay a backlog of scans from an offline scanner
+@bp.route('/scan/batch', methods=['POST'])
+def scan_qr_code_batch():
+    data = request.get_json()
+    scans = data.get('scans') if isinstance(data, dict) else None
+
+    if not isinstance(scans, list) or not scans:
+        return abort(400, description='Missing scans')
+    if len(scans) > current_app.config['SCAN_BATCH_MAX_SIZE']:
+        return abort(400, description=f"Too many scans (max {current_app.config['SCAN_BATCH_MAX_SIZE']})")
+
+    signer = current_app.qr_signer
+    items, scan_times = [], []
+    for index, scan in enumerate(scans):
+        # Accept both {"user_id", "scanned_at", "gate_id"} objects and [user_id, scanned_at, gate_id] tuples;
+        # user_id carries the scanned code contents, signed or not
+        if isinstance(scan, dict):
+            qr_data, scanned_at, gate_id = scan.get('user_id'), scan.get('scanned_at'), scan.get('gate_id')
+        elif isinstance(scan, (list, tuple)) and len(scan) == 3:
+            qr_data, scanned_at, gate_id = scan
+        else:
+            return abort(400, description=f'Invalid scan at index {index}')
+        if not qr_data:
+            return abort(400, description=f'Missing user_id at index {index}')
+        item = {'user_id': str(qr_data), 'scanned_at': scanned_at, 'gate_id': gate_id, 'result': None}
+        try:
+            item['user_id'] = signer.verify(str(qr_data))
+            scan_times.append(_parse_scanned_at(scanned_at))
+        except (InvalidQRPayload, ValueError):
+            item['result'] = 'invalid'
+            scan_times.append(None)
+        items.append(item)
 
+    # The earliest scan of a code wins the check-in; later ones are duplicates. Scans without a time go last.
+    ordered = [items[index] for index in sorted(
+        (index for index, item in enumerate(items) if item['result'] is None),
+        key=lambda index: (scan_times[index] is None, scan_times[index]))]
+
+    roster = getattr(current_app, 'roster', None)
+    unresolved = []
+    for item in ordered:
+        result = roster.check_in(item['user_id']) if roster is not None else None
+        if result == 'checked_in':
+            item['result'] = 'checked_in'
+        elif result == 'already_checked_in':
+            item['result'] = 'duplicate'
+        else:
+            unresolved.append(item)
+
+    if unresolved:
+        user_ids = list({item['user_id'] for item in unresolved})
+        try:
+            users = {user['user_id']: user for user in
+                     get_users_by_ids(user_ids, 'user_id, approval_status, check_in_status')}
+            checked_in = check_in_users([
+                user_id for user_id, user in users.items()
+                if user['approval_status'] == 'approved' and user['check_in_status'] == 'not_checked_in'
+            ]) if users else set()
+        except Exception as e:
+            logger.error(f"Error processing scan batch of {len(items)}: {str(e)}")
+            return abort(500, description=f'Error processing scan batch: {str(e)}')
+
+        claimed = set()
+        for item in unresolved:
+            user = users.get(item['user_id'])
+            if user is None:
+                item['result'] = 'unknown'
+            elif user['approval_status'] != 'approved':
+                item['result'] = 'not_approved'
+            elif item['user_id'] in checked_in and item['user_id'] not in claimed:
+                claimed.add(item['user_id'])
+                item['result'] = 'checked_in'
+            else:
+                item['result'] = 'duplicate'
+        if roster is not None:
+            for user_id in checked_in:
+                roster.add(user_id, checked_in=True)
+
+    app = current_app._get_current_object()
+    summary = {}
+    for item in items:
+        summary[item['result']] = summary.get(item['result'], 0) + 1
+        if item['result'] == 'checked_in':
+            send_signal(user_checked_in, app, user={'user_id': item['user_id']})
+    logger.info("Processed scan batch of %s: %s", len(items), summary)
+    return jsonify({'results': items, 'summary': summary}), 200
+
+# Roster for scanners that validate codes offline (admin-only). Without ?since, or with a version
+# this server does not know, a full snapshot; with ?since=<version>, only the users changed after it.
+# NDJSON: a {"version", "snapshot", "count"} header line, then one ["user_id", state] line per user
+# with state 'a' (approved), 'c' (checked in) or 'r' (removed); gzip'd when the client accepts it
+@bp.route('/roster', methods=['GET'])
+@jwt_required()
+def roster_feed():
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return abort(400, description='since must be a roster version')
+
+    compress = 'gzip' in request.accept_encodings
     try:
-        check_in_user(user_id)
-        logger.info(f"User checked in: {user_id}")
-        return jsonify({'message': 'User checked in successfully'}), 200
+        version, snapshot, body = current_app.roster_feed.encode(since, compress=compress)
     except Exception as e:
-        logger.error(f"Error checking in user {user_id}: {str(e)}")
-        return abort(500, description=f'Error checking in user: {str(e)}')
\ No newline at end of file
+        logger.error(f"Error building roster feed since {since}: {str(e)}")
+        return abort(500, description=f'Error building roster feed: {str(e)}')
+
+    response = Response(body, mimetype='application/x-ndjson')
+    response.headers['X-Roster-Version'] = str(version)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    logger.info("Roster %s to version %s sent (%s bytes)", 'snapshot' if snapshot else f'delta from {since}',
+                version, len(body))
+    return response
+
+# Check-in roster sync status (admin-only)
+@bp.route('/roster/status', methods=['GET'])
+@jwt_required()
+def roster_status():
+    roster = getattr(current_app, 'roster', None)
+    if roster is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **roster.stats()}), 200
+
+# QR code image of an approved user, rendered on demand; approval messages link here
+# when QR_STORAGE_UPLOAD_ENABLED is off
+@bp.route('/<user_id>.<image_format>', methods=['GET'])
+def qr_code_image(user_id, image_format):
+    if image_format not in QR_CONTENT_TYPES:
+        return abort(404, description='Unsupported image format')
+    try:
+        uuid.UUID(user_id)
+    except ValueError:
+        return abort(404, description='User not found')
+
+    # Approved users are in the desk search index; other workers' approvals are looked up once
+    index = current_app.attendee_index
+    if user_id not in index:
+        try:
+            user = get_user_by_id(user_id)
+        except Exception as e:
+            logger.error(f"Error fetching user {user_id} for QR code image: {str(e)}")
+            return abort(500, description=f'Error fetching user: {str(e)}')
+        if not user or user['approval_status'] != 'approved':
+            return abort(404, description='User not found')
+        if index.loaded:
+            index.add(user)
+
+    options = {**qr_render_options(), 'image_format': image_format}
+    payload = qr_code_payload(user_id)
+    etag = qr_code_etag(payload, **options)
+    if etag in request.if_none_match:
+        # Revalidation without rendering
+        response = Response(status=304)
+    else:
+        try:
+            image = generate_qr_code_image(payload, **options)
+        except Exception as e:
+            logger.error(f"Error rendering QR code image for {user_id}: {str(e)}")
+            return abort(500, description=f'Error generating QR code: {str(e)}')
+        response = Response(image, mimetype=QR_CONTENT_TYPES[image_format])
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['QR_HTTP_MAX_AGE']
+    return response
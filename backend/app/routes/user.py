@@ -1,126 +1,533 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, url_for, Response
 from werkzeug.exceptions import abort
 from flask_jwt_extended import jwt_required
-from ..database import get_user_by_id, approve_user, get_pending_users
-from ..utils.qr_code import generate_qr_code_image, upload_file_to_supabase, format_phone_number
-from ..utils.whatsapp import send_whatsapp_message
+from ..database import (get_user_by_id, get_users_by_ids, create_user, create_users, approve_users,
+                        reject_user as reject_pending_user, get_pending_users, find_registration)
+from ..utils.qr_code import (generate_qr_code_image, render_qr_code_images, upload_file_to_supabase, format_phone_number,
+                             qr_render_options, qr_code_payload, qr_code_file_name, qr_code_link, QR_CONTENT_TYPES)
+from ..utils.outbox import send_whatsapp_message
+from ..utils.registrations import normalize_phone_number, IdempotencyKeyReused
+from ..signals import user_approved, user_rejected, user_registered, send_signal
+from ..backends.base import USER_COLUMNS, DuplicateRecordError
+from ..utils.jobs import Stage, JobFailed
+from ..utils.export import EXPORT_FORMATS, EXPORT_FILTERS, export_users
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import base64
+import csv
+import hashlib
+import io
+import json
 import re
+import uuid
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('user', __name__, url_prefix='/users')
 
-# Register a new user
-@bp.route('/register', methods=['POST'])
-def register_user():
-    data = request.form
-    name = data.get('name')
-    batch = data.get('batch')
-    branch = data.get('branch')
-    phone_number = data.get('phone_number')
-    transaction_id = data.get('transaction_id')
+def _approval_message(user, qr_code_url):
+    return f"Dear {user['name']}, your registration for the iftar event has been approved. Please present your QR code at the entrance: {qr_code_url}"
 
-    if not all([name, batch, branch, phone_number, transaction_id]):
-        return abort(400, description='Missing required fields: name, batch, branch, phone_number, or transaction_id')
+REGISTRATION_FIELDS = ('name', 'batch', 'branch', 'phone_number', 'transaction_id')
+
+def _registration_fields(data):
+    # Shared by /register and /import; returns (fields, None) or (None, error message)
+    values = {field: (data.get(field) or '').strip() for field in REGISTRATION_FIELDS}
+    if not all(values.values()):
+        return None, 'Missing required fields: name, batch, branch, phone_number, or transaction_id'
 
     # Validate phone number (Bangladesh-specific)
-    if not re.match(r'^(0|\+88)\d{9,10}$', phone_number):
-        return abort(400, description='Invalid phone number format (e.g., 01712345678 or +8801712345678)')
+    if not re.match(r'^(0|\+88)\d{9,10}$', values['phone_number']):
+        return None, 'Invalid phone number format (e.g., 01712345678 or +8801712345678)'
+    try:
+        format_phone_number(values['phone_number'])
+    except ValueError as e:
+        return None, str(e)
+
+    return {**values, 'approval_status': 'pending', 'check_in_status': 'not_checked_in'}, None
+
+def _duplicate_registration(user_id, matched):
+    return {'message': 'User already registered', 'user_id': user_id, 'duplicate_of': matched}, 200
+
+# Register a new user. Retries are safe: an Idempotency-Key header replays the first
+# response, and a known transaction_id or phone number returns the existing user_id
+@bp.route('/register', methods=['POST'])
+def register_user():
+    fields, error = _registration_fields(request.form)
+    if error:
+        return abort(400, description=error)
 
-    supabase = request.app.supabase
+    index = current_app.registration_index
+    idempotency_key = request.headers.get('Idempotency-Key')
     try:
-        user = supabase.table('users').insert({
-            'name': name,
-            'batch': batch,
-            'branch': branch,
-            'phone_number': phone_number,
-            'transaction_id': transaction_id,
-            'approval_status': 'pending',
-            'check_in_status': 'not_checked_in'
-        }).execute()
-        logger.info(f"User registered: {user.data[0]['user_id']}")
-        return jsonify({'message': 'User registered successfully', 'user_id': user.data[0]['user_id']}), 201
+        with index.claim(fields, idempotency_key):
+            replayed = index.replay(idempotency_key, fields)
+            if replayed:
+                body, status = replayed
+                return jsonify(body), status
+
+            existing = index.find(fields)
+            if existing:
+                body, status = _duplicate_registration(*existing)
+                logger.info("Duplicate registration for transaction %s: %s", fields['transaction_id'], existing[0])
+            else:
+                try:
+                    user = create_user(fields)
+                    index.add(user)
+                    send_signal(user_registered, current_app._get_current_object(), user=user)
+                    body, status = {'message': 'User registered successfully', 'user_id': user['user_id']}, 201
+                    logger.info("User registered: %s", user['user_id'])
+                except DuplicateRecordError:
+                    # Registered through another process since this index was loaded
+                    user, matched = find_registration(fields['transaction_id'], fields['phone_number'])
+                    if user is None:
+                        raise
+                    index.add(user)
+                    body, status = _duplicate_registration(user['user_id'], matched)
+                    logger.info("Duplicate registration for transaction %s: %s", fields['transaction_id'], user['user_id'])
+            index.remember(idempotency_key, fields, body, status)
+            return jsonify(body), status
+    except IdempotencyKeyReused as e:
+        return abort(422, description=str(e))
     except Exception as e:
         logger.error(f"Error registering user: {str(e)}")
         return abort(500, description=f'Error registering user: {str(e)}')
 
-# Get all pending users (admin-only)
+def _insert_import_chunk(chunk, errors):
+    # One insert for the chunk; on a duplicate, retry row by row to find the offending rows
+    index = current_app.registration_index
+    app = current_app._get_current_object()
+    try:
+        users = create_users([fields for _, fields in chunk])
+        for user in users:
+            index.add(user)
+            send_signal(user_registered, app, user=user)
+        return len(users)
+    except DuplicateRecordError:
+        pass
+    except Exception as e:
+        errors.extend({'row': row, 'error': f'Insert failed: {str(e)}'} for row, _ in chunk)
+        return 0
+
+    imported = 0
+    for row, fields in chunk:
+        try:
+            user = create_user(fields)
+            index.add(user)
+            send_signal(user_registered, app, user=user)
+            imported += 1
+        except DuplicateRecordError:
+            errors.append({'row': row, 'error': 'Duplicate registration'})
+        except Exception as e:
+            errors.append({'row': row, 'error': f'Insert failed: {str(e)}'})
+    return imported
+
+# Bulk-register users from a CSV export, streamed row by row (admin-only)
+@bp.route('/import', methods=['POST'])
+@jwt_required()
+def import_users():
+    # Either a multipart "file" field (spooled to disk by Werkzeug) or a raw text/csv body
+    if 'file' in request.files:
+        stream = request.files['file'].stream
+    elif request.mimetype == 'text/csv':
+        stream = io.BufferedReader(request.stream)
+    else:
+        return abort(400, description='Upload the CSV as a "file" form field or send it as a text/csv body')
+
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    try:
+        header = [(column or '').strip().lower() for column in (reader.fieldnames or [])]
+    except (UnicodeDecodeError, csv.Error) as e:
+        return abort(400, description=f'Unreadable CSV: {str(e)}')
+    missing = [field for field in REGISTRATION_FIELDS if field not in header]
+    if missing:
+        return abort(400, description=f"Missing CSV columns: {', '.join(missing)}")
+    reader.fieldnames = header
+
+    chunk_size = current_app.config['IMPORT_CHUNK_SIZE']
+    max_rows = current_app.config['IMPORT_MAX_ROWS']
+    index = current_app.registration_index
+    errors, chunk, seen = [], [], set()
+    imported = rows = 0
+    try:
+        for record in reader:
+            if rows >= max_rows:
+                errors.append({'row': reader.line_num, 'error': f'Import stopped after {max_rows} rows'})
+                break
+            rows += 1
+            fields, error = _registration_fields(record)
+            if error:
+                errors.append({'row': reader.line_num, 'error': error})
+                continue
+            existing = index.find(fields)
+            if existing:
+                errors.append({'row': reader.line_num, 'error': f'Already registered ({existing[1]})',
+                               'user_id': existing[0]})
+                continue
+            keys = (('transaction_id', fields['transaction_id']),
+                    ('phone_number', normalize_phone_number(fields['phone_number'])))
+            repeated = next((field for field, key in keys if (field, key) in seen), None)
+            if repeated:
+                errors.append({'row': reader.line_num, 'error': f'Duplicate {repeated} in file'})
+                continue
+            seen.update(keys)
+            chunk.append((reader.line_num, fields))
+            if len(chunk) >= chunk_size:
+                imported += _insert_import_chunk(chunk, errors)
+                chunk = []
+    except (UnicodeDecodeError, csv.Error) as e:
+        errors.append({'row': reader.line_num, 'error': f'Unreadable CSV, import stopped: {str(e)}'})
+    if chunk:
+        imported += _insert_import_chunk(chunk, errors)
+
+    errors.sort(key=lambda error: error['row'])
+    logger.info(f"Imported {imported} of {rows} CSV rows ({len(errors)} errors)")
+    return jsonify({'imported': imported, 'failed': len(errors), 'rows': rows, 'errors': errors}), 200
+
+# Find approved users by phone number, its last digits or name, for manual check-in (admin-only)
+@bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_users():
+    query = (request.args.get('q') or '').strip()
+    if len(query) < 2:
+        return abort(400, description='Search query must be at least 2 characters')
+    try:
+        limit = int(request.args.get('limit', current_app.config['SEARCH_DEFAULT_LIMIT']))
+    except ValueError:
+        return abort(400, description='Invalid limit')
+    limit = max(1, min(limit, current_app.config['SEARCH_MAX_LIMIT']))
+
+    index = current_app.attendee_index
+    if not index.loaded:
+        return abort(503, description='Search index is still loading')
+    results = index.search(query, limit)
+    return jsonify({'results': results, 'count': len(results)}), 200
+
+def _encode_cursor(row):
+    raw = json.dumps([row['created_at'], row['user_id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _decode_cursor(cursor):
+    # The values end up inside a PostgREST filter expression, so only a real timestamp and UUID
+    # are accepted; anything else (quotes, commas, parentheses) would rewrite the filter
+    try:
+        created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at).isoformat(), str(uuid.UUID(user_id))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+# Get pending users, one keyset page at a time (admin-only)
 @bp.route('/pending', methods=['GET'])
 @jwt_required()
 def get_pending_users_route():
+    limit = request.args.get('limit', current_app.config['PENDING_PAGE_SIZE'], type=int)
+    if limit < 1 or limit > current_app.config['PENDING_PAGE_MAX_SIZE']:
+        return abort(400, description=f"limit must be between 1 and {current_app.config['PENDING_PAGE_MAX_SIZE']}")
+
+    columns = '*'
+    if request.args.get('columns'):
+        requested = [column.strip() for column in request.args['columns'].split(',') if column.strip()]
+        unknown = [column for column in requested if column not in USER_COLUMNS]
+        if unknown:
+            return abort(400, description=f"Unknown columns: {', '.join(unknown)}")
+        # The cursor needs the keyset columns
+        columns = ','.join(dict.fromkeys(requested + ['created_at', 'user_id']))
+
+    after = None
+    if request.args.get('cursor'):
+        after = _decode_cursor(request.args['cursor'])
+        if after is None:
+            return abort(400, description='Invalid cursor')
+
+    # The ETag is derived from the users change counter and the page asked for, read before the
+    # query, so an unchanged page is a bodiless 304 without touching the database
+    page = [request.args.get(name) for name in ('batch', 'branch', 'cursor')]
+    etag = hashlib.sha256(
+        json.dumps([current_app.users_changes.token(), columns, limit, *page]).encode('utf-8')
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+
     try:
-        users = get_pending_users()
-        logger.info(f"Fetched {len(users)} pending users")
-        return jsonify(users), 200
+        users = get_pending_users(columns, batch=request.args.get('batch'), branch=request.args.get('branch'),
+                                  after=after, limit=limit)
     except Exception as e:
         logger.error(f"Error fetching pending users: {str(e)}")
         return abort(500, description=f'Error fetching pending users: {str(e)}')
+    logger.info(f"Fetched {len(users)} pending users")
+
+    body = json.dumps(users, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if len(users) == limit:
+        cursor = _encode_cursor(users[-1])
+        response.headers['X-Next-Cursor'] = cursor
+        next_args = {**request.args.to_dict(), 'cursor': cursor}
+        response.headers['Link'] = f'<{url_for(request.endpoint, **next_args)}>; rel="next"'
+    return response
+
+# Stream every user, or those matching the filters, as CSV or NDJSON (admin-only).
+# Paged from the database as the client reads, and gzip'd when the client accepts it
+@bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_users_route():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return abort(400, description=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+    columns = list(USER_COLUMNS)
+    if request.args.get('columns'):
+        columns = list(dict.fromkeys(column.strip() for column in request.args['columns'].split(',') if column.strip()))
+        unknown = [column for column in columns if column not in USER_COLUMNS]
+        if unknown or not columns:
+            return abort(400, description=f"Unknown columns: {', '.join(unknown)}" if unknown else 'No columns')
+
+    filters = {}
+    for column, allowed in EXPORT_FILTERS.items():
+        value = request.args.get(column)
+        if not value:
+            continue
+        if allowed and value not in allowed:
+            return abort(400, description=f"{column} must be one of {', '.join(allowed)}")
+        filters[column] = value
+
+    compress = 'gzip' in request.accept_encodings
+    config = current_app.config
+    try:
+        body = export_users(current_app.db, columns, export_format, filters, compress,
+                            page_size=config['EXPORT_PAGE_SIZE'], retry_attempts=config['DB_READ_RETRY_ATTEMPTS'],
+                            retry_base_delay=config['DB_READ_RETRY_BASE_DELAY'])
+    except Exception as e:
+        logger.error(f"Error exporting users: {str(e)}")
+        return abort(500, description=f'Error exporting users: {str(e)}')
+    logger.info(f"Exporting users as {export_format} with filters {filters}")
+
+    file_name = f"users-{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    response = Response(body, mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename="{file_name}"',
+        'Cache-Control': 'no-store',
+        'Vary': 'Accept-Encoding',
+        'X-Accel-Buffering': 'no',  # Stop nginx from buffering the whole export
+    })
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 # Approve a user and send QR code via WhatsApp (admin-only)
 @bp.route('/approve/<user_id>', methods=['PATCH'])
 @jwt_required()
 def approve_user_route(user_id):
-    user = get_user_by_id(user_id)
+    # Reads that decide a write skip the shared user cache, which can lag other workers
+    user = get_user_by_id(user_id, 'user_id, approval_status', fresh=True)
     if not user:
         return abort(404, description='User not found')
     if user['approval_status'] != 'pending':
         return abort(400, description='User already processed')
 
+    # Rendering, upload, the database update and the WhatsApp message run as a background job;
+    # a second click while it runs gets the same job back
+    state = {'user_id': user_id, 'upload': current_app.config['QR_STORAGE_UPLOAD_ENABLED']}
+    if not state['upload']:
+        # Rendered when the link is first opened
+        state['qr_code_url'] = qr_code_link(user_id)
     try:
-        qr_code_image = generate_qr_code_image(user_id)
-        qr_code_url = upload_file_to_supabase(qr_code_image, 'qr_codes', f'{user_id}.png')
+        job_id, created = current_app.jobs.submit('approve_user', user_id, state)
     except Exception as e:
-        logger.error(f"Error generating/uploading QR code for {user_id}: {str(e)}")
-        return abort(500, description=f'Error generating QR code: {str(e)}')
+        logger.error(f"Error queueing approval of {user_id}: {str(e)}")
+        return abort(500, description=f'Error queueing approval: {str(e)}')
+    logger.info("Approval of %s queued as job %s", user_id, job_id)
+
+    response = jsonify({'message': 'User approval queued', 'job_id': job_id, 'created': created})
+    response.status_code = 202
+    response.headers['Location'] = url_for('jobs.job_status', job_id=job_id)
+    return response
+
+# Stages of the approval job (see app/utils/jobs.py). Each one may run again after a crash
+# or a failed attempt, so each is safe to repeat
+def _render_approval_qr_code(state):
+    if not state['upload']:
+        return {}
+    options = qr_render_options()
+    image = generate_qr_code_image(qr_code_payload(state['user_id']), **options)
+    return {'_image': base64.b64encode(image).decode('ascii'), 'image_format': options['image_format']}
 
-    supabase = request.app.supabase
+def _upload_approval_qr_code(state):
+    if not state['upload']:
+        return {}
+    # Upsert to a fixed object name, so a repeated upload overwrites the same file
+    url = upload_file_to_supabase(base64.b64decode(state['_image']), 'qr_codes', qr_code_file_name(state['user_id']),
+                                  QR_CONTENT_TYPES[state['image_format']])
+    return {'qr_code_url': url, '_image': None}
+
+def _persist_approval(state):
+    # One conditional update: a reject or a batch approval that lands while the job waits is never
+    # overwritten. Only a repeat of this stage may find the user approved, by its own earlier attempt
+    repeat = state.get('_attempt', 1) > 1
+    users = approve_users({state['user_id']: state['qr_code_url']},
+                          from_statuses=('pending', 'approved') if repeat else ('pending',))
+    if not users:
+        user = get_user_by_id(state['user_id'], 'approval_status', fresh=True)
+        if not user:
+            raise JobFailed('User not found')
+        if user['approval_status'] == 'rejected':
+            raise JobFailed('User was rejected while the approval was queued')
+        raise JobFailed('User already processed')
+    user = users[0]
+    send_signal(user_approved, current_app._get_current_object(), user=user)
+    return {'approved': True, '_name': user['name'], '_phone_number': user['phone_number']}
+
+def _notify_approval(state, conn):
+    # Queued in the transaction that completes the job, so the message is queued exactly once
     try:
-        supabase.table('users').update({
-            'approval_status': 'approved',
-            'qr_code_image_url': qr_code_url
-        }).eq('user_id', user_id).execute()
-    except Exception as e:
-        logger.error(f"Error updating user status for {user_id}: {str(e)}")
-        return abort(500, description=f'Error updating user status: {str(e)}')
+        formatted_phone = format_phone_number(state['_phone_number'])
+    except ValueError as e:
+        raise JobFailed(str(e))
+    message = _approval_message({'name': state['_name']}, state['qr_code_url'])
+    message_id = current_app.whatsapp_outbox.enqueue(formatted_phone, message, conn=conn)
+    return {'message_id': message_id}
+
+APPROVAL_STAGES = [
+    Stage('render', _render_approval_qr_code),
+    Stage('upload', _upload_approval_qr_code),
+    Stage('persist', _persist_approval, mark_started=True),
+    Stage('notify', _notify_approval, transactional=True),
+]
+
+# Render in worker processes, then upload with bounded concurrency; returns {user_id: url}
+# and records failures in results
+def _render_and_upload_qr_codes(app, user_ids, results):
+    options = qr_render_options()
+    payloads = {user_id: qr_code_payload(user_id) for user_id in user_ids}
+    rendered_images = render_qr_code_images(list(payloads.values()), app.config['QR_RENDER_PROCESSES'], **options)
+    images = {user_id: rendered_images[payload] for user_id, payload in payloads.items()}
+
+    def upload(user_id):
+        with app.app_context():
+            return upload_file_to_supabase(images[user_id], 'qr_codes', qr_code_file_name(user_id),
+                                           QR_CONTENT_TYPES[options['image_format']])
+
+    rendered = []
+    for user_id in user_ids:
+        if isinstance(images[user_id], Exception):
+            results[user_id] = f'Error generating QR code: {str(images[user_id])}'
+        else:
+            rendered.append(user_id)
+
+    qr_code_urls = {}
+    with ThreadPoolExecutor(max_workers=app.config['QR_UPLOAD_CONCURRENCY']) as executor:
+        for user_id, future in [(user_id, executor.submit(upload, user_id)) for user_id in rendered]:
+            try:
+                qr_code_urls[user_id] = future.result()
+            except Exception as e:
+                results[user_id] = f'Error uploading QR code: {str(e)}'
+    return qr_code_urls
+
+# Approve many users at once (admin-only)
+@bp.route('/approve/batch', methods=['POST'])
+@jwt_required()
+def approve_users_batch():
+    data = request.get_json()
+    user_ids = data.get('user_ids') if isinstance(data, dict) else None
+
+    if not isinstance(user_ids, list) or not user_ids:
+        return abort(400, description='Missing user_ids')
+    max_size = current_app.config['APPROVE_BATCH_MAX_SIZE']
+    if len(user_ids) > max_size:
+        return abort(400, description=f'Too many user_ids (max {max_size})')
+    user_ids = list(dict.fromkeys(str(user_id) for user_id in user_ids))
 
-    formatted_phone = format_phone_number(user['phone_number'])
-    message = f"Dear {user['name']}, your registration for the iftar event has been approved. Please present your QR code at the entrance: {qr_code_url}"
     try:
-        send_whatsapp_message(formatted_phone, message)
-        logger.info(f"Approval message sent to {formatted_phone}")
+        # Decides which users get approved, so it skips the shared user cache
+        users = {user['user_id']: user for user in get_users_by_ids(user_ids, fresh=True)}
     except Exception as e:
-        logger.warning(f"Failed to send WhatsApp message to {formatted_phone}: {str(e)}")
-        # Continue even if WhatsApp fails
+        logger.error(f"Error fetching users for batch approval: {str(e)}")
+        return abort(500, description=f'Error fetching users: {str(e)}')
+
+    results = {}
+    for user_id in user_ids:
+        user = users.get(user_id)
+        if not user:
+            results[user_id] = 'User not found'
+        elif user['approval_status'] != 'pending':
+            results[user_id] = 'User already processed'
+    to_approve = [user_id for user_id in user_ids if user_id not in results]
+
+    app = current_app._get_current_object()
+    if current_app.config['QR_STORAGE_UPLOAD_ENABLED']:
+        qr_code_urls = _render_and_upload_qr_codes(app, to_approve, results)
+    else:
+        # No storage round trips: messages link to GET /qr_codes/<user_id>.png
+        qr_code_urls = {user_id: qr_code_link(user_id) for user_id in to_approve}
 
-    return jsonify({'message': 'User approved and QR code sent'}), 200
+    # Only approval_status and qr_code_image_url are written, and only on users still pending
+    approved = []
+    if qr_code_urls:
+        try:
+            approved = approve_users(qr_code_urls)
+        except Exception as e:
+            logger.error(f"Error updating {len(qr_code_urls)} users in batch approval: {str(e)}")
+            for user_id in qr_code_urls:
+                results[user_id] = f'Error updating user status: {str(e)}'
+        changed = {user['user_id'] for user in approved}
+        for user_id in qr_code_urls:
+            if user_id not in changed and user_id not in results:
+                # Rejected or approved by someone else after it was read
+                results[user_id] = 'User already processed'
+
+    for user in approved:
+        results[user['user_id']] = None
+        send_signal(user_approved, app, user=user)
+        # Only queued here; the outbox worker delivers in the background
+        try:
+            send_whatsapp_message(format_phone_number(user['phone_number']),
+                                  _approval_message(user, user['qr_code_image_url']))
+        except Exception as e:
+            logger.warning(f"Failed to queue approval message for {user['user_id']}: {str(e)}")
+
+    logger.info(f"Batch approval: {len(approved)} of {len(user_ids)} users approved")
+    return jsonify({
+        'approved': len(approved),
+        'failed': len(user_ids) - len(approved),
+        'results': [
+            {'user_id': user_id, 'status': 'approved'} if results[user_id] is None
+            else {'user_id': user_id, 'status': 'failed', 'error': results[user_id]}
+            for user_id in user_ids
+        ],
+    }), 200
 
 # Reject a user (admin-only)
 @bp.route('/reject/<user_id>', methods=['PATCH'])
 @jwt_required()
 def reject_user(user_id):
-    user = get_user_by_id(user_id)
+    user = get_user_by_id(user_id, fresh=True)
     if not user:
         return abort(404, description='User not found')
     if user['approval_status'] != 'pending':
         return abort(400, description='User already processed')
 
-    supabase = request.app.supabase
     try:
-        supabase.table('users').update({'approval_status': 'rejected'}).eq('user_id', user_id).execute()
+        # Conditional on the user still being pending: an approval job may have persisted since the read
+        rejected = reject_pending_user(user_id)
     except Exception as e:
         logger.error(f"Error rejecting user {user_id}: {str(e)}")
         return abort(500, description=f'Error rejecting user: {str(e)}')
+    if not rejected:
+        return abort(400, description='User already processed')
+    user = {**user, **rejected}
+    send_signal(user_rejected, current_app._get_current_object(), user=user)
 
     formatted_phone = format_phone_number(user['phone_number'])
     message = f"Dear {user['name']}, your registration for the iftar event has been rejected. Please contact support for details."
     try:
         send_whatsapp_message(formatted_phone, message)
-        logger.info(f"Rejection message sent to {formatted_phone}")
+        logger.info(f"Rejection message queued for {formatted_phone}")
     except Exception as e:
-        logger.warning(f"Failed to send rejection message to {formatted_phone}: {str(e)}")
+        logger.warning(f"Failed to queue rejection message to {formatted_phone}: {str(e)}")
         # Continue even if WhatsApp fails
 
     return jsonify({'message': 'User rejected successfully'}), 200
\ No newline at end of file
@@ -1,12 +1,11 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, url_for
 from werkzeug.exceptions import abort
 from flask_jwt_extended import jwt_required
 from ..utils.qr_code import format_phone_number
-from ..utils.whatsapp import send_whatsapp_message
+from ..utils.outbox import send_whatsapp_message
+from ..utils.broadcast import CampaignError, FILTER_COLUMNS
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 bp = Blueprint('whatsapp', __name__, url_prefix='/whatsapp')
@@ -23,12 +22,104 @@ def send_message():
 
     try:
         formatted_phone = format_phone_number(phone_number)
-        send_whatsapp_message(formatted_phone, message)
-        logger.info(f"Manual message sent to {formatted_phone}")
-        return jsonify({'message': 'Message sent successfully'}), 200
+        message_id = send_whatsapp_message(formatted_phone, message)
+        logger.info(f"Manual message queued for {formatted_phone}")
+        return jsonify({'message': 'Message queued for delivery', 'message_id': message_id}), 202
     except ValueError as e:
         logger.error(f"Invalid phone number format: {str(e)}")
         return abort(400, description=str(e))
     except Exception as e:
-        logger.error(f"Error sending manual WhatsApp message: {str(e)}")
-        return abort(500, description=f'Error sending message: {str(e)}')
\ No newline at end of file
+        logger.error(f"Error queueing manual WhatsApp message: {str(e)}")
+        return abort(500, description=f'Error queueing message: {str(e)}')
+
+# Outbox queue depth, send latency and dead letters (admin-only)
+@bp.route('/outbox', methods=['GET'])
+@jwt_required()
+def outbox_status():
+    outbox = current_app.whatsapp_outbox
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        **outbox.stats(),
+        'transport': {'name': current_app.messaging_transport.name, **current_app.messaging_transport.stats()},
+        'dead_letter_messages': outbox.dead_letters(limit),
+    }), 200
+
+# Put a dead-lettered message back in the queue (admin-only)
+@bp.route('/outbox/<int:message_id>/retry', methods=['POST'])
+@jwt_required()
+def retry_outbox_message(message_id):
+    if not current_app.whatsapp_outbox.retry_dead_letter(message_id):
+        return abort(404, description='Dead-lettered message not found')
+    logger.info(f"Outbox message {message_id} re-queued")
+    return jsonify({'message': 'Message re-queued'}), 200
+
+# Start a broadcast to approved users, e.g. {"template": "Dear {name}, gates open at 6pm", "filters": {"batch": "2020"}}
+# (admin-only). Messages are queued at BROADCAST_RATE_PER_MINUTE; poll the returned URL for progress
+@bp.route('/broadcasts', methods=['POST'])
+@jwt_required()
+def create_broadcast():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return abort(400, description='Missing template')
+    filters = data.get('filters') or {}
+    if not isinstance(filters, dict) or not all(isinstance(value, str) for value in filters.values()):
+        return abort(400, description=f"filters must map {', '.join(FILTER_COLUMNS)} to strings")
+
+    # Recipient count from the in-memory index of approved users; exact once every recipient is queued
+    index = current_app.attendee_index
+    estimated = index.count(filters) if index.loaded else None
+    try:
+        campaign_id = current_app.broadcasts.create(data.get('template'), filters, estimated)
+    except CampaignError as e:
+        return abort(400, description=str(e))
+    except Exception as e:
+        logger.error(f"Error creating broadcast campaign: {str(e)}")
+        return abort(500, description=f'Error creating broadcast: {str(e)}')
+
+    response = jsonify(current_app.broadcasts.progress(campaign_id))
+    response.status_code = 202
+    response.headers['Location'] = url_for('whatsapp.broadcast_progress', campaign_id=campaign_id)
+    return response
+
+# Recent broadcast campaigns with their progress (admin-only)
+@bp.route('/broadcasts', methods=['GET'])
+@jwt_required()
+def list_broadcasts():
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'campaigns': current_app.broadcasts.recent(limit)}), 200
+
+# Sent, failed and remaining counts of one broadcast (admin-only)
+@bp.route('/broadcasts/<int:campaign_id>', methods=['GET'])
+@jwt_required()
+def broadcast_progress(campaign_id):
+    progress = current_app.broadcasts.progress(campaign_id)
+    if progress is None:
+        return abort(404, description='Broadcast not found')
+    return jsonify(progress), 200
+
+# Stop queueing further messages of a broadcast until it is resumed (admin-only)
+@bp.route('/broadcasts/<int:campaign_id>/pause', methods=['POST'])
+@jwt_required()
+def pause_broadcast(campaign_id):
+    if not current_app.broadcasts.pause(campaign_id):
+        return abort(409, description='Broadcast is not running')
+    logger.info(f"Broadcast campaign {campaign_id} paused")
+    return jsonify(current_app.broadcasts.progress(campaign_id)), 200
+
+# Continue a paused broadcast from its checkpoint (admin-only)
+@bp.route('/broadcasts/<int:campaign_id>/resume', methods=['POST'])
+@jwt_required()
+def resume_broadcast(campaign_id):
+    if not current_app.broadcasts.resume(campaign_id):
+        return abort(409, description='Broadcast is not paused')
+    logger.info(f"Broadcast campaign {campaign_id} resumed")
+    return jsonify(current_app.broadcasts.progress(campaign_id)), 200
+
+# Cancel a broadcast and drop its messages still waiting in the outbox (admin-only)
+@bp.route('/broadcasts/<int:campaign_id>/cancel', methods=['POST'])
+@jwt_required()
+def cancel_broadcast(campaign_id):
+    if not current_app.broadcasts.cancel(campaign_id):
+        return abort(409, description='Broadcast is already finished')
+    logger.info(f"Broadcast campaign {campaign_id} cancelled")
+    return jsonify(current_app.broadcasts.progress(campaign_id)), 200
@@ -0,0 +1,23 @@
+from blinker import Namespace
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Application signals for user state changes. In-process caches subscribe to
+# these instead of every route having to know about every cache.
+_signals = Namespace()
+
+user_approved = _signals.signal('user-approved')
+user_rejected = _signals.signal('user-rejected')
+user_registered = _signals.signal('user-registered')
+user_checked_in = _signals.signal('user-checked-in')
+
+
+def send_signal(signal, sender, **kwargs):
+    # The change is already in the database when this runs, so a failing
+    # receiver is logged instead of failing the request that made it
+    for receiver in signal.receivers_for(sender):
+        try:
+            receiver(sender, **kwargs)
+        except Exception as e:
+            logger.error(f"Error in {signal.name} receiver {getattr(receiver, '__qualname__', receiver)}: {str(e)}")
@@ -0,0 +1,293 @@
+import json
+import string
+import threading
+import time
+import logging
+from .outbox import TokenBucket
+from .qr_code import format_phone_number
+
+logger = logging.getLogger(__name__)
+
+RECIPIENT_COLUMNS = 'user_id, name, batch, branch, phone_number, check_in_status, created_at'
+TEMPLATE_FIELDS = ('name', 'batch', 'branch', 'user_id', 'check_in_status')
+FILTER_COLUMNS = ('batch', 'branch', 'check_in_status')
+
+# Campaign states; a campaign that has queued every recipient is reported as
+# 'sending' until the outbox has delivered or dead-lettered its messages
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+QUEUED = 'queued'
+
+
+class CampaignError(ValueError):
+    pass
+
+
+def validate_template(template):
+    # Only plain {field} placeholders for known user fields; no attribute or index lookups
+    if not isinstance(template, str) or not template.strip():
+        raise CampaignError('Missing template')
+    try:
+        parsed = list(string.Formatter().parse(template))
+    except ValueError as e:
+        raise CampaignError(f'Invalid template: {str(e)}')
+    for _, field, format_spec, conversion in parsed:
+        if field is None:
+            continue
+        if field not in TEMPLATE_FIELDS or format_spec or conversion:
+            raise CampaignError(f"Unsupported template field {{{field}}} (use {', '.join(TEMPLATE_FIELDS)})")
+
+
+def render_template(template, user):
+    return template.format_map({field: user.get(field) or '' for field in TEMPLATE_FIELDS})
+
+
+class BroadcastCampaigns:
+    """Throttled, resumable broadcasts to approved users through the WhatsApp outbox.
+
+    Campaigns live in the outbox's SQLite file, so every worker can create and
+    report on them. A single runner thread, in the process that drains the
+    outbox, pages through the recipients in ``(created_at, user_id)`` order and
+    queues one message at a time under its own token bucket. Each message is
+    queued in the same transaction that advances the campaign's cursor, so a
+    restart resumes after the last queued recipient without skipping or
+    repeating anyone. At most ``max_in_flight`` messages per campaign wait in
+    the outbox at once, which keeps approval messages from queueing behind a
+    whole broadcast.
+    """
+
+    def __init__(self, outbox, store, rate_per_minute=6, page_size=200, max_in_flight=5, poll_interval=5.0):
+        self.outbox = outbox
+        self.store = store
+        self.page_size = page_size
+        self.max_in_flight = max(1, max_in_flight)
+        self.poll_interval = poll_interval
+        self.bucket = TokenBucket(rate_per_minute)
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._init_db()
+
+    def _init_db(self):
+        with self.outbox.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    template TEXT NOT NULL,
+                    filters TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    estimated_recipients INTEGER,
+                    queued INTEGER NOT NULL DEFAULT 0,
+                    skipped INTEGER NOT NULL DEFAULT 0,
+                    cursor_created_at TEXT,
+                    cursor_user_id TEXT,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    queued_at REAL
+                )
+            ''')
+
+    def create(self, template, filters=None, estimated_recipients=None):
+        validate_template(template)
+        filters = filters or {}
+        unknown = set(filters) - set(FILTER_COLUMNS)
+        if unknown:
+            raise CampaignError(f"Unsupported filter {', '.join(sorted(unknown))} (use {', '.join(FILTER_COLUMNS)})")
+        now = time.time()
+        with self.outbox.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO campaigns (template, filters, status, estimated_recipients, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (template, json.dumps(filters, sort_keys=True), RUNNING, estimated_recipients, now, now),
+            )
+        self._wakeup.set()
+        logger.info(f"Broadcast campaign {cursor.lastrowid} created for filters {filters}")
+        return cursor.lastrowid
+
+    def _set_status(self, campaign_id, status, allowed_from):
+        with self.outbox.transaction() as conn:
+            updated = conn.execute(
+                f"UPDATE campaigns SET status = ?, updated_at = ? WHERE id = ? "
+                f"AND status IN ({', '.join('?' * len(allowed_from))})",
+                (status, time.time(), campaign_id, *allowed_from),
+            ).rowcount
+            if updated and status == CANCELLED:
+                # Messages still waiting in the outbox are dropped; the one being sent finishes
+                conn.execute("UPDATE outbox SET status = 'cancelled' WHERE campaign_id = ? AND status = 'pending'",
+                             (campaign_id,))
+        self._wakeup.set()
+        return bool(updated)
+
+    def pause(self, campaign_id):
+        return self._set_status(campaign_id, PAUSED, (RUNNING,))
+
+    def resume(self, campaign_id):
+        return self._set_status(campaign_id, RUNNING, (PAUSED,))
+
+    def cancel(self, campaign_id):
+        progress = self.progress(campaign_id)
+        if progress is None or progress['status'] in ('completed', CANCELLED):
+            return False
+        return self._set_status(campaign_id, CANCELLED, (RUNNING, PAUSED, QUEUED))
+
+    def progress(self, campaign_id):
+        with self.outbox.transaction() as conn:
+            row = conn.execute(
+                'SELECT id, template, filters, status, estimated_recipients, queued, skipped, last_error, '
+                'created_at, updated_at, queued_at FROM campaigns WHERE id = ?', (campaign_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = dict(conn.execute(
+                'SELECT status, COUNT(*) FROM outbox WHERE campaign_id = ? GROUP BY status', (campaign_id,)
+            ).fetchall())
+        (campaign_id, template, filters, status, estimated, queued, skipped, last_error,
+         created_at, updated_at, queued_at) = row
+        in_outbox = counts.get('pending', 0) + counts.get('sending', 0)
+        if status == QUEUED:
+            # Paging is done, so the recipient count is exact
+            status = 'sending' if in_outbox else 'completed'
+            recipients = queued + skipped
+        else:
+            recipients = max(estimated or 0, queued + skipped) if estimated is not None else None
+        sent, failed = counts.get('sent', 0), counts.get('dead', 0)
+        return {
+            'campaign_id': campaign_id,
+            'status': status,
+            'template': template,
+            'filters': json.loads(filters),
+            'recipients': recipients,
+            'sent': sent,
+            'failed': failed,
+            'skipped': skipped,
+            'in_outbox': in_outbox,
+            'cancelled': counts.get('cancelled', 0),
+            'remaining': 0 if status == CANCELLED else (
+                None if recipients is None else max(recipients - sent - failed - skipped, 0)),
+            'last_error': last_error,
+            'created_at': created_at,
+            'updated_at': updated_at,
+            'queued_at': queued_at,
+        }
+
+    def recent(self, limit=50):
+        with self.outbox.transaction() as conn:
+            ids = [row[0] for row in conn.execute('SELECT id FROM campaigns ORDER BY id DESC LIMIT ?', (limit,))]
+        return [self.progress(campaign_id) for campaign_id in ids]
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='broadcast-runner', daemon=True)
+        self._thread.start()
+        logger.info("Broadcast runner started")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def _next_campaign(self):
+        with self.outbox.transaction() as conn:
+            return conn.execute(
+                'SELECT id, template, filters, cursor_created_at, cursor_user_id FROM campaigns '
+                'WHERE status = ? ORDER BY id LIMIT 1', (RUNNING,)
+            ).fetchone()
+
+    def _in_flight(self, campaign_id):
+        with self.outbox.transaction() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE campaign_id = ? AND status IN ('pending', 'sending')", (campaign_id,)
+            ).fetchone()[0]
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                idle = self._step()
+            except Exception as e:
+                logger.error(f"Broadcast runner error: {str(e)}")
+                idle = True
+            if idle:
+                # Campaigns created or resumed in other worker processes are found on the next poll
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _step(self):
+        # Queue up to one page of messages for the oldest running campaign; returns True when idle
+        campaign = self._next_campaign()
+        if campaign is None:
+            return True
+        campaign_id, template, filters, cursor_created_at, cursor_user_id = campaign
+        room = self.max_in_flight - self._in_flight(campaign_id)
+        if room <= 0:
+            self._stopped.wait(1.0)
+            return False
+
+        after = (cursor_created_at, cursor_user_id) if cursor_user_id else None
+        try:
+            page = self.store.list_users(RECIPIENT_COLUMNS, filters={**json.loads(filters), 'approval_status': 'approved'},
+                                         after=after, limit=min(room, self.page_size))
+        except Exception as e:
+            # Retried on the next poll from the same cursor
+            self._record_error(campaign_id, f'Error fetching recipients: {str(e)}')
+            return True
+        if not page:
+            self._finish_paging(campaign_id)
+            return False
+
+        for user in page:
+            if not self.bucket.acquire(self._stopped):
+                return True
+            if not self._queue_message(campaign_id, template, user):
+                # Paused or cancelled while this page was being sent
+                return False
+        if len(page) < min(room, self.page_size):
+            self._finish_paging(campaign_id)
+        return False
+
+    def _queue_message(self, campaign_id, template, user):
+        try:
+            phone_number = format_phone_number(user['phone_number'])
+            message = render_template(template, user)
+        except Exception as e:
+            logger.warning(f"Broadcast {campaign_id} skipping {user['user_id']}: {str(e)}")
+            phone_number = message = None
+
+        with self.outbox.transaction() as conn:
+            # Checked in the same transaction, so a pause or cancel from another worker is never overrun
+            status = conn.execute('SELECT status FROM campaigns WHERE id = ?', (campaign_id,)).fetchone()[0]
+            if status != RUNNING:
+                return False
+            counter = 'skipped'
+            if message is not None:
+                self.outbox.enqueue(phone_number, message, campaign_id=campaign_id, conn=conn)
+                counter = 'queued'
+            conn.execute(
+                f"UPDATE campaigns SET {counter} = {counter} + 1, "
+                "cursor_created_at = ?, cursor_user_id = ?, updated_at = ? WHERE id = ?",
+                (user['created_at'], user['user_id'], time.time(), campaign_id),
+            )
+        return True
+
+    def _finish_paging(self, campaign_id):
+        now = time.time()
+        with self.outbox.transaction() as conn:
+            conn.execute('UPDATE campaigns SET status = ?, queued_at = ?, updated_at = ? WHERE id = ? AND status = ?',
+                         (QUEUED, now, now, campaign_id, RUNNING))
+        logger.info(f"Broadcast campaign {campaign_id} has queued all recipients")
+
+    def _record_error(self, campaign_id, error):
+        logger.error(f"Broadcast campaign {campaign_id}: {error}")
+        with self.outbox.transaction() as conn:
+            conn.execute('UPDATE campaigns SET last_error = ?, updated_at = ? WHERE id = ?', (error, time.time(), campaign_id))
+
+    def stats(self):
+        with self.outbox.transaction() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM campaigns GROUP BY status').fetchall())
+        return {'running': counts.get(RUNNING, 0), 'paused': counts.get(PAUSED, 0),
+                'runner_alive': self._thread is not None and self._thread.is_alive()}
@@ -0,0 +1,43 @@
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeCounter:
+    """Counts writes to a table, shared by the worker processes on the host
+    through the outbox's SQLite file.
+
+    A read endpoint puts ``token()`` in its ETag and can then answer a
+    conditional request with 304 before querying: any write made through
+    this host's app changes the token. The token also carries a random epoch
+    chosen when the counter is created, so a new outbox file never repeats an
+    old token.
+    """
+
+    def __init__(self, outbox, name):
+        self.outbox = outbox
+        self.name = name
+        with outbox.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS change_counters (
+                    name TEXT PRIMARY KEY,
+                    epoch TEXT NOT NULL,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('INSERT OR IGNORE INTO change_counters (name, epoch) VALUES (?, ?)', (name, uuid.uuid4().hex))
+
+    def bump(self):
+        # Called after the write it counts, so a token read before the write never outlives it
+        try:
+            with self.outbox.transaction() as conn:
+                conn.execute('UPDATE change_counters SET value = value + 1 WHERE name = ?', (self.name,))
+        except Exception as e:
+            logger.error(f"Error counting a change to {self.name}: {str(e)}")
+
+    def token(self):
+        with self.outbox.reader() as conn:
+            epoch, value = conn.execute('SELECT epoch, value FROM change_counters WHERE name = ?',
+                                        (self.name,)).fetchone()
+        return f'{epoch}.{value}'
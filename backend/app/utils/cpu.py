@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Under gevent workers (gunicorn.conf.py) threading is monkey-patched: "threads" are
+# greenlets on the one OS thread that runs the hub, and a bcrypt hash or a QR render
+# in one of them stalls every other request in the worker. CPU-bound work goes
+# through these helpers, which use gevent's native OS threads when it is active.
+
+
+def gevent_active():
+    try:
+        from gevent.monkey import is_module_patched
+    except ImportError:
+        return False
+    return is_module_patched('threading')
+
+
+def cpu_executor(max_workers, thread_name_prefix=''):
+    """A ThreadPoolExecutor whose workers are OS threads, with or without gevent."""
+    if gevent_active():
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        return NativeThreadPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+CPU_THREADS = 2  # Pure-Python work holds the GIL; more threads only take turns away from the hub
+
+
+def run_cpu_bound(func, *args, **kwargs):
+    # Without gevent the caller is already an OS thread (or a render process), so run inline
+    global _pool
+    if not gevent_active():
+        return func(*args, **kwargs)
+    with _pool_lock:
+        if _pool is None:
+            from gevent.threadpool import ThreadPool
+            _pool = ThreadPool(CPU_THREADS)
+    return _pool.apply(func, args, kwargs)
+
+
+def _reset_pool():
+    # A forked worker must start its own threads
+    global _pool
+    _pool = None
+
+
+os.register_at_fork(after_in_child=_reset_pool)
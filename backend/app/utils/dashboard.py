@@ -0,0 +1,324 @@
+import json
+import queue
+import threading
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_COLUMNS = 'user_id, batch, branch, approval_status, check_in_status, created_at'
+GROUP_DIMENSIONS = ('batch', 'branch')
+
+# Position of each field in the per-user state list
+BATCH, BRANCH, APPROVAL, CHECK_IN = range(4)
+
+
+def _format_event(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def _new_counts():
+    return {'total': 0, 'approval_status': {}, 'check_in_status': {}}
+
+
+def _bump(counts, state, delta):
+    counts['total'] += delta
+    for field, value in (('approval_status', state[APPROVAL]), ('check_in_status', state[CHECK_IN])):
+        bucket = counts[field]
+        bucket[value] = bucket.get(value, 0) + delta
+        if not bucket[value]:
+            del bucket[value]
+
+
+def _copy_counts(counts):
+    return {'total': counts['total'], 'approval_status': dict(counts['approval_status']),
+            'check_in_status': dict(counts['check_in_status'])}
+
+
+class Subscriber:
+    """One /dashboard/stream client: a bounded queue of formatted events.
+
+    A client that falls too far behind is not disconnected; its queue is
+    cleared and it gets a fresh snapshot instead.
+    """
+
+    def __init__(self, dashboard, queue_size):
+        self.dashboard = dashboard
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self.replay = None
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.overflowed = True
+
+    def _drain(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def events(self, heartbeat_interval=15.0, aggregate_interval=1.0):
+        """Yields the SSE stream: a snapshot (or the missed events), then
+        changes as they happen, with aggregates coalesced to at most one
+        event per ``aggregate_interval`` seconds."""
+        yield 'retry: 3000\n\n'
+        if self.replay is None:
+            yield self.dashboard.snapshot_event()
+            dirty = False
+        else:
+            yield from self.replay
+            self.replay = None
+            dirty = True
+
+        last_write = last_aggregates = time.monotonic()
+        while True:
+            if self.overflowed:
+                self.overflowed = False
+                self._drain()
+                yield self.dashboard.snapshot_event()
+                dirty = False
+                last_write = last_aggregates = time.monotonic()
+                continue
+
+            now = time.monotonic()
+            if dirty and now - last_aggregates >= aggregate_interval:
+                yield self.dashboard.aggregates_event()
+                dirty = False
+                last_write = last_aggregates = now
+                continue
+
+            deadline = last_write + heartbeat_interval
+            if dirty:
+                deadline = min(deadline, last_aggregates + aggregate_interval)
+            try:
+                item = self.queue.get(timeout=max(deadline - now, 0.01))
+            except queue.Empty:
+                if time.monotonic() - last_write >= heartbeat_interval:
+                    # Comment line: keeps proxies from closing an idle connection
+                    yield ': keepalive\n\n'
+                    last_write = time.monotonic()
+                continue
+            yield item
+            dirty = True
+            last_write = time.monotonic()
+
+
+class LiveDashboard:
+    """Running registration aggregates kept in memory for the admin dashboard.
+
+    Seeded once from the database, then updated from the user signals sent
+    by the register, approve, reject and scan routes. Each change is pushed
+    to the connected /dashboard/stream clients. With several worker
+    processes, changes made by other workers show up at the next resync.
+    """
+
+    def __init__(self, store, client_queue_size=1000, history_size=1000, max_subscribers=50, resync_interval=0):
+        self.store = store
+        self.client_queue_size = client_queue_size
+        self.max_subscribers = max_subscribers
+        self.resync_interval = resync_interval
+        self._users = {}  # user_id -> [batch, branch, approval_status, check_in_status]
+        self._totals = _new_counts()
+        self._groups = {dimension: {} for dimension in GROUP_DIMENSIONS}
+        self._changes = None  # Updates applied while a load is in flight
+        self._history = deque(maxlen=history_size)  # (event id, formatted event) for Last-Event-ID
+        self._event_id = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.loaded = False
+        self.last_resync_at = None
+        self.last_resync_error = None
+        self.overflows = 0
+
+    def load(self, page_size=1000):
+        """(Re)builds the aggregates from the database and pushes them to
+        connected clients if they changed."""
+        with self._lock:
+            before = self._aggregates() if self.loaded else None
+            self._changes = {}
+        try:
+            users = {}
+            after = None
+            while True:
+                rows = self.store.list_users(DASHBOARD_COLUMNS, after=after, limit=page_size)
+                for row in rows:
+                    users[row['user_id']] = [row.get('batch'), row.get('branch'),
+                                             row['approval_status'], row['check_in_status']]
+                if len(rows) < page_size:
+                    break
+                after = (rows[-1]['created_at'], rows[-1]['user_id'])
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            # Keep changes made while the load was in flight (check-ins may not be written back yet)
+            for user_id, state in self._changes.items():
+                users[user_id] = list(state)
+            self._changes = None
+            self._users = users
+            self._recount()
+            self.loaded = True
+            self.last_resync_at = time.time()
+            changed = self._aggregates() != before
+            subscribers = list(self._subscribers) if changed else []
+        if subscribers:
+            item = self.aggregates_event()
+            for subscriber in subscribers:
+                subscriber.put(item)
+        logger.info(f"Dashboard aggregates loaded with {len(users)} users")
+
+    def _recount(self):
+        self._totals = _new_counts()
+        self._groups = {dimension: {} for dimension in GROUP_DIMENSIONS}
+        for state in self._users.values():
+            self._count(state, 1)
+
+    def _count(self, state, delta):
+        _bump(self._totals, state, delta)
+        for position, dimension in ((BATCH, 'batch'), (BRANCH, 'branch')):
+            groups = self._groups[dimension]
+            counts = groups.get(state[position])
+            if counts is None:
+                counts = groups[state[position]] = _new_counts()
+            _bump(counts, state, delta)
+            if not counts['total']:
+                del groups[state[position]]
+
+    def _aggregates(self):
+        aggregates = _copy_counts(self._totals)
+        for dimension, groups in self._groups.items():
+            aggregates[dimension] = {key: _copy_counts(counts) for key, counts in groups.items()}
+        return aggregates
+
+    def snapshot(self):
+        with self._lock:
+            return {'version': self._event_id, 'loaded': self.loaded, 'aggregates': self._aggregates()}
+
+    def snapshot_event(self):
+        snapshot = self.snapshot()
+        return _format_event(snapshot['version'], 'snapshot', snapshot)
+
+    def aggregates_event(self):
+        snapshot = self.snapshot()
+        return _format_event(snapshot['version'], 'aggregates', snapshot)
+
+    def _apply(self, event, user, updates=None):
+        user_id = user['user_id']
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None and (event == 'registered' or (user.get('batch') and user.get('branch'))):
+                state = [user.get('batch'), user.get('branch'),
+                         user.get('approval_status', 'pending'), user.get('check_in_status', 'not_checked_in')]
+                self._users[user_id] = state
+                self._count(state, 1)
+            elif state is not None and event == 'registered':
+                return
+            # A user registered through another worker stays uncounted until the next resync
+
+            if state is not None and updates:
+                self._count(state, -1)
+                for position, value in updates.items():
+                    state[position] = value
+                self._count(state, 1)
+            if state is not None and self._changes is not None:
+                self._changes[user_id] = tuple(state)
+
+            self._event_id += 1
+            data = {'user_id': user_id, 'at': time.time()}
+            if state is not None:
+                data.update(batch=state[BATCH], branch=state[BRANCH],
+                            approval_status=state[APPROVAL], check_in_status=state[CHECK_IN])
+            item = _format_event(self._event_id, event, data)
+            self._history.append((self._event_id, item))
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(item)
+
+    def registered(self, user):
+        self._apply('registered', user)
+
+    def approved(self, user):
+        self._apply('approved', user, {APPROVAL: 'approved'})
+
+    def rejected(self, user):
+        self._apply('rejected', user, {APPROVAL: 'rejected'})
+
+    def checked_in(self, user):
+        self._apply('checked_in', user, {CHECK_IN: 'checked_in'})
+
+    def subscribe(self, last_event_id=None):
+        """Registers a stream client; returns None when the subscriber limit is reached.
+
+        With a ``last_event_id`` still covered by the event history, the
+        client gets the events it missed instead of a new snapshot.
+        """
+        subscriber = Subscriber(self, self.client_queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            try:
+                last_event_id = int(last_event_id) if last_event_id is not None else None
+            except ValueError:
+                last_event_id = None
+            if last_event_id is not None and last_event_id <= self._event_id:
+                oldest = self._history[0][0] if self._history else self._event_id + 1
+                if last_event_id >= oldest - 1:
+                    subscriber.replay = [item for event_id, item in self._history if event_id > last_event_id]
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            if subscriber.overflowed:
+                self.overflows += 1
+
+    def start(self):
+        if self.resync_interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='dashboard-resync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stopped.wait(self.resync_interval):
+            try:
+                self.load()
+                self.last_resync_error = None
+            except Exception as e:
+                self.last_resync_error = str(e)
+                logger.error(f"Error resyncing dashboard aggregates: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self.loaded,
+                'users': len(self._users),
+                'subscribers': len(self._subscribers),
+                'version': self._event_id,
+                'last_resync_at': self.last_resync_at,
+                'last_resync_error': self.last_resync_error,
+            }
+
+
+def connect_dashboard_signals(app, dashboard):
+    from ..signals import user_registered, user_approved, user_rejected, user_checked_in
+
+    user_registered.connect(lambda sender, user, **extra: dashboard.registered(user), sender=app, weak=False)
+    user_approved.connect(lambda sender, user, **extra: dashboard.approved(user), sender=app, weak=False)
+    user_rejected.connect(lambda sender, user, **extra: dashboard.rejected(user), sender=app, weak=False)
+    user_checked_in.connect(lambda sender, user, **extra: dashboard.checked_in(user), sender=app, weak=False)
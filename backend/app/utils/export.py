@@ -0,0 +1,118 @@
+import csv
+import io
+import itertools
+import json
+import re
+import time
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_FILTERS = {
+    'batch': None,
+    'branch': None,
+    'approval_status': ('pending', 'approved', 'rejected'),
+    'check_in_status': ('not_checked_in', 'checked_in'),
+}
+CHUNK_BYTES = 64 * 1024  # Rows are sent in chunks of about this size, not one write per row
+
+
+def iter_users(store, columns, filters=None, page_size=1000, retry_attempts=3, retry_base_delay=0.1):
+    """Yields every user matching ``filters``, in (created_at, user_id) order,
+    one keyset page in memory at a time. A page that fails with a transient
+    error is fetched again from the same cursor."""
+    select = ', '.join(dict.fromkeys([*columns, 'created_at', 'user_id']))
+    after = None
+    while True:
+        delay = retry_base_delay
+        for attempt in range(1, retry_attempts + 1):
+            try:
+                page = store.list_users(select, filters=filters, after=after, limit=page_size)
+                break
+            except Exception as e:
+                if attempt == retry_attempts or not store.is_transient(e):
+                    raise
+                logger.warning(f"Transient error exporting users (attempt {attempt}), retrying in {delay:.2f}s: {str(e)}")
+                time.sleep(delay)
+                delay *= 2
+        yield from page
+        if len(page) < page_size:
+            return
+        after = (page[-1]['created_at'], page[-1]['user_id'])
+
+
+def _csv_cell(value):
+    if value is None:
+        return ''
+    value = str(value)
+    # Spreadsheets run cells starting with these as formulas; phone numbers like +880... are left alone
+    if value[:1] in ('=', '@', '\t', '\r') or (value[:1] in ('+', '-') and not re.fullmatch(r'[+-][\d\s]+', value)):
+        return "'" + value
+    return value
+
+
+def encode_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_cell(row.get(column)) for column in columns])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def encode_ndjson(rows, columns):
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps({column: row.get(column) for column in columns}, ensure_ascii=False, separators=(',', ':'))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_BYTES:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines, size = [], 0
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_stream(chunks):
+    # wbits=31 writes a gzip header and trailer, so the stream is a regular .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_users(store, columns, export_format, filters=None, compress=False, page_size=1000,
+                 retry_attempts=3, retry_base_delay=0.1):
+    """Returns a generator of the export body, produced as the client reads it.
+
+    The first page is fetched before returning, so a database that is down
+    still gets an error status instead of an empty file.
+    """
+    rows = iter_users(store, columns, filters, page_size, retry_attempts, retry_base_delay)
+    first = next(rows, None)
+    if first is not None:
+        rows = itertools.chain([first], rows)
+    encode = encode_csv if export_format == 'csv' else encode_ndjson
+
+    def counted():
+        count, started = 0, time.monotonic()
+        try:
+            for row in rows:
+                count += 1
+                yield row
+        except Exception as e:
+            # The status line has been sent; the client sees a truncated file
+            logger.error(f"User export failed after {count} rows: {str(e)}")
+            raise
+        logger.info(f"Exported {count} users as {export_format} in {time.monotonic() - started:.1f}s")
+
+    chunks = encode(counted(), columns)
+    return gzip_stream(chunks) if compress else chunks
@@ -0,0 +1,56 @@
+import os
+import threading
+import logging
+import httpx
+from postgrest.utils import SyncClient as PostgrestSession
+from storage3.utils import SyncClient as StorageSession
+
+logger = logging.getLogger(__name__)
+
+# One connection pool per process for everything that talks to Supabase. Under the
+# gevent worker (gunicorn.conf.py) the sockets are cooperative, so the synchronous
+# database.py and upload functions yield while waiting and hundreds of requests can
+# share these keep-alive connections.
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def shared_transport(max_connections=100, max_keepalive=20):
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = httpx.HTTPTransport(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+                retries=1,  # Reconnect once when a pooled keep-alive connection was closed by the server
+            )
+        return _transport
+
+
+def _reset_after_fork():
+    # Pooled sockets must never be shared between processes
+    global _transport, _transport_lock
+    _transport = None
+    _transport_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def pool_supabase_client(client, max_connections=100, max_keepalive=20):
+    """Point the Supabase table and storage clients at the shared connection pool."""
+    transport = shared_transport(max_connections, max_keepalive)
+
+    old = client.postgrest.session
+    client.postgrest.session = PostgrestSession(
+        base_url=old.base_url, headers=old.headers, timeout=old.timeout, transport=transport
+    )
+    old.close()
+
+    storage = client.storage
+    old = storage.session
+    storage.session = storage._client = StorageSession(
+        base_url=old.base_url, headers=old.headers, timeout=old.timeout, transport=transport
+    )
+    old.close()
+    logger.info(f"Supabase clients share one HTTP pool (max {max_connections} connections)")
+    return client
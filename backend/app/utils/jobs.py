@@ -0,0 +1,280 @@
+from collections import namedtuple
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Job states reported by /jobs/<id>
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+# A step of a job. ``run(state)`` returns the keys to merge into the job's state; with
+# ``transactional`` it is called as ``run(state, conn)`` inside the transaction that
+# records the step as done, so what it writes to the outbox file commits exactly once.
+# ``state['_attempt']`` is the stage's attempt number; with ``mark_started`` it is saved
+# before the stage runs, so it also counts an attempt cut short by a crash
+Stage = namedtuple('Stage', ['name', 'run', 'transactional', 'mark_started'], defaults=[False, False])
+
+
+class JobFailed(Exception):
+    """Raised by a stage that cannot succeed however often it is retried."""
+
+
+class JobQueue:
+    """Durable multi-stage background jobs, stored in the outbox's SQLite file.
+
+    A job runs its stages in order, and the state each stage returns is saved
+    before the next one starts. A crash or a failing stage therefore resumes at
+    the stage that did not finish, with the earlier results kept. A failing
+    stage is retried on its own with exponential backoff; after ``max_attempts``
+    the job is marked failed and can be retried from that stage.
+
+    Every worker process runs ``workers`` threads. Jobs are claimed with a
+    lease, so a job whose process died is picked up by another once the lease
+    expires.
+    """
+
+    def __init__(self, app, outbox, workers=2, max_attempts=5, retry_base_delay=5, retry_max_delay=300,
+                 lease_seconds=300, poll_interval=2.0):
+        self.app = app
+        self.outbox = outbox
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._kinds = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self._init_db()
+
+    def _init_db(self):
+        with self.outbox.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage_index INTEGER NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    state TEXT NOT NULL,
+                    stages TEXT NOT NULL,
+                    last_error TEXT,
+                    next_attempt_at REAL NOT NULL,
+                    lease_expires_at REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, next_attempt_at)')
+            # One unfinished job per kind and subject (e.g. per user being approved)
+            conn.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active ON jobs (kind, subject) "
+                "WHERE status IN ('queued', 'running')"
+            )
+
+    def register(self, kind, stages):
+        self._kinds[kind] = list(stages)
+
+    def submit(self, kind, subject, state=None):
+        """Queues a job and returns its id; an unfinished job of the same kind
+        and subject is returned instead of starting a second one."""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        stages = {stage.name: {'status': 'pending', 'attempts': 0, 'seconds': None} for stage in self._kinds[kind]}
+        try:
+            with self.outbox.transaction() as conn:
+                conn.execute(
+                    'INSERT INTO jobs (id, kind, subject, status, state, stages, next_attempt_at, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, kind, subject, QUEUED, json.dumps(state or {}), json.dumps(stages), now, now, now),
+                )
+        except sqlite3.IntegrityError:
+            with self.outbox.reader() as conn:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND subject = ? AND status IN ('queued', 'running')",
+                    (kind, subject),
+                ).fetchone()
+            if row is None:
+                raise
+            return row[0], False
+        self._wakeup.set()
+        logger.info("Job %s (%s %s) queued", job_id, kind, subject)
+        return job_id, True
+
+    def get(self, job_id):
+        with self.outbox.reader() as conn:
+            row = conn.execute(
+                'SELECT id, kind, subject, status, stage_index, state, stages, last_error, next_attempt_at, '
+                'created_at, updated_at, finished_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        (job_id, kind, subject, status, stage_index, state, stages, last_error, next_attempt_at,
+         created_at, updated_at, finished_at) = row
+        names = [stage.name for stage in self._kinds.get(kind, ())]
+        stages = json.loads(stages)
+        return {
+            'job_id': job_id,
+            'kind': kind,
+            'subject': subject,
+            'status': status,
+            'stage': names[stage_index] if stage_index < len(names) else None,
+            'stages': [{'name': name, **stages[name]} for name in names if name in stages],
+            'result': {key: value for key, value in json.loads(state).items() if not key.startswith('_')},
+            'last_error': last_error,
+            'next_attempt_at': next_attempt_at if status == QUEUED else None,
+            'created_at': created_at,
+            'updated_at': updated_at,
+            'finished_at': finished_at,
+        }
+
+    def retry(self, job_id):
+        # Put a failed job back in the queue at the stage that failed
+        now = time.time()
+        try:
+            with self.outbox.transaction() as conn:
+                updated = conn.execute(
+                    'UPDATE jobs SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ?, finished_at = NULL '
+                    'WHERE id = ? AND status = ?', (QUEUED, now, now, job_id, FAILED)
+                ).rowcount
+        except sqlite3.IntegrityError:
+            # A newer job for the same subject is already running
+            return False
+        if updated:
+            self._wakeup.set()
+        return bool(updated)
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopped.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'jobs-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job queue started with {self.workers} worker(s) in process {os.getpid()}")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=30)
+        self._threads = []
+
+    def _claim(self):
+        # Looking for a due job is a plain read, so idle polls never take the write lock. The lease is
+        # a conditional update, so no two threads or processes run the same job; a candidate taken
+        # by another worker in between is skipped
+        due = '((status = ? AND next_attempt_at <= ?) OR (status = ? AND lease_expires_at < ?))'
+        for _ in range(3):
+            now = time.time()
+            with self.outbox.reader() as conn:
+                candidate = conn.execute(f'SELECT id FROM jobs WHERE {due} ORDER BY next_attempt_at LIMIT 1',
+                                         (QUEUED, now, RUNNING, now)).fetchone()
+            if candidate is None:
+                return None
+            with self.outbox.transaction() as conn:
+                claimed = conn.execute(
+                    f'UPDATE jobs SET status = ?, lease_expires_at = ?, updated_at = ? WHERE id = ? AND {due}',
+                    (RUNNING, now + self.lease_seconds, now, candidate[0], QUEUED, now, RUNNING, now)
+                ).rowcount
+                if claimed:
+                    return conn.execute('SELECT id, kind, stage_index, attempts, state, stages FROM jobs WHERE id = ?',
+                                        (candidate[0],)).fetchone()
+        return None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming a job: {str(e)}")
+                job = None
+            if job is None:
+                # Jobs queued by other worker processes are found on the next poll
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            with self.app.app_context():
+                self._execute(*job)
+
+    def _execute(self, job_id, kind, stage_index, attempts, state, stages):
+        state, stages = json.loads(state), json.loads(stages)
+        kind_stages = self._kinds[kind]
+        while stage_index < len(kind_stages):
+            stage = kind_stages[stage_index]
+            attempts += 1
+            stages[stage.name].update(status='running', attempts=stages[stage.name]['attempts'] + 1)
+            state['_attempt'] = stages[stage.name]['attempts']
+            if stage.mark_started:
+                with self.outbox.transaction() as conn:
+                    conn.execute('UPDATE jobs SET stages = ?, updated_at = ? WHERE id = ?',
+                                 (json.dumps(stages), time.time(), job_id))
+            started = time.monotonic()
+            try:
+                if stage.transactional:
+                    with self.outbox.transaction() as conn:
+                        state.update(stage.run(state, conn) or {})
+                        stages[stage.name].update(status='done', seconds=round(time.monotonic() - started, 3))
+                        self._save(conn, job_id, stage_index + 1, state, stages)
+                else:
+                    state.update(stage.run(state) or {})
+                    stages[stage.name].update(status='done', seconds=round(time.monotonic() - started, 3))
+                    with self.outbox.transaction() as conn:
+                        self._save(conn, job_id, stage_index + 1, state, stages)
+            except Exception as e:
+                stages[stage.name]['status'] = 'failed'
+                self._record_failure(job_id, kind, stage.name, attempts, state, stages, e)
+                return
+            logger.debug("Job %s stage %s done", job_id, stage.name)
+            stage_index += 1
+            attempts = 0
+
+        now = time.time()
+        with self.outbox.transaction() as conn:
+            conn.execute('UPDATE jobs SET status = ?, finished_at = ?, updated_at = ?, last_error = NULL, '
+                         'lease_expires_at = NULL WHERE id = ?', (SUCCEEDED, now, now, job_id))
+        logger.info("Job %s (%s) succeeded", job_id, kind)
+
+    def _save(self, conn, job_id, stage_index, state, stages):
+        # Checkpoint after a stage; also renews the lease for the next one
+        now = time.time()
+        conn.execute(
+            'UPDATE jobs SET stage_index = ?, attempts = 0, state = ?, stages = ?, lease_expires_at = ?, updated_at = ? '
+            'WHERE id = ?', (stage_index, json.dumps(state), json.dumps(stages), now + self.lease_seconds, now, job_id)
+        )
+
+    def _record_failure(self, job_id, kind, stage_name, attempts, state, stages, error):
+        now = time.time()
+        final = isinstance(error, JobFailed) or attempts >= self.max_attempts
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempts - 1))
+        with self.outbox.transaction() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, attempts = ?, state = ?, stages = ?, last_error = ?, next_attempt_at = ?, '
+                'lease_expires_at = NULL, updated_at = ?, finished_at = ? WHERE id = ?',
+                (FAILED if final else QUEUED, attempts, json.dumps(state), json.dumps(stages),
+                 f'{stage_name}: {str(error)}', now if final else now + delay, now, now if final else None, job_id),
+            )
+        if final:
+            logger.error(f"Job {job_id} ({kind}) failed at {stage_name} after {attempts} attempt(s): {str(error)}")
+        else:
+            logger.warning(f"Job {job_id} ({kind}) stage {stage_name} failed (attempt {attempts}), "
+                           f"retrying in {delay}s: {str(error)}")
+
+    def stats(self):
+        with self.outbox.reader() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {'queued': counts.get(QUEUED, 0), 'running': counts.get(RUNNING, 0), 'failed': counts.get(FAILED, 0),
+                'workers_running': sum(1 for thread in self._threads if thread.is_alive())}
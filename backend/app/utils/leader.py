@@ -0,0 +1,72 @@
+import os
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: no multi-process server, every process leads
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lock files held by this process; more app instances in the same process share the lead
+_held = {}
+_held_lock = threading.Lock()
+
+
+class BackgroundLeader:
+    """Elects one process per host to run the background services.
+
+    Gunicorn runs several workers, each with its own create_app(). Only one of
+    them may own the WhatsApp sessions and drain the outbox, so the workers
+    race for an exclusive flock on ``path``. The others keep retrying every
+    ``retry_interval`` seconds and take over when the leader exits.
+    """
+
+    def __init__(self, path, on_elected, retry_interval=5.0):
+        self.path = path
+        self.on_elected = on_elected
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _try_acquire(self):
+        if fcntl is None:
+            return True
+        with _held_lock:
+            if self.path in _held:
+                return True
+            handle = open(self.path, 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+            _held[self.path] = handle
+            return True
+
+    def _elect(self):
+        self.is_leader = True
+        logger.info(f"Process {os.getpid()} runs the background services")
+        self.on_elected()
+
+    def start(self):
+        if self._try_acquire():
+            self._elect()
+            return
+        logger.info(f"Process {os.getpid()} is a standby for the background services")
+        self._thread = threading.Thread(target=self._retry, name='background-leader', daemon=True)
+        self._thread.start()
+
+    def _retry(self):
+        while not self._stopped.wait(self.retry_interval):
+            if self._try_acquire():
+                try:
+                    self._elect()
+                except Exception as e:
+                    logger.error(f"Failed to start background services: {str(e)}")
+                return
+
+    def stop(self):
+        self._stopped.set()
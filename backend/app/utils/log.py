@@ -0,0 +1,157 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Attributes every LogRecord has; anything else was passed through extra= and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+JsonFormatter.converter = time.gmtime
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Merge the arguments in the caller's thread (they may change later) but leave
+        # formatting, and the traceback as its own field, to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RequestContextFilter(logging.Filter):
+    # Runs in the logging thread, before the record is queued, while the request context is still there
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most ``burst`` records per call site through every ``interval`` seconds.
+
+    Meant for per-scan and per-message INFO/DEBUG lines; warnings and errors always
+    pass, as do records logged with ``extra={'_no_rate_limit': True}`` (the
+    per-request line, which is most useful exactly when traffic is high). The
+    first record after a suppressed stretch carries ``suppressed`` with the number
+    of records dropped.
+    """
+
+    def __init__(self, burst, interval):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}  # (logger, path, line) -> [window start, count, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.burst or getattr(record, '_no_rate_limit', False):
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def configure_logging(config):
+    """Route all logging through one queue drained by a background writer thread.
+
+    Safe to call more than once (every create_app() does); only the first call per
+    process installs the handlers.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        if config['LOG_FORMAT'] == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
+
+        handlers = [logging.StreamHandler()]
+        if config['LOG_FILE']:
+            handlers.append(RotatingFileHandler(config['LOG_FILE'], maxBytes=config['LOG_MAX_BYTES'],
+                                                backupCount=config['LOG_BACKUP_COUNT'], encoding='utf-8'))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.addFilter(RequestContextFilter())
+        queue_handler.addFilter(RateLimitFilter(config['LOG_RATE_LIMIT_BURST'], config['LOG_RATE_LIMIT_INTERVAL']))
+
+        root = logging.getLogger()
+        root.addHandler(queue_handler)
+        root.setLevel(config['LOG_LEVEL'])
+
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def init_request_logging(app):
+    """Tag each request with an id (X-Request-ID) and log its outcome and latency."""
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_log_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        response.headers['X-Request-ID'] = g.get('request_id', '')
+        started = g.pop('request_log_started', None)
+        if started is not None and app.config['LOG_REQUESTS']:
+            logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+                'remote_addr': request.remote_addr,
+                '_no_rate_limit': True,  # One record per request, however many there are
+            })
+        return response
@@ -0,0 +1,274 @@
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request
+from flask_jwt_extended import verify_jwt_in_request
+import bisect
+import functools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-millisecond roster scans up to Selenium sends
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', repr(bound))]), cumulative))
+            samples.append((f'{self.name}_bucket', _format_labels(self.labelnames, key, [('le', '+Inf')]), state[-1]))
+            samples.append((f'{self.name}_sum', _format_labels(self.labelnames, key), state[-2]))
+            samples.append((f'{self.name}_count', _format_labels(self.labelnames, key), state[-1]))
+        return samples
+
+
+class Gauge:
+    """Read at scrape time from a callback returning a number, or None to skip."""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def samples(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} failed: {str(e)}")
+            return []
+        return [] if value is None else [(self.name, '', value)]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._scrape = threading.local()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback):
+        # Re-registering replaces the callback, so a new app instance takes over its gauges
+        metric = Gauge(name, documentation, callback)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def cached(self, key, load):
+        """Call ``load`` once per scrape for ``key``, so gauges sharing a source read it once."""
+        values = getattr(self._scrape, 'values', None)
+        if values is None:
+            return load()
+        if key not in values:
+            values[key] = load()
+        return values[key]
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        self._scrape.values = {}
+        try:
+            for metric in metrics:
+                lines.append(f'# HELP {metric.name} {metric.documentation}')
+                lines.append(f'# TYPE {metric.name} {metric.type}')
+                for name, labels, value in metric.samples():
+                    lines.append(f'{name}{labels} {value}')
+        finally:
+            del self._scrape.values
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('blueprint', 'endpoint', 'method', 'status'))
+REQUEST_ERRORS = REGISTRY.counter(
+    'http_request_errors_total', 'HTTP responses with a 5xx status', ('blueprint', 'endpoint', 'status'))
+DEPENDENCY_DURATION = REGISTRY.histogram(
+    'dependency_duration_seconds', 'Time spent in database, storage, QR rendering, bcrypt and messaging calls',
+    ('dependency', 'operation'))
+DEPENDENCY_ERRORS = REGISTRY.counter(
+    'dependency_errors_total', 'Dependency calls that raised', ('dependency', 'operation'))
+
+
+@contextmanager
+def span(dependency, operation):
+    """Time a dependency call; inside a request it also joins the slow-request breakdown."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        DEPENDENCY_DURATION.observe(elapsed, dependency=dependency, operation=operation)
+        if has_request_context() and '_request_started' in g:
+            g.setdefault('_spans', []).append((f'{dependency}.{operation}', elapsed))
+
+
+def timed(dependency, operation=None):
+    # Decorator form of span(); the operation defaults to the function name
+    def decorator(func):
+        name = operation or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(dependency, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _breakdown(spans, total):
+    grouped = {}
+    for name, elapsed in spans:
+        count, seconds = grouped.get(name, (0, 0.0))
+        grouped[name] = (count + 1, seconds + elapsed)
+    parts = [f'{name} {seconds * 1000:.1f}ms x{count}'
+             for name, (count, seconds) in sorted(grouped.items(), key=lambda item: -item[1][1])]
+    # Spans can overlap (thread pools), so "other" is only meaningful when they do not
+    other = total - sum(seconds for _, seconds in grouped.values())
+    if other > 0:
+        parts.append(f'other {other * 1000:.1f}ms')
+    return ', '.join(parts)
+
+
+def _register_gauges(app):
+    def stat(service, key):
+        def read():
+            obj = getattr(app, service, None)
+            return REGISTRY.cached(service, obj.stats).get(key) if obj is not None else None
+        return read
+
+    REGISTRY.gauge('outbox_queue_depth', 'Messages waiting in the outbox', stat('whatsapp_outbox', 'queue_depth'))
+    REGISTRY.gauge('outbox_oldest_pending_age_seconds', 'Age of the oldest undelivered message',
+                   stat('whatsapp_outbox', 'oldest_pending_age_seconds'))
+    REGISTRY.gauge('outbox_dead_letters', 'Messages that exhausted their retries', stat('whatsapp_outbox', 'dead_letters'))
+    REGISTRY.gauge('outbox_sent', 'Messages delivered (all processes)', stat('whatsapp_outbox', 'sent'))
+    REGISTRY.gauge('outbox_workers_running', 'Outbox delivery threads alive', stat('whatsapp_outbox', 'workers_running'))
+    REGISTRY.gauge('roster_pending_sync', 'Check-ins not yet written to the database', stat('roster', 'pending_sync'))
+    REGISTRY.gauge('roster_sync_lag_seconds', 'Age of the oldest unsynced check-in', stat('roster', 'sync_lag_seconds'))
+    REGISTRY.gauge('login_verifications_in_flight', 'Password checks running or queued', stat('password_verifier', 'in_flight'))
+    REGISTRY.gauge('login_verifications_rejected', 'Password checks refused because the queue was full',
+                   stat('password_verifier', 'rejected'))
+    REGISTRY.gauge('jobs_queued', 'Background jobs waiting to run', stat('jobs', 'queued'))
+    REGISTRY.gauge('jobs_failed', 'Background jobs that exhausted their retries', stat('jobs', 'failed'))
+    REGISTRY.gauge('broadcasts_running', 'Broadcast campaigns still queueing messages', stat('broadcasts', 'running'))
+    REGISTRY.gauge('dashboard_subscribers', 'Open /dashboard/stream connections', stat('dashboard', 'subscribers'))
+    REGISTRY.gauge('admin_cache_entries', 'Cached admin records', stat('admin_cache', 'entries'))
+    REGISTRY.gauge('user_lookups', 'User lookups by ID (this process)', stat('user_loader', 'lookups'))
+    REGISTRY.gauge('user_lookup_queries', 'Database queries made for user lookups', stat('user_loader', 'queries'))
+    REGISTRY.gauge('user_lookup_round_trips_saved', 'User lookups answered without a query of their own',
+                   stat('user_loader', 'round_trips_saved'))
+    REGISTRY.gauge('user_lookup_retries', 'User lookups retried after a transient error', stat('user_loader', 'retries'))
+
+
+def init_metrics(app):
+    """Register request timing, the slow-request log and the /metrics endpoint."""
+
+    @app.before_request
+    def start_request_timer():
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def note_status(response):
+        g._response_status = response.status_code
+        return response
+
+    # Recorded at teardown, which also runs when an unhandled exception skipped after_request
+    @app.teardown_request
+    def record_request(exc):
+        started = g.pop('_request_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        status = g.pop('_response_status', None) or 500
+        blueprint = request.blueprint or ''
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_DURATION.observe(elapsed, blueprint=blueprint, endpoint=endpoint, method=request.method, status=status)
+        if status >= 500:
+            REQUEST_ERRORS.inc(blueprint=blueprint, endpoint=endpoint, status=status)
+
+        threshold = current_app.config['SLOW_REQUEST_THRESHOLD_MS']
+        if threshold and elapsed * 1000 >= threshold:
+            logger.warning(f"Slow request {request.method} {request.path} -> {status} "
+                           f"in {elapsed * 1000:.1f}ms: {_breakdown(g.get('_spans', []), elapsed)}")
+
+    _register_gauges(app)
+
+    # Prometheus text exposition format; needs an admin token unless METRICS_PUBLIC is set
+    def metrics():
+        if not current_app.config['METRICS_PUBLIC']:
+            verify_jwt_in_request()
+        return current_app.response_class(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
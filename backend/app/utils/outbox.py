@@ -0,0 +1,346 @@
+from flask import current_app
+from contextlib import contextmanager
+import os
+import socket
+import sqlite3
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Under gevent workers threading.local is per greenlet; greenlets on one OS thread share a reader
+    from gevent.monkey import get_original
+    _thread_local = get_original('threading', 'local')
+except ImportError:
+    _thread_local = threading.local
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def wait_time(self):
+        with self._lock:
+            self._refill()
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def acquire(self, stop_event=None):
+        # Block until a token is available; returns False if stop_event was set first
+        while not self.try_acquire():
+            delay = self.wait_time()
+            if stop_event is not None:
+                if stop_event.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+        return True
+
+
+def _owner():
+    # Read per claim, not once, so that a forked worker claims under its own pid
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class WhatsAppOutbox:
+    """Persistent outbox for WhatsApp messages.
+
+    Routes only enqueue. Messages are stored in a local SQLite file so they
+    survive a restart, and a background worker sends them through ``send``
+    under a token-bucket rate limit. Failures are retried with exponential
+    backoff and end up in the dead-letter list after ``max_attempts``.
+
+    Every process can enqueue, but only the one that runs ``start()`` sends. A
+    message being sent is leased to its process for ``lease_seconds``; one
+    still marked as sending after that (its process died mid-send) goes back
+    in the queue.
+    """
+
+    def __init__(self, send, db_path='outbox.db', rate_per_minute=10, burst=1,
+                 max_attempts=5, retry_base_delay=30, retry_max_delay=1800, workers=1, lease_seconds=120):
+        self.send = send
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.lease_seconds = lease_seconds
+        self._next_recovery_at = 0.0
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._readers = _thread_local()
+        self._db_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+        self.sent_total = 0
+        self.failed_attempts_total = 0
+        self.dead_lettered_total = 0
+        self.last_send_latency = None
+        self.max_send_latency = 0.0
+        self._send_latency_sum = 0.0
+        self._init_db()
+
+    def _init_db(self):
+        with self._db_lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    phone_number TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    sent_at REAL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)')
+            # Broadcast campaign a message belongs to (see app/utils/broadcast.py); added to older files in place
+            columns = {row[1] for row in self._conn.execute('PRAGMA table_info(outbox)')}
+            if 'campaign_id' not in columns:
+                self._conn.execute('ALTER TABLE outbox ADD COLUMN campaign_id INTEGER')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_campaign ON outbox (campaign_id, status)')
+            # Lease of a message being sent (see _requeue_expired); added to older files in place
+            for column, column_type in (('claimed_at', 'REAL'), ('claimed_by', 'TEXT')):
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} {column_type}')
+
+    @contextmanager
+    def transaction(self):
+        # Statements run on the yielded connection commit together, e.g. a queued message and a campaign checkpoint
+        with self._db_lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @contextmanager
+    def reader(self):
+        # Plain SELECTs: in WAL mode they neither take the write lock nor wait for it
+        conn = getattr(self._readers, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA query_only = ON')
+            self._readers.conn = conn
+        yield conn
+
+    def enqueue(self, phone_number, message, campaign_id=None, conn=None):
+        # With conn (from transaction()) the insert joins the caller's transaction
+        now = time.time()
+        params = (phone_number, message, now, now, campaign_id)
+        sql = 'INSERT INTO outbox (phone_number, message, next_attempt_at, created_at, campaign_id) VALUES (?, ?, ?, ?, ?)'
+        if conn is not None:
+            cursor = conn.execute(sql, params)
+        else:
+            with self._db_lock:
+                cursor = self._conn.execute(sql, params)
+        self._wakeup.set()
+        logger.debug("Message %s to %s queued", cursor.lastrowid, phone_number)
+        return cursor.lastrowid
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopped.clear()
+        self._requeue_expired()
+        # One worker per sending session so a session pool is used in parallel
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'whatsapp-outbox-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"WhatsApp outbox started with {self.workers} worker(s)")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=30)
+        self._threads = []
+        logger.info("WhatsApp outbox worker stopped")
+
+    def _seconds_until_due(self):
+        with self._db_lock:
+            next_attempt_at = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+        return None if next_attempt_at is None else next_attempt_at - time.time()
+
+    def _requeue_expired(self):
+        # Messages whose sending process died mid-send; a lease held by this process is still being sent
+        now = time.time()
+        self._next_recovery_at = now + min(self.lease_seconds, 30)
+        with self._db_lock:
+            requeued = self._conn.execute(
+                "UPDATE outbox SET status = 'pending', claimed_at = NULL, claimed_by = NULL "
+                "WHERE status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?) "
+                "AND (claimed_by IS NULL OR claimed_by != ?)",
+                (now - self.lease_seconds, _owner()),
+            ).rowcount
+        if requeued:
+            logger.warning(f"Requeued {requeued} outbox message(s) left unsent by a stopped process")
+            self._wakeup.set()
+
+    def _claim_next(self):
+        # Select and lease in one critical section so parallel workers never share a message
+        now = time.time()
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT id, phone_number, message, attempts FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'sending', claimed_at = ?, claimed_by = ? WHERE id = ?",
+                    (now, _owner(), row[0]),
+                )
+        return row
+
+    def _release(self, message_id):
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'pending', claimed_at = NULL, claimed_by = NULL WHERE id = ?", (message_id,)
+            )
+
+    def _run(self):
+        while not self._stopped.is_set():
+            if time.time() >= self._next_recovery_at:
+                self._requeue_expired()
+            delay = self._seconds_until_due()
+            if delay is None or delay > 0:
+                # Sleep until the next retry is due or something new is queued
+                self._wakeup.wait(5 if delay is None else min(delay, 5))
+                self._wakeup.clear()
+                continue
+            row = self._claim_next()
+            if row is None:
+                # Another worker took the due message
+                continue
+            # The rate limit is applied to messages actually sent, not to workers looking for one
+            if not self.bucket.acquire(self._stopped):
+                self._release(row[0])
+                break
+            self._deliver(*row)
+
+    def _deliver(self, message_id, phone_number, message, attempts):
+        started = time.monotonic()
+        try:
+            self.send(phone_number, message)
+        except Exception as e:
+            self._record_failure(message_id, phone_number, attempts + 1, str(e))
+            return
+        latency = time.monotonic() - started
+
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL, "
+                "claimed_at = NULL, claimed_by = NULL WHERE id = ?",
+                (attempts + 1, time.time(), message_id),
+            )
+        with self._stats_lock:
+            self.sent_total += 1
+            self.last_send_latency = latency
+            self.max_send_latency = max(self.max_send_latency, latency)
+            self._send_latency_sum += latency
+        logger.info("Outbox message %s sent to %s in %.2fs", message_id, phone_number, latency)
+
+    def _record_failure(self, message_id, phone_number, attempts, error):
+        with self._stats_lock:
+            self.failed_attempts_total += 1
+        if attempts >= self.max_attempts:
+            with self._db_lock:
+                self._conn.execute(
+                    "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ?, claimed_at = NULL, "
+                    "claimed_by = NULL WHERE id = ?",
+                    (attempts, error, message_id),
+                )
+            with self._stats_lock:
+                self.dead_lettered_total += 1
+            logger.error(f"Outbox message {message_id} to {phone_number} dead-lettered after {attempts} attempts: {error}")
+            return
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (attempts - 1))
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = ?, "
+                "claimed_at = NULL, claimed_by = NULL WHERE id = ?",
+                (attempts, error, time.time() + delay, message_id),
+            )
+        logger.warning(f"Outbox message {message_id} to {phone_number} failed (attempt {attempts}), retrying in {delay}s: {error}")
+
+    def retry_dead_letter(self, message_id):
+        with self._db_lock:
+            updated = self._conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = ? WHERE id = ? AND status = 'dead'",
+                (time.time(), message_id),
+            ).rowcount
+        if updated:
+            self._wakeup.set()
+        return bool(updated)
+
+    def dead_letters(self, limit=50):
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT id, phone_number, message, attempts, last_error, created_at FROM outbox "
+                "WHERE status = 'dead' ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {'id': row[0], 'phone_number': row[1], 'message': row[2], 'attempts': row[3],
+             'last_error': row[4], 'created_at': row[5]}
+            for row in rows
+        ]
+
+    def stats(self):
+        with self._db_lock:
+            counts = dict(self._conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')"
+            ).fetchone()[0]
+        return {
+            'queue_depth': counts.get('pending', 0) + counts.get('sending', 0),
+            'oldest_pending_age_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'sent': counts.get('sent', 0),
+            'dead_letters': counts.get('dead', 0),
+            'sent_this_process': self.sent_total,
+            'failed_attempts': self.failed_attempts_total,
+            'dead_lettered_this_process': self.dead_lettered_total,
+            'send_latency_seconds': {
+                'last': round(self.last_send_latency, 3) if self.last_send_latency is not None else None,
+                'avg': round(self._send_latency_sum / self.sent_total, 3) if self.sent_total else None,
+                'max': round(self.max_send_latency, 3),
+            },
+            'rate_per_minute': round(self.bucket.rate * 60, 2),
+            'workers_running': sum(1 for thread in self._threads if thread.is_alive()),
+        }
+
+
+def send_whatsapp_message(phone_number, message):
+    # Only queues the message; the outbox worker delivers it under the rate limit
+    outbox = current_app.whatsapp_outbox
+    message_id = outbox.enqueue(phone_number, message)
+    logger.info("Message %s to %s added to outbox", message_id, phone_number)
+    return message_id
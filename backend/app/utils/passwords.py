@@ -0,0 +1,59 @@
+from concurrent.futures import TimeoutError
+import bcrypt
+import logging
+import threading
+from .cpu import cpu_executor
+
+logger = logging.getLogger(__name__)
+
+
+class VerifierBusy(Exception):
+    pass
+
+
+class PasswordVerifier:
+    """Runs bcrypt checks on a small dedicated pool instead of the request thread.
+
+    At most ``max_workers`` hashes run at once (bcrypt releases the GIL, so
+    they run in parallel) and at most ``max_queue`` more wait; beyond that
+    ``verify`` raises VerifierBusy at once rather than piling up work. The pool
+    threads are OS threads under gevent workers too (see app.utils.cpu).
+    """
+
+    def __init__(self, max_workers=2, max_queue=16):
+        self._executor = cpu_executor(max_workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def verify(self, password, hashed, timeout=None):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise VerifierBusy('Too many logins in progress')
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._executor.submit(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            # The check keeps its slot until it finishes
+            raise VerifierBusy('Password check timed out')
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': self.in_flight, 'rejected': self.rejected}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
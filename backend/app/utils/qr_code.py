@@ -1,32 +1,205 @@
 import qrcode
+from qrcode.image.svg import SvgPathImage
 from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import hashlib
+import os
 import re
 import logging
-from flask import current_app
+from flask import current_app, url_for
+from .metrics import timed
+from .cpu import run_cpu_bound
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def generate_qr_code_image(data):
+QR_CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# In-memory LRU of rendered images keyed by payload and render parameters
+_qr_cache = OrderedDict()
+_qr_cache_lock = threading.Lock()
+_qr_cache_max_entries = 1024
+
+def configure_qr_cache(max_entries):
+    global _qr_cache_max_entries
+    with _qr_cache_lock:
+        _qr_cache_max_entries = max_entries
+        while len(_qr_cache) > max_entries:
+            _qr_cache.popitem(last=False)
+
+def qr_render_options():
+    # Render parameters from the app config, passed explicitly so worker processes need no app context
+    return {
+        'box_size': current_app.config['QR_BOX_SIZE'],
+        'border': current_app.config['QR_BORDER'],
+        'image_format': current_app.config['QR_IMAGE_FORMAT'],
+        'cache_dir': current_app.config['QR_CACHE_DIR'],
+    }
+
+def qr_code_payload(user_id):
+    # What the QR code encodes: a signed payload, or the bare user_id when signing is off
+    if current_app.config['QR_SIGNING_ENABLED']:
+        return current_app.qr_signer.sign(user_id)
+    return user_id
+
+def qr_code_file_name(user_id):
+    return f"{user_id}.{current_app.config['QR_IMAGE_FORMAT']}"
+
+def _cache_key(data, box_size=10, border=4, image_format='png', cache_dir=None):
+    return (data, box_size, border, image_format)
+
+def qr_code_etag(data, box_size=10, border=4, image_format='png', cache_dir=None):
+    # Rendering is deterministic, so the render inputs identify the image bytes without rendering
+    return hashlib.sha256(repr(_cache_key(data, box_size, border, image_format)).encode('utf-8')).hexdigest()[:32]
+
+def qr_code_link(user_id):
+    # Link to the image served by GET /qr_codes/<user_id>.<format>, used instead of a storage URL
+    base_url = current_app.config['QR_PUBLIC_BASE_URL']
+    if base_url:
+        return f"{base_url.rstrip('/')}/qr_codes/{qr_code_file_name(user_id)}"
+    return url_for('qr_code.qr_code_image', user_id=user_id, image_format=current_app.config['QR_IMAGE_FORMAT'],
+                   _external=True)
+
+def _cache_put(key, image):
+    with _qr_cache_lock:
+        _qr_cache[key] = image
+        _qr_cache.move_to_end(key)
+        while len(_qr_cache) > _qr_cache_max_entries:
+            _qr_cache.popitem(last=False)
+
+def _render_qr_code(data, box_size, border, image_format):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    bio = BytesIO()
+    if image_format == 'svg':
+        qr.make_image(image_factory=SvgPathImage).save(bio)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(bio, 'PNG')
+    return bio.getvalue()
+
+@timed('qr_render')
+def generate_qr_code_image(data, box_size=10, border=4, image_format='png', cache_dir=None):
+    if image_format not in QR_CONTENT_TYPES:
+        raise ValueError(f'Unsupported QR image format: {image_format}')
+    key = _cache_key(data, box_size, border, image_format)
+    with _qr_cache_lock:
+        image = _qr_cache.get(key)
+        if image is not None:
+            _qr_cache.move_to_end(key)
+            return image
+
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        bio = BytesIO()
-        img.save(bio, 'PNG')
-        logger.info(f"QR code generated for data: {data}")
-        return bio.getvalue()
+        disk_path = None
+        if cache_dir:
+            digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+            disk_path = os.path.join(cache_dir, f'{digest}.{image_format}')
+            if os.path.exists(disk_path):
+                with open(disk_path, 'rb') as f:
+                    image = f.read()
+        if image is None:
+            image = run_cpu_bound(_render_qr_code, data, box_size, border, image_format)
+            logger.info("QR code generated for data: %s", data)
+            if disk_path:
+                # Write then rename so concurrent renderers never read a partial file
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = f'{disk_path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(image)
+                os.replace(tmp_path, disk_path)
     except Exception as e:
         logger.error(f"Error generating QR code for {data}: {str(e)}")
         raise
 
+    _cache_put(key, image)
+    return image
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def _get_render_pool(max_workers):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # Spawned, not forked: a fork copies the locks held by this process's other threads
+            # (outbox, jobs, logging) and can deadlock on them in the child
+            _render_pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return _render_pool
+
+def _reset_render_pool():
+    # A forked worker must start its own pool; the parent's processes belong to the parent
+    global _render_pool, _render_pool_lock
+    _render_pool = None
+    _render_pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_render_pool)
+
+@timed('qr_render')
+def render_qr_code_images(payloads, max_workers, **options):
+    # Render many QR codes in a process pool; returns {payload: bytes or Exception}
+    results = {}
+    pending = []
+    for payload in payloads:
+        with _qr_cache_lock:
+            image = _qr_cache.get(_cache_key(payload, **options))
+        if image is not None:
+            results[payload] = image
+        else:
+            pending.append(payload)
+    if not pending:
+        return results
+
+    pool = _get_render_pool(max_workers)
+    futures = {payload: pool.submit(generate_qr_code_image, payload, **options) for payload in pending}
+    for payload, future in futures.items():
+        try:
+            results[payload] = future.result()
+        except Exception as e:
+            logger.error(f"Error rendering QR code for {payload}: {str(e)}")
+            results[payload] = e
+            continue
+        # Keep worker results in this process's cache too
+        _cache_put(_cache_key(payload, **options), results[payload])
+    return results
+
+# Content hash of the last upload per object, so identical bytes skip the storage round trip
+_uploaded_hashes = {}
+_uploaded_hashes_lock = threading.Lock()
+
+def _upload_record_path(bucket_name, file_name):
+    cache_dir = current_app.config.get('QR_CACHE_DIR')
+    if not cache_dir:
+        return None
+    digest = hashlib.sha256(f'{bucket_name}/{file_name}'.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'uploaded', digest)
+
+def _last_uploaded_hash(bucket_name, file_name):
+    with _uploaded_hashes_lock:
+        content_hash = _uploaded_hashes.get((bucket_name, file_name))
+    if content_hash is None:
+        record_path = _upload_record_path(bucket_name, file_name)
+        if record_path and os.path.exists(record_path):
+            with open(record_path) as f:
+                content_hash = f.read().strip()
+    return content_hash
+
+def _record_upload(bucket_name, file_name, content_hash):
+    with _uploaded_hashes_lock:
+        _uploaded_hashes[(bucket_name, file_name)] = content_hash
+    record_path = _upload_record_path(bucket_name, file_name)
+    if record_path:
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        with open(record_path, 'w') as f:
+            f.write(content_hash)
+
+@timed('storage')
 def upload_file_to_supabase(file_content, bucket_name, file_name, content_type='image/png'):
     supabase = current_app.supabase
     try:
@@ -40,12 +213,19 @@ def upload_file_to_supabase(file_content, bucket_name, file_name, content_type='
         else:
             raise ValueError('Invalid file content type')
 
-        # Check if file already exists and overwrite if necessary
-        supabase.storage.from_(bucket_name).remove([file_name])
-        response = supabase.storage.from_(bucket_name).upload(file_name, file_content, {'content-type': content_type})
+        url = f"{current_app.config['SUPABASE_URL']}/storage/v1/object/public/{bucket_name}/{file_name}"
+        content_hash = hashlib.sha256(file_content).hexdigest()
+        if _last_uploaded_hash(bucket_name, file_name) == content_hash:
+            logger.debug("Skipping upload of unchanged file: %s", url)
+            return url
+
+        # Single upsert call overwrites an existing object, no separate remove needed
+        response = supabase.storage.from_(bucket_name).upload(
+            file_name, file_content, {'content-type': content_type, 'x-upsert': 'true'}
+        )
         if response.status_code == 200 or response.status_code == 201:
-            url = f"{current_app.config['SUPABASE_URL']}/storage/v1/object/public/{bucket_name}/{file_name}"
-            logger.info(f"File uploaded to Supabase: {url}")
+            _record_upload(bucket_name, file_name, content_hash)
+            logger.info("File uploaded to Supabase: %s", url)
             return url
         else:
             logger.error(f"Upload failed with status {response.status_code}: {response.content}")
@@ -63,7 +243,7 @@ def format_phone_number(phone_number):
             phone_number = '+88' + phone_number[1:]
         elif not phone_number.startswith('+'):
             phone_number = '+880' + phone_number
-        logger.debug(f"Formatted phone number: {phone_number}")
+        logger.debug("Formatted phone number: %s", phone_number)
         return phone_number
     except Exception as e:
         logger.error(f"Error formatting phone number {phone_number}: {str(e)}")
@@ -0,0 +1,59 @@
+import base64
+import hashlib
+import hmac
+import uuid
+
+PAYLOAD_VERSION = 'v1'
+SIGNATURE_LENGTH = 16  # base64url characters, 96 bits of the HMAC-SHA256
+
+
+class InvalidQRPayload(ValueError):
+    pass
+
+
+class QRSigner:
+    """Signs and verifies QR payloads of the form ``v1.<event_id>.<user_id>.<signature>``.
+
+    Verification is a pure-CPU check, so forged, garbled or wrong-event codes
+    are rejected before any database lookup. With ``accept_unsigned`` a bare
+    ``user_id`` (codes issued before signing) is still accepted.
+    """
+
+    def __init__(self, secret_key, event_id, accept_unsigned=True):
+        if not secret_key:
+            raise ValueError('A secret key is required to sign QR payloads')
+        if '.' in event_id:
+            raise ValueError('Event ID must not contain "."')
+        self.event_id = event_id
+        self.accept_unsigned = accept_unsigned
+        self._mac = hmac.new(secret_key.encode('utf-8'), digestmod=hashlib.sha256)
+
+    def _signature(self, message):
+        mac = self._mac.copy()
+        mac.update(message.encode('utf-8'))
+        return base64.urlsafe_b64encode(mac.digest()).decode('ascii')[:SIGNATURE_LENGTH]
+
+    def sign(self, user_id):
+        message = f'{PAYLOAD_VERSION}.{self.event_id}.{user_id}'
+        return f'{message}.{self._signature(message)}'
+
+    def verify(self, payload):
+        # Returns the user_id carried by a valid payload, raises InvalidQRPayload otherwise
+        parts = payload.split('.')
+        if len(parts) == 1:
+            if not self.accept_unsigned:
+                raise InvalidQRPayload('Unsigned QR code')
+            try:
+                uuid.UUID(payload)
+            except ValueError:
+                raise InvalidQRPayload('Malformed QR code')
+            return payload
+        if len(parts) != 4 or parts[0] != PAYLOAD_VERSION:
+            raise InvalidQRPayload('Malformed QR code')
+        _, event_id, user_id, signature = parts
+        if event_id != self.event_id:
+            raise InvalidQRPayload('QR code is for a different event')
+        expected = self._signature(f'{PAYLOAD_VERSION}.{event_id}.{user_id}')
+        if not hmac.compare_digest(signature, expected):
+            raise InvalidQRPayload('Invalid QR code signature')
+        return user_id
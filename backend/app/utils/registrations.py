@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+import hashlib
+import json
+import re
+import threading
+import logging
+from .ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_phone_number(phone_number):
+    # National number without the +88 / 0 prefixes, so 01712345678 and +881712345678 compare equal.
+    # Must match the users_phone_key expression index (migrations/001_unique_registrations.sql).
+    digits = re.sub(r'\D', '', phone_number or '')
+    return re.sub(r'^(88)?0?', '', digits)
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when an Idempotency-Key comes back with a different request body."""
+
+
+def _fingerprint(fields):
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RegistrationIndex:
+    """In-process index of registrations by transaction_id and normalized phone.
+
+    Answers duplicate checks for /users/register and /users/import without a
+    database round trip. It is warmed from the users table and updated as
+    users are inserted; the unique indexes in the database remain the final
+    word for registrations made by other processes. Also remembers responses
+    per Idempotency-Key.
+    """
+
+    def __init__(self, idempotency_ttl=86400, claim_timeout=10):
+        self.claim_timeout = claim_timeout
+        self._by_transaction = {}
+        self._by_phone = {}
+        self._responses = TTLCache(idempotency_ttl, max_entries=100000)
+        self._in_flight = {}  # claim key -> Event set when its request finishes
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, store, page_size=1000):
+        by_transaction, by_phone = {}, {}
+        after = None
+        while True:
+            rows = store.list_users('user_id, phone_number, transaction_id, created_at', after=after, limit=page_size)
+            for row in rows:
+                by_transaction.setdefault(row['transaction_id'], row['user_id'])
+                by_phone.setdefault(normalize_phone_number(row['phone_number']), row['user_id'])
+            if len(rows) < page_size:
+                break
+            after = (rows[-1]['created_at'], rows[-1]['user_id'])
+        with self._lock:
+            # Keep registrations made while the load was in flight
+            by_transaction.update(self._by_transaction)
+            by_phone.update(self._by_phone)
+            self._by_transaction, self._by_phone = by_transaction, by_phone
+            self.loaded = True
+        logger.info(f"Registration index loaded with {len(by_transaction)} registrations")
+
+    def add(self, user):
+        with self._lock:
+            self._by_transaction.setdefault(user['transaction_id'], user['user_id'])
+            self._by_phone.setdefault(normalize_phone_number(user['phone_number']), user['user_id'])
+
+    def find(self, fields):
+        """Returns (user_id, matched field) of an existing registration, or None."""
+        with self._lock:
+            user_id = self._by_transaction.get(fields['transaction_id'])
+            if user_id:
+                return user_id, 'transaction_id'
+            user_id = self._by_phone.get(normalize_phone_number(fields['phone_number']))
+            if user_id:
+                return user_id, 'phone_number'
+        return None
+
+    @contextmanager
+    def claim(self, fields, idempotency_key=None):
+        # Serializes requests for the same transaction, phone or idempotency key (a retried
+        # form arriving while the first attempt is still inserting); unrelated ones run in parallel
+        keys = [f"transaction:{fields['transaction_id']}", f"phone:{normalize_phone_number(fields['phone_number'])}"]
+        if idempotency_key:
+            keys.append(f'idempotency:{idempotency_key}')
+        while True:
+            with self._lock:
+                busy = next((self._in_flight[key] for key in keys if key in self._in_flight), None)
+                if busy is None:
+                    event = threading.Event()
+                    for key in keys:
+                        self._in_flight[key] = event
+                    break
+            if not busy.wait(self.claim_timeout):
+                raise TimeoutError('Timed out waiting for a concurrent registration')
+        try:
+            yield
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._in_flight.pop(key, None)
+            event.set()
+
+    def remember(self, idempotency_key, fields, body, status):
+        if idempotency_key:
+            self._responses.set(idempotency_key, (_fingerprint(fields), body, status))
+
+    def replay(self, idempotency_key, fields):
+        """Returns the (body, status) recorded for ``idempotency_key``, or None.
+
+        Raises IdempotencyKeyReused if the key was recorded for a form with
+        other fields, rather than answering with someone else's registration.
+        """
+        recorded = self._responses.get(idempotency_key) if idempotency_key else None
+        if recorded is None:
+            return None
+        fingerprint, body, status = recorded
+        if fingerprint != _fingerprint(fields):
+            raise IdempotencyKeyReused('Idempotency-Key was already used for a different registration')
+        return body, status
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': self.loaded,
+                'transactions': len(self._by_transaction),
+                'phones': len(self._by_phone),
+                'idempotency_keys': self._responses.stats()['entries'],
+            }
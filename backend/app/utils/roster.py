@@ -0,0 +1,178 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Compact per-user status flags held by the roster
+CHECKED_IN = 0x01
+CHECK_IN_SYNCED = 0x02
+
+
+class CheckInRoster:
+    """In-memory roster of approved users used to answer gate scans.
+
+    Only a small int of status flags is kept per ``user_id``. Check-ins are
+    applied in memory and written back to the database in batches by a
+    background thread.
+    """
+
+    def __init__(self, store, flush_interval=1.0, flush_batch_size=200):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self._flags = {}
+        self._pending = {}  # user_id -> time the check-in was accepted
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.loaded = False
+        self.flushed_count = 0
+        self.failed_flushes = 0
+        self.last_flush_at = None
+        self.last_flush_error = None
+
+    def load(self, page_size=1000):
+        # Paged: one request is capped by the Supabase max-rows setting
+        flags, after = {}, None
+        while True:
+            page = self.store.list_users('user_id, check_in_status, created_at', filters={'approval_status': 'approved'},
+                                         after=after, limit=page_size)
+            for row in page:
+                if row['check_in_status'] == 'checked_in':
+                    flags[row['user_id']] = CHECKED_IN | CHECK_IN_SYNCED
+                else:
+                    flags[row['user_id']] = 0
+            if len(page) < page_size:
+                break
+            after = (page[-1]['created_at'], page[-1]['user_id'])
+        with self._lock:
+            # Keep check-ins accepted while the load was in flight, including ones made
+            # through the database before the roster was first loaded
+            for user_id, user_flags in self._flags.items():
+                if user_flags & CHECKED_IN:
+                    flags[user_id] = user_flags
+            for user_id in self._pending:
+                flags[user_id] = CHECKED_IN
+            self._flags = flags
+            self.loaded = True
+        logger.info(f"Check-in roster loaded with {len(flags)} approved users")
+
+    def __contains__(self, user_id):
+        return user_id in self._flags
+
+    def __len__(self):
+        return len(self._flags)
+
+    def add(self, user_id, checked_in=False):
+        with self._lock:
+            self._flags[user_id] = (CHECKED_IN | CHECK_IN_SYNCED) if checked_in else 0
+
+    def discard(self, user_id):
+        with self._lock:
+            self._flags.pop(user_id, None)
+            self._pending.pop(user_id, None)
+
+    def check_in(self, user_id):
+        """Check a user in from memory.
+
+        Returns ``'checked_in'``, ``'already_checked_in'`` or ``None`` when the
+        user is not in the roster.
+        """
+        with self._lock:
+            flags = self._flags.get(user_id)
+            if flags is None:
+                return None
+            if flags & CHECKED_IN:
+                return 'already_checked_in'
+            self._flags[user_id] = flags | CHECKED_IN
+            self._pending[user_id] = time.time()
+            pending_count = len(self._pending)
+        if pending_count >= self.flush_batch_size:
+            self._wakeup.set()
+        return 'checked_in'
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='roster-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        # Write back whatever is left before the process exits
+        while self._pending and self.flush():
+            pass
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while self._pending and not self._stopped.is_set():
+                if not self.flush():
+                    break
+
+    def flush(self):
+        """Write one batch of pending check-ins to the database.
+
+        Returns True if the batch was written.
+        """
+        with self._lock:
+            batch = list(self._pending.items())[:self.flush_batch_size]
+        if not batch:
+            return True
+        user_ids = [user_id for user_id, _ in batch]
+        try:
+            self.store.check_in_users(user_ids)
+        except Exception as e:
+            self.failed_flushes += 1
+            self.last_flush_error = str(e)
+            logger.error(f"Error syncing {len(user_ids)} check-ins to the database: {str(e)}")
+            return False
+
+        with self._lock:
+            for user_id, accepted_at in batch:
+                # Leave entries that were re-queued after this batch was taken
+                if self._pending.get(user_id) == accepted_at:
+                    del self._pending[user_id]
+                if user_id in self._flags:
+                    self._flags[user_id] |= CHECK_IN_SYNCED
+        self.flushed_count += len(user_ids)
+        self.last_flush_at = time.time()
+        self.last_flush_error = None
+        logger.debug("Synced %s check-ins to the database", len(user_ids))
+        return True
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+            oldest = min(self._pending.values()) if self._pending else None
+            size = len(self._flags)
+        return {
+            'loaded': self.loaded,
+            'approved_users': size,
+            'pending_sync': pending,
+            'sync_lag_seconds': round(time.time() - oldest, 3) if oldest else 0.0,
+            'synced_total': self.flushed_count,
+            'failed_flushes': self.failed_flushes,
+            'last_flush_at': self.last_flush_at,
+            'last_flush_error': self.last_flush_error,
+        }
+
+
+def connect_roster_signals(app, roster):
+    from ..signals import user_approved, user_rejected
+
+    def on_approved(sender, user, **extra):
+        roster.add(user['user_id'], checked_in=user.get('check_in_status') == 'checked_in')
+
+    def on_rejected(sender, user, **extra):
+        roster.discard(user['user_id'])
+
+    user_approved.connect(on_approved, sender=app, weak=False)
+    user_rejected.connect(on_rejected, sender=app, weak=False)
@@ -0,0 +1,227 @@
+import gzip
+import json
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-user roster states sent to scanner devices
+APPROVED = 'a'
+CHECKED_IN = 'c'
+REMOVED = 'r'  # Rejected; only appears in deltas
+
+
+class RosterFeed:
+    """Versioned roster of approved users for scanners that validate codes offline.
+
+    Every approval, rejection and check-in is appended to a change log in the
+    outbox's SQLite file, shared by all worker processes on the host; the row
+    number is the roster version. A device that sent ``since=<version>`` gets
+    only the users changed after it. A new device gets a snapshot: the
+    approved users in the database, overlaid with the change log (which also
+    holds check-ins the roster has not written back yet). The base snapshot is
+    reused for ``snapshot_ttl`` seconds with the newer changes applied on top.
+
+    Changes are not written on the request that makes them: ``record`` only
+    buffers them in memory, and a background thread appends the buffer to the
+    log in one transaction every ``flush_interval`` seconds. Versions are
+    assigned by that insert, so they stay ordered across worker processes.
+    """
+
+    def __init__(self, outbox, store, page_size=1000, snapshot_ttl=300, flush_interval=0.5):
+        self.outbox = outbox
+        self.store = store
+        self.page_size = page_size
+        self.snapshot_ttl = snapshot_ttl
+        self.flush_interval = flush_interval
+        self._base = None  # (version, built_at, {user_id: state})
+        self._encoded = None  # (version, body, gzipped body) of the last snapshot sent
+        self._pending = []  # (user_id, state, changed_at) not yet in the log
+        self._lock = threading.Lock()  # Held only briefly: record() takes it on the scan path
+        self._flush_lock = threading.Lock()
+        self._build_lock = threading.Lock()  # One base build at a time
+        self._stopped = threading.Event()
+        self._thread = None
+        self._init_db()
+
+    def _init_db(self):
+        with self.outbox.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS roster_changes (
+                    version INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    changed_at REAL NOT NULL
+                )
+            ''')
+
+    def record(self, user_id, state):
+        # Called from the signals on the request path, so it must not touch the database
+        with self._lock:
+            self._pending.append((user_id, state, time.time()))
+
+    def flush(self):
+        """Appends the buffered changes to the log; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                with self.outbox.transaction() as conn:
+                    conn.executemany('INSERT INTO roster_changes (user_id, state, changed_at) VALUES (?, ?, ?)', pending)
+            except Exception:
+                # Put them back in front of anything recorded since, keeping the order
+                with self._lock:
+                    self._pending[:0] = pending
+                raise
+        logger.debug("Roster feed flushed %s changes", len(pending))
+        return len(pending)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='roster-feed-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Roster feed lost {len(self._pending)} changes at shutdown: {str(e)}")
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing roster feed changes: {str(e)}")
+
+    def version(self):
+        with self.outbox.transaction() as conn:
+            return conn.execute('SELECT COALESCE(MAX(version), 0) FROM roster_changes').fetchone()[0]
+
+    def _changes(self, since, until=None):
+        # Latest state per user changed after `since`; returns (version, {user_id: state})
+        with self.outbox.transaction() as conn:
+            if until is None:
+                until = conn.execute('SELECT COALESCE(MAX(version), 0) FROM roster_changes').fetchone()[0]
+            rows = conn.execute('SELECT user_id, state FROM roster_changes WHERE version > ? AND version <= ? '
+                                'ORDER BY version', (since, until)).fetchall()
+        return until, dict(rows)
+
+    def delta(self, since):
+        return self._changes(since)
+
+    def _load_base(self):
+        # The version is read first: changes made while the users are paged in are replayed on top
+        version, changes = self._changes(0)
+        users, after = {}, None
+        while True:
+            page = self.store.list_users('user_id, check_in_status, created_at', filters={'approval_status': 'approved'},
+                                         after=after, limit=self.page_size)
+            for row in page:
+                users[row['user_id']] = CHECKED_IN if row['check_in_status'] == 'checked_in' else APPROVED
+            if len(page) < self.page_size:
+                break
+            after = (page[-1]['created_at'], page[-1]['user_id'])
+        _apply(users, changes)
+        logger.info(f"Roster snapshot base built at version {version} with {len(users)} users")
+        return version, time.monotonic(), users
+
+    def _fresh_base(self):
+        with self._lock:
+            base = self._base
+        if base is not None and time.monotonic() - base[1] <= self.snapshot_ttl:
+            return base
+        # Built outside _lock, so scans recording changes never wait for the users to be paged in
+        with self._build_lock:
+            with self._lock:
+                base = self._base
+            if base is None or time.monotonic() - base[1] > self.snapshot_ttl:
+                base = self._load_base()
+                with self._lock:
+                    self._base = base
+        return base
+
+    def snapshot(self):
+        """Returns (version, {user_id: state}) with every approved user."""
+        base_version, _, base = self._fresh_base()
+        version, changes = self._changes(base_version)
+        users = dict(base)
+        _apply(users, changes)
+        return version, users
+
+    def encode(self, since=None, compress=False):
+        """Returns (version, is_snapshot, NDJSON body, gzipped if ``compress``).
+
+        A ``since`` that is not a version of this log (missing, or ahead of it
+        after the log was reset) gets a snapshot. The first line is a header.
+        """
+        # This worker's own buffered changes are included; other workers' follow within flush_interval
+        self.flush()
+        current = self.version()
+        if since is not None and 0 <= since <= current:
+            version, users = self.delta(since)
+            body = _ndjson(version, False, users)
+            return version, False, gzip_body(body) if compress else body
+
+        with self._lock:
+            encoded = self._encoded
+        if encoded is None or encoded[0] != current:
+            version, users = self.snapshot()
+            body = _ndjson(version, True, users)
+            # Devices that come online together share one encoding (and one compression) per version
+            encoded = (version, body, gzip_body(body))
+            with self._lock:
+                self._encoded = encoded
+        version, body, compressed = encoded
+        return version, True, compressed if compress else body
+
+    def stats(self):
+        with self._lock:
+            base, pending = self._base, len(self._pending)
+        return {'version': self.version(), 'snapshot_version': base[0] if base else None,
+                'snapshot_users': len(base[2]) if base else None, 'pending': pending}
+
+
+def _apply(users, changes):
+    for user_id, state in changes.items():
+        if state == REMOVED:
+            users.pop(user_id, None)
+        else:
+            users[user_id] = state
+
+
+def _ndjson(version, snapshot, users):
+    lines = [json.dumps({'version': version, 'snapshot': snapshot, 'count': len(users)})]
+    lines.extend(json.dumps([user_id, state], separators=(',', ':')) for user_id, state in users.items())
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_body(body):
+    # Level 6 is most of the size win of 9 at a fraction of the CPU
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def connect_roster_feed_signals(app, feed):
+    from ..signals import user_approved, user_rejected, user_checked_in
+
+    def on_approved(sender, user, **extra):
+        feed.record(user['user_id'], CHECKED_IN if user.get('check_in_status') == 'checked_in' else APPROVED)
+
+    def on_rejected(sender, user, **extra):
+        feed.record(user['user_id'], REMOVED)
+
+    def on_checked_in(sender, user, **extra):
+        feed.record(user['user_id'], CHECKED_IN)
+
+    user_approved.connect(on_approved, sender=app, weak=False)
+    user_rejected.connect(on_rejected, sender=app, weak=False)
+    user_checked_in.connect(on_checked_in, sender=app, weak=False)
@@ -0,0 +1,281 @@
+from bisect import bisect_left, insort
+import heapq
+import math
+import re
+import threading
+import unicodedata
+import logging
+from .qr_code import format_phone_number
+from .registrations import normalize_phone_number
+
+logger = logging.getLogger(__name__)
+
+SEARCH_COLUMNS = 'user_id, name, batch, branch, phone_number, check_in_status, created_at'
+SUFFIX_DIGITS = 4  # Shortest phone suffix the desk can search by
+NATIONAL_DIGITS = 10  # Bangladeshi mobile number without the +880 / 0 prefix
+MIN_SIMILARITY = 0.3  # Trigram similarity below which a name word is not a match (pg_trgm's default)
+
+
+def normalize_name(name):
+    # Case- and punctuation-insensitive; keeps non-Latin letters as they are
+    return ' '.join(re.sub(r'[\W_]+', ' ', unicodedata.normalize('NFKC', name or '').casefold()).split())
+
+
+def trigrams(word):
+    # Same padding as PostgreSQL's pg_trgm: two spaces before the word and one after
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def e164_phone_number(phone_number):
+    national = normalize_phone_number(phone_number)
+    return format_phone_number(national) if len(national) == NATIONAL_DIGITS else None
+
+
+class AttendeeIndex:
+    """In-memory search over approved users for manual check-in at the desk.
+
+    Finds users by full phone number (compared in E.164 form), by the last
+    digits of the phone number, and by name: every query word must start a
+    word of the name, or failing that be trigram-similar to one. Names are
+    matched through their vocabulary of distinct words, which is much smaller
+    than the user list. Loaded once from the database and kept current from
+    the approve, reject and check-in signals.
+    """
+
+    def __init__(self):
+        self._users = {}  # user_id -> public record
+        self._names = {}  # user_id -> normalized name words
+        self._phones = {}  # E.164 number -> user_id
+        self._suffixes = {}  # last SUFFIX_DIGITS digits -> {user_id}
+        self._vocabulary = []  # sorted distinct name words, for prefix search
+        self._word_users = {}  # name word -> {user_id}
+        self._word_trigrams = {}  # name word -> its trigrams
+        self._trigram_words = {}  # trigram -> {name word}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self, store, page_size=1000):
+        rows, after = [], None
+        while True:
+            page = store.list_users(SEARCH_COLUMNS, filters={'approval_status': 'approved'}, after=after, limit=page_size)
+            rows.extend(page)
+            if len(page) < page_size:
+                break
+            after = (page[-1]['created_at'], page[-1]['user_id'])
+        with self._lock:
+            # Keep approvals and check-ins that arrived while the load was in flight
+            known = list(self._users.values())
+            self._users, self._names, self._phones, self._suffixes = {}, {}, {}, {}
+            self._vocabulary, self._word_users, self._word_trigrams, self._trigram_words = [], {}, {}, {}
+            for row in rows:
+                self._add(row)
+            for record in known:
+                self._add(record)
+            self.loaded = True
+        logger.info(f"Attendee search index loaded with {len(self._users)} approved users")
+
+    def _add(self, user):
+        user_id = user['user_id']
+        self._remove(user_id)
+        phone = e164_phone_number(user.get('phone_number'))
+        record = {
+            'user_id': user_id,
+            'name': user.get('name'),
+            'batch': user.get('batch'),
+            'branch': user.get('branch'),
+            'phone_number': phone or user.get('phone_number'),
+            'check_in_status': user.get('check_in_status') or 'not_checked_in',
+        }
+        self._users[user_id] = record
+        if phone:
+            self._phones[phone] = user_id
+            self._suffixes.setdefault(phone[-SUFFIX_DIGITS:], set()).add(user_id)
+        words = tuple(dict.fromkeys(normalize_name(record['name']).split()))
+        self._names[user_id] = words
+        for word in words:
+            users = self._word_users.get(word)
+            if users is None:
+                users = self._word_users[word] = set()
+                insort(self._vocabulary, word)
+                grams = self._word_trigrams[word] = trigrams(word)
+                for gram in grams:
+                    self._trigram_words.setdefault(gram, set()).add(word)
+            users.add(user_id)
+
+    def _remove(self, user_id):
+        record = self._users.pop(user_id, None)
+        if record is None:
+            return
+        phone = record['phone_number']
+        if self._phones.get(phone) == user_id:
+            del self._phones[phone]
+        suffix = self._suffixes.get(phone[-SUFFIX_DIGITS:]) if phone else None
+        if suffix is not None:
+            suffix.discard(user_id)
+            if not suffix:
+                del self._suffixes[phone[-SUFFIX_DIGITS:]]
+        for word in self._names.pop(user_id):
+            users = self._word_users[word]
+            users.discard(user_id)
+            if users:
+                continue
+            # Last user with this word: drop it from the vocabulary
+            del self._word_users[word]
+            del self._vocabulary[bisect_left(self._vocabulary, word)]
+            for gram in self._word_trigrams.pop(word):
+                words = self._trigram_words[gram]
+                words.discard(word)
+                if not words:
+                    del self._trigram_words[gram]
+
+    def add(self, user):
+        with self._lock:
+            self._add(user)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def set_check_in_status(self, user_id, status):
+        with self._lock:
+            record = self._users.get(user_id)
+            if record is not None:
+                record['check_in_status'] = status
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def count(self, filters=None):
+        # Approved users whose record matches every column in filters
+        with self._lock:
+            return sum(1 for record in self._users.values()
+                       if all(record.get(column) == value for column, value in (filters or {}).items()))
+
+    def search(self, query, limit=10):
+        """Returns up to ``limit`` records, best matches first, each with the
+        kind of match: ``phone``, ``phone_suffix``, ``name_prefix`` or
+        ``name_similar`` (with a ``score``)."""
+        query = (query or '').strip()
+        digits = re.sub(r'\D', '', query)
+        with self._lock:
+            # Digits, optionally with +, spaces or dashes: a phone number or its last digits
+            if len(digits) >= SUFFIX_DIGITS and re.fullmatch(r'[\d\s()+-]+', query):
+                return self._search_phone(digits, limit)
+            words = normalize_name(query).split()
+            if not words:
+                return []
+            results = self._search_name(words, limit, fuzzy=False, exclude=set())
+            if len(results) < limit:
+                # Too few exact prefixes: fill up with misspelled matches
+                results += self._search_name(words, limit - len(results), fuzzy=True,
+                                             exclude={result['user_id'] for result in results})
+            return results
+
+    def _result(self, user_id, match, score=None):
+        result = {**self._users[user_id], 'match': match}
+        if score is not None:
+            result['score'] = round(score, 3)
+        return result
+
+    def _search_phone(self, digits, limit):
+        if len(digits) >= NATIONAL_DIGITS:
+            phone = e164_phone_number(digits)
+            user_id = self._phones.get(phone) if phone else None
+            return [self._result(user_id, 'phone')] if user_id else []
+        matches = sorted(
+            user_id for user_id in self._suffixes.get(digits[-SUFFIX_DIGITS:], ())
+            if self._users[user_id]['phone_number'].endswith(digits)
+        )
+        return [self._result(user_id, 'phone_suffix') for user_id in matches[:limit]]
+
+    def _matching_words(self, word, fuzzy):
+        """Vocabulary words matching one query word -> score: 1.0 for words it
+        starts, trigram similarity for the rest when ``fuzzy``."""
+        start = bisect_left(self._vocabulary, word)
+        stop = bisect_left(self._vocabulary, word + '\U0010ffff')
+        matches = dict.fromkeys(self._vocabulary[start:stop], 1.0)
+        if not fuzzy:
+            return matches
+
+        # A word with similarity >= MIN_SIMILARITY shares at least `needed` trigrams with
+        # the query word, so it must contain one of the rarest len(grams) - needed + 1
+        grams = trigrams(word)
+        needed = max(1, math.ceil(MIN_SIMILARITY * len(grams)))
+        rarest = sorted(grams, key=lambda gram: len(self._trigram_words.get(gram, ())))
+        candidates = set()
+        for gram in rarest[:len(grams) - needed + 1]:
+            candidates.update(self._trigram_words.get(gram, ()))
+        for candidate in candidates:
+            if candidate in matches:
+                continue
+            candidate_grams = self._word_trigrams[candidate]
+            shared = len(grams & candidate_grams)
+            score = shared / (len(grams) + len(candidate_grams) - shared)
+            if score >= MIN_SIMILARITY:
+                matches[candidate] = score
+        return matches
+
+    def _search_name(self, words, limit, fuzzy, exclude):
+        per_word = [self._matching_words(word, fuzzy) for word in words]
+        if not all(per_word):
+            return []
+
+        # Walk the users of the most selective query word, best-scoring words first,
+        # and score each user against the other query words
+        per_word.sort(key=lambda matches: sum(len(self._word_users[word]) for word in matches))
+        driver, others = per_word[0], per_word[1:]
+        scored = []
+        for word, score in sorted(driver.items(), key=lambda item: (-item[1], item[0])):
+            if len(scored) >= limit:
+                if not fuzzy:
+                    break
+                # The other query words score at most 1.0 each, so no user of this
+                # word can beat the best `limit` found so far
+                worst_kept = -heapq.nsmallest(limit, scored)[-1][0]
+                if (score + len(others)) / len(per_word) <= worst_kept:
+                    break
+            for user_id in sorted(self._word_users[word]):
+                if user_id in exclude:
+                    continue
+                exclude.add(user_id)
+                total = score
+                for matches in others:
+                    best = max((matches.get(name_word, 0.0) for name_word in self._names[user_id]), default=0.0)
+                    if not best:
+                        break
+                    total += best
+                else:
+                    scored.append((-total / len(per_word), ' '.join(self._names[user_id]), user_id))
+                    if not fuzzy and len(scored) >= limit:
+                        break
+
+        best = heapq.nsmallest(limit, scored)
+        if fuzzy:
+            return [self._result(user_id, 'name_similar', -score) for score, _, user_id in best]
+        return [self._result(user_id, 'name_prefix') for _, _, user_id in best]
+
+    def stats(self):
+        with self._lock:
+            return {'loaded': self.loaded, 'users': len(self._users), 'vocabulary': len(self._vocabulary),
+                    'trigrams': len(self._trigram_words)}
+
+
+def connect_search_signals(app, index):
+    from ..signals import user_approved, user_rejected, user_checked_in
+
+    def on_approved(sender, user, **extra):
+        index.add(user)
+
+    def on_rejected(sender, user, **extra):
+        index.discard(user['user_id'])
+
+    def on_checked_in(sender, user, **extra):
+        index.set_check_in_status(user['user_id'], 'checked_in')
+
+    user_approved.connect(on_approved, sender=app, weak=False)
+    user_rejected.connect(on_rejected, sender=app, weak=False)
+    user_checked_in.connect(on_checked_in, sender=app, weak=False)
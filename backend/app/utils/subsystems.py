@@ -0,0 +1,123 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Subsystem states reported by /healthz and /readyz
+PENDING = 'pending'  # Waiting for the subsystems it depends on
+STARTING = 'starting'
+READY = 'ready'
+FAILED = 'failed'  # Last attempt failed; retried with backoff
+STANDBY = 'standby'  # Runs in another process (see BackgroundLeader)
+DISABLED = 'disabled'
+
+
+class _Subsystem:
+    def __init__(self, name, required):
+        self.name = name
+        self.required = required
+        self.state = PENDING
+        self.ready = threading.Event()
+        self.error = None
+        self.attempts = 0
+        self.since = time.time()
+        self.startup_seconds = None
+
+
+class Subsystems:
+    """Starts the slow parts of the app in background threads.
+
+    create_app() returns as soon as the cheap objects exist. Each subsystem
+    registered with ``start()`` is initialized in its own thread once the
+    subsystems it depends on are ready, and retried with exponential backoff
+    until it succeeds. The app is ready to serve when every ``required``
+    subsystem is.
+    """
+
+    def __init__(self, retry_base_delay=1.0, retry_max_delay=60.0):
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.created_at = time.time()
+        self._subsystems = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _get(self, name, required=False):
+        with self._lock:
+            subsystem = self._subsystems.get(name)
+            if subsystem is None:
+                subsystem = self._subsystems[name] = _Subsystem(name, required)
+            return subsystem
+
+    def set_state(self, name, state, required=False):
+        subsystem = self._get(name, required)
+        subsystem.state = state
+        subsystem.since = time.time()
+        if state == READY:
+            subsystem.ready.set()
+
+    def start(self, name, init, required=False, after=()):
+        self.set_state(name, PENDING, required)
+        subsystem = self._get(name)
+        thread = threading.Thread(target=self._run, args=(subsystem, init, after), name=f'startup-{name}', daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self, subsystem, init, after):
+        for dependency in after:
+            while not self._get(dependency).ready.wait(1.0):
+                if self._stopped.is_set():
+                    return
+
+        started = time.monotonic()
+        delay = self.retry_base_delay
+        while not self._stopped.is_set():
+            subsystem.attempts += 1
+            subsystem.state = STARTING
+            try:
+                init()
+            except Exception as e:
+                subsystem.state = FAILED
+                subsystem.error = str(e)
+                subsystem.since = time.time()
+                logger.error(f"Failed to start {subsystem.name} (attempt {subsystem.attempts}), "
+                             f"retrying in {delay:.0f}s: {str(e)}")
+                if self._stopped.wait(delay):
+                    return
+                delay = min(delay * 2, self.retry_max_delay)
+                continue
+            subsystem.error = None
+            subsystem.startup_seconds = round(time.monotonic() - started, 3)
+            self.set_state(subsystem.name, READY)
+            logger.info(f"{subsystem.name} ready after {subsystem.startup_seconds}s")
+            return
+
+    def wait(self, name, timeout=None):
+        return self._get(name).ready.wait(timeout)
+
+    def is_ready(self, name=None):
+        """Whether one subsystem, or every required subsystem, is ready."""
+        with self._lock:
+            subsystems = list(self._subsystems.values())
+        if name is not None:
+            return self._get(name).ready.is_set()
+        return all(subsystem.ready.is_set() for subsystem in subsystems if subsystem.required)
+
+    def report(self):
+        with self._lock:
+            subsystems = list(self._subsystems.values())
+        return {
+            subsystem.name: {
+                'state': subsystem.state,
+                'required': subsystem.required,
+                'since': subsystem.since,
+                'attempts': subsystem.attempts,
+                'startup_seconds': subsystem.startup_seconds,
+                'error': subsystem.error,
+            }
+            for subsystem in subsystems
+        }
+
+    def stop(self):
+        self._stopped.set()
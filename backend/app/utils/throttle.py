@@ -0,0 +1,48 @@
+from collections import OrderedDict
+import threading
+from .outbox import TokenBucket
+
+
+class KeyedRateLimiter:
+    """One token bucket per key (client IP, email, ...), least recently used keys evicted."""
+
+    def __init__(self, rate_per_minute, burst, max_keys=10000):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate_per_minute, self.burst)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def hit(self, key):
+        """Take a token for ``key``; returns 0 if allowed, else seconds until the next token."""
+        bucket = self._bucket(key)
+        if bucket.try_acquire():
+            return 0.0
+        return bucket.wait_time()
+
+
+class LoginThrottle:
+    def __init__(self, ip_rate_per_minute, ip_burst, email_rate_per_minute, email_burst):
+        self.by_ip = KeyedRateLimiter(ip_rate_per_minute, ip_burst)
+        self.by_email = KeyedRateLimiter(email_rate_per_minute, email_burst)
+
+    def check(self, ip, email):
+        """Returns (scope, retry_after) for a throttled attempt, or None."""
+        retry_after = self.by_ip.hit(ip)
+        if retry_after:
+            return 'ip', retry_after
+        retry_after = self.by_email.hit(email.strip().lower())
+        if retry_after:
+            return 'email', retry_after
+        return None
@@ -0,0 +1,150 @@
+import threading
+import time
+import logging
+import httpx
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class MessageTransport:
+    """Interface for delivering a text message to a phone number.
+
+    ``concurrency`` tells the outbox how many messages the transport can
+    have in flight at once.
+    """
+
+    name = 'base'
+    concurrency = 1
+
+    def start(self):
+        pass
+
+    def send(self, phone_number, message):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class SeleniumTransport(MessageTransport):
+    """WhatsApp Web driven through a pool of headless Chrome sessions."""
+
+    name = 'selenium'
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.concurrency = len(pool.sessions)
+
+    def start(self):
+        self.pool.start()
+
+    def send(self, phone_number, message):
+        self.pool.send_message(phone_number, message)
+
+    def stats(self):
+        return {'sessions': self.pool.stats()}
+
+    def close(self):
+        self.pool.close()
+
+
+class HttpApiTransport(MessageTransport):
+    """WhatsApp Business Cloud API over one pooled keep-alive HTTP client."""
+
+    name = 'http'
+
+    def __init__(self, api_url, token, phone_number_id, concurrency=4, timeout=10):
+        self.concurrency = concurrency
+        self.url = f"{api_url.rstrip('/')}/{phone_number_id}/messages"
+        self.client = httpx.Client(
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self.sent = 0
+        self.failures = 0
+
+    @timed('whatsapp_api', 'send')
+    def send(self, phone_number, message):
+        response = self.client.post(self.url, json={
+            'messaging_product': 'whatsapp',
+            'to': phone_number.lstrip('+'),
+            'type': 'text',
+            'text': {'body': message},
+        })
+        if response.status_code >= 300:
+            self.failures += 1
+            raise RuntimeError(f'WhatsApp API returned {response.status_code}: {response.text}')
+        self.sent += 1
+
+    def stats(self):
+        return {'sent': self.sent, 'failures': self.failures}
+
+    def close(self):
+        self.client.close()
+
+
+class FakeTransport(MessageTransport):
+    """In-process transport that records messages, for tests and load runs.
+
+    The first ``failures`` sends raise, to exercise the outbox's retries.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.0, concurrency=1, start_delay=0.0, failures=0):
+        self.latency = latency
+        self.concurrency = concurrency
+        self.start_delay = start_delay
+        self.failures = failures
+        self.attempts = 0
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.start_delay:
+            time.sleep(self.start_delay)
+
+    def send(self, phone_number, message):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.attempts += 1
+            if self.attempts <= self.failures:
+                raise RuntimeError(f'Fake send failure {self.attempts} of {self.failures}')
+            self.messages.append((phone_number, message))
+
+    def stats(self):
+        return {'recorded': len(self.messages)}
+
+
+def create_transport(config):
+    name = config['MESSAGING_TRANSPORT']
+    if name == 'selenium':
+        # Imported here so the other transports do not pull in Selenium
+        from .whatsapp import WhatsAppSessionPool
+        return SeleniumTransport(WhatsAppSessionPool(
+            size=config['WHATSAPP_SESSIONS'],
+            profile_root=config['WHATSAPP_PROFILE_DIR'],
+            rate_per_minute=config['WHATSAPP_SESSION_RATE_PER_MINUTE'],
+            health_check_interval=config['WHATSAPP_HEALTH_CHECK_INTERVAL'],
+            login_timeout=config['WHATSAPP_LOGIN_TIMEOUT'],
+        ))
+    if name == 'http':
+        missing = [key for key in ('WHATSAPP_API_TOKEN', 'WHATSAPP_PHONE_NUMBER_ID') if not config.get(key)]
+        if missing:
+            raise ValueError(f"Missing settings for the http transport: {', '.join(missing)}")
+        return HttpApiTransport(
+            config['WHATSAPP_API_URL'],
+            config['WHATSAPP_API_TOKEN'],
+            config['WHATSAPP_PHONE_NUMBER_ID'],
+            concurrency=config['MESSAGING_HTTP_CONCURRENCY'],
+            timeout=config['MESSAGING_HTTP_TIMEOUT'],
+        )
+    if name == 'fake':
+        return FakeTransport(latency=config['FAKE_TRANSPORT_LATENCY'], start_delay=config['FAKE_TRANSPORT_START_DELAY'])
+    raise ValueError(f'Unknown messaging transport: {name}')
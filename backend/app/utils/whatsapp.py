@@ -3,25 +3,31 @@ from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from flask import current_app
+from selenium.common.exceptions import WebDriverException
+from .outbox import TokenBucket
+from .metrics import timed
+import threading
 import time
 import logging
 import pickle
 import os
-import queue
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Chat list shown once WhatsApp Web is logged in
+LOGGED_IN_LOCATOR = (By.ID, 'pane-side')
+
 class WhatsAppBot:
-    def __init__(self):
-        self.session_file = 'whatsapp_session.pkl'
-        self.message_queue = queue.Queue()
+    def __init__(self, session_file='whatsapp_session.pkl', profile_dir=None, login_timeout=120):
+        self.session_file = session_file
         options = webdriver.ChromeOptions()
         options.add_argument('--headless')
         options.add_argument('--no-sandbox')
         options.add_argument('--disable-dev-shm-usage')
+        if profile_dir:
+            # Separate Chrome profile so several sessions can run side by side
+            os.makedirs(profile_dir, exist_ok=True)
+            options.add_argument(f'--user-data-dir={os.path.abspath(profile_dir)}')
         self.driver = webdriver.Chrome(options=options)
 
         # Load existing session if available
@@ -35,12 +41,19 @@ class WhatsAppBot:
             logger.info("Loaded existing WhatsApp session")
         else:
             self.driver.get('https://web.whatsapp.com/')
-            logger.info("Please scan the QR code within 20 seconds")
-            time.sleep(20)  # Manual QR scan
+            logger.info(f"Please scan the QR code within {login_timeout:.0f} seconds")
+            # Manual QR scan; returns as soon as the chat list appears. Runs in a background
+            # thread (see app.subsystems), so the app keeps serving meanwhile
+            try:
+                WebDriverWait(self.driver, login_timeout).until(EC.presence_of_element_located(LOGGED_IN_LOCATOR))
+            except Exception:
+                self.driver.quit()
+                raise
             with open(self.session_file, 'wb') as f:
                 pickle.dump(self.driver.get_cookies(), f)
             logger.info("New WhatsApp session saved")
 
+    @timed('whatsapp')
     def send_message(self, phone_number, message):
         try:
             url = f'https://web.whatsapp.com/send?phone={phone_number}&text={message}'
@@ -50,21 +63,159 @@ class WhatsAppBot:
             )
             message_box.send_keys(Keys.ENTER)
             time.sleep(3)  # Increased wait for reliability
-            logger.info(f"Message sent to {phone_number}")
+            logger.info("Message sent to %s", phone_number)
         except Exception as e:
             logger.error(f"Error sending message to {phone_number}: {str(e)}")  # Fixed f-string
             raise
 
+    def is_alive(self):
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
     def close(self):
         self.driver.quit()
         logger.info("WhatsApp bot closed")
 
-def send_whatsapp_message(phone_number, message):
-    bot = current_app.whatsapp_bot
-    try:
-        bot.send_message(phone_number, message)
-        time.sleep(5)  # Rate limit to avoid WhatsApp bans
-    except Exception as e:
-        logger.warning(f"Failed to send message to {phone_number}, added to queue: {str(e)}")
-        bot.message_queue.put((phone_number, message))
-        # Note: Queue processing would need a separate worker/thread (not implemented here)
\ No newline at end of file
+
+class _Session:
+    def __init__(self, index, session_file, profile_dir, rate_per_minute):
+        self.index = index
+        self.session_file = session_file
+        self.profile_dir = profile_dir
+        self.bucket = TokenBucket(rate_per_minute)
+        self.lock = threading.Lock()
+        self.bot = None
+        self.healthy = False
+        self.restarts = 0
+        self.sent = 0
+        self.failures = 0
+        self.last_error = None
+
+
+class WhatsAppSessionPool:
+    """Pool of WhatsApp Web sessions sending in parallel.
+
+    Each session has its own Chrome profile, cookie file and rate limit.
+    Sessions whose WebDriver died are restarted by a health-check thread.
+    """
+
+    def __init__(self, size=1, profile_root='whatsapp_profiles', rate_per_minute=7,
+                 health_check_interval=60, acquire_timeout=30, login_timeout=120, bot_factory=WhatsAppBot):
+        self.bot_factory = bot_factory
+        self.login_timeout = login_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.sessions = []
+        for index in range(size):
+            # The first session keeps the original cookie file so existing logins carry over
+            session_file = 'whatsapp_session.pkl' if index == 0 else f'whatsapp_session_{index}.pkl'
+            profile_dir = os.path.join(profile_root, f'session_{index}')
+            self.sessions.append(_Session(index, session_file, profile_dir, rate_per_minute))
+        self._next = 0
+        self._available = threading.Condition()
+        self._stopped = threading.Event()
+        self._health_thread = None
+
+    def start(self):
+        # Called again when a previous start failed; sessions that came up are kept
+        for session in self.sessions:
+            if not session.healthy:
+                self._start_session(session)
+        if not any(session.healthy for session in self.sessions):
+            raise RuntimeError('No WhatsApp session could be started')
+        if self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._health_loop, name='whatsapp-health', daemon=True)
+            self._health_thread.start()
+
+    def _start_session(self, session):
+        try:
+            session.bot = self.bot_factory(session_file=session.session_file, profile_dir=session.profile_dir,
+                                           login_timeout=self.login_timeout)
+            session.healthy = True
+            logger.info(f"WhatsApp session {session.index} started")
+        except Exception as e:
+            session.bot = None
+            session.healthy = False
+            session.last_error = str(e)
+            logger.error(f"Failed to start WhatsApp session {session.index}: {str(e)}")
+
+    def _restart_session(self, session):
+        if session.bot is not None:
+            try:
+                session.bot.close()
+            except Exception as e:
+                logger.debug(f"Error closing WhatsApp session {session.index}: {str(e)}")
+        session.restarts += 1
+        self._start_session(session)
+        with self._available:
+            self._available.notify_all()
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_check_interval):
+            for session in self.sessions:
+                # Busy sessions are evidently alive; check them next round
+                if not session.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if session.bot is None or not session.bot.is_alive():
+                        logger.warning(f"WhatsApp session {session.index} is down, restarting")
+                        self._restart_session(session)
+                finally:
+                    session.lock.release()
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._available:
+            while True:
+                for offset in range(len(self.sessions)):
+                    session = self.sessions[(self._next + offset) % len(self.sessions)]
+                    if not session.healthy or not session.lock.acquire(blocking=False):
+                        continue
+                    if session.bucket.try_acquire():
+                        self._next = (session.index + 1) % len(self.sessions)
+                        return session
+                    session.lock.release()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('No WhatsApp session available')
+                waits = [s.bucket.wait_time() for s in self.sessions if s.healthy]
+                self._available.wait(min([remaining, 1.0] + waits))
+
+    def send_message(self, phone_number, message):
+        session = self._acquire()
+        try:
+            session.bot.send_message(phone_number, message)
+            session.sent += 1
+        except Exception as e:
+            session.failures += 1
+            session.last_error = str(e)
+            if isinstance(e, WebDriverException) and not session.bot.is_alive():
+                logger.warning(f"WhatsApp session {session.index} died while sending, restarting")
+                self._restart_session(session)
+            raise
+        finally:
+            session.lock.release()
+            with self._available:
+                self._available.notify()
+
+    def stats(self):
+        return [
+            {'session': session.index, 'healthy': session.healthy, 'busy': session.lock.locked(),
+             'sent': session.sent, 'failures': session.failures, 'restarts': session.restarts,
+             'last_error': session.last_error}
+            for session in self.sessions
+        ]
+
+    def close(self):
+        self._stopped.set()
+        for session in self.sessions:
+            if session.bot is not None:
+                try:
+                    session.bot.close()
+                except Exception as e:
+                    logger.warning(f"Error closing WhatsApp session {session.index}: {str(e)}")
+                session.bot = None
+                session.healthy = False
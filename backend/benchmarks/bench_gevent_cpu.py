@@ -0,0 +1,97 @@
+"""Event loop stalls from CPU-bound work under gevent workers.
+
+Usage (from backend/):
+    python -m benchmarks.bench_gevent_cpu --logins 8 --renders 8
+    python -m benchmarks.bench_gevent_cpu --max-stall-ms 100   # exit 1 above this
+
+Monkey-patches like a gevent gunicorn worker, then runs concurrent bcrypt
+checks through PasswordVerifier and QR renders through
+generate_qr_code_image while a greenlet ticks every few milliseconds, the
+way /healthz probes and scans would be served meanwhile. Reports the longest
+gap between ticks, once with the work called directly in greenlets (what a
+plain ThreadPoolExecutor does once threading is patched) and once through
+the app's helpers, which hand it to OS threads.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+import uuid  # noqa: E402
+
+import bcrypt  # noqa: E402
+import gevent  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.passwords import PasswordVerifier  # noqa: E402
+from app.utils import qr_code  # noqa: E402
+
+TICK = 0.005  # Seconds between ticks of the probe greenlet
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=8, help='Concurrent bcrypt checks')
+    parser.add_argument('--renders', type=int, default=8, help='Concurrent QR renders (distinct payloads)')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost factor of the test hash')
+    parser.add_argument('--max-stall-ms', type=float, help='Exit with status 1 if the helpers stall longer')
+    return parser.parse_args()
+
+
+def measure(label, jobs):
+    """Run jobs in greenlets; returns the longest gap between probe ticks in ms."""
+    gaps = []
+    done = gevent.event.Event()
+
+    def probe():
+        last = time.perf_counter()
+        while not done.is_set():
+            gevent.sleep(TICK)
+            now = time.perf_counter()
+            gaps.append(now - last - TICK)
+            last = now
+
+    ticker = gevent.spawn(probe)
+    gevent.sleep(TICK * 2)
+    started = time.perf_counter()
+    gevent.joinall([gevent.spawn(job) for job in jobs], raise_error=True)
+    elapsed = time.perf_counter() - started
+    done.set()
+    ticker.join()
+    stall_ms = max(gaps) * 1000
+    print(f"{label:<40} {elapsed * 1000:>9.1f} ms total {stall_ms:>9.1f} ms max stall {len(gaps):>6} ticks")
+    return stall_ms
+
+
+def main():
+    args = parse_args()
+    password = b'benchmark-password'
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(args.rounds))
+
+    def payloads():
+        return [str(uuid.uuid4()) for _ in range(args.renders)]
+
+    measure('bcrypt in greenlets (unpatched pool)',
+            [lambda: bcrypt.checkpw(password, hashed) for _ in range(args.logins)])
+    verifier = PasswordVerifier(max_workers=args.logins, max_queue=0)
+    helper_stall = measure('bcrypt via PasswordVerifier',
+                           [lambda: verifier.verify(password.decode(), hashed.decode()) for _ in range(args.logins)])
+    verifier.close()
+
+    measure('QR render in greenlets',
+            [lambda p=p: qr_code._render_qr_code(p, 10, 4, 'png') for p in payloads()])
+    helper_stall = max(helper_stall, measure(
+        'QR render via generate_qr_code_image',
+        [lambda p=p: qr_code.generate_qr_code_image(p) for p in payloads()]))
+
+    if args.max_stall_ms is not None and helper_stall > args.max_stall_ms:
+        print(f"\nCPU-bound work stalled the hub for {helper_stall:.1f} ms (limit {args.max_stall_ms} ms)")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Microbenchmark for signed QR payload verification on the scan path.
+
+Usage (from backend/):
+    python -m benchmarks.bench_qr_verify --iterations 200000
+
+Measures raw QRSigner.verify throughput for valid, forged and unsigned
+codes. It also measures end-to-end /qr_codes/scan throughput for forged
+codes, which are rejected before any database call, so no Supabase
+connection is needed.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Dummy settings, read when the app package is imported: forged codes never
+# reach Supabase or the messaging transport
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_KEY', 'benchmark.key')  # Must look like a JWT
+os.environ.setdefault('SECRET_KEY', 'benchmark-secret')
+os.environ['MESSAGING_TRANSPORT'] = 'fake'
+os.environ.setdefault('LOG_FILE', '')
+os.environ['OUTBOX_DB_PATH'] = os.path.join(tempfile.mkdtemp(), 'outbox.db')
+
+from app.utils.qr_signing import QRSigner, InvalidQRPayload  # noqa: E402
+
+
+def bench(label, fn, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {iterations / elapsed:>14,.0f} ops/s {elapsed / iterations * 1e6:>10.2f} us/op")
+
+
+def rejects(signer, payload):
+    def run():
+        try:
+            signer.verify(payload)
+        except InvalidQRPayload:
+            pass
+    return run
+
+
+def bench_scan_route(requests):
+    from app import create_app
+
+    app = create_app()
+    forged = QRSigner('not-the-secret', app.config['EVENT_ID']).sign(str(uuid.uuid4()))
+    with app.test_client() as client:
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.post('/qr_codes/scan', json={'qr_data': forged})
+            assert response.status_code == 400
+        elapsed = time.perf_counter() - started
+    print(f"{'POST /qr_codes/scan (forged)':<34} {requests / elapsed:>14,.0f} req/s {elapsed / requests * 1e6:>10.2f} us/req")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--requests', type=int, default=2000, help='Requests for the route benchmark')
+    parser.add_argument('--skip-route', action='store_true', help='Only benchmark QRSigner.verify')
+    args = parser.parse_args()
+
+    signer = QRSigner('benchmark-secret', 'iftar')
+    user_id = str(uuid.uuid4())
+    valid = signer.sign(user_id)
+    forged = QRSigner('wrong-secret', 'iftar').sign(user_id)
+    wrong_event = QRSigner('benchmark-secret', 'other-event').sign(user_id)
+
+    bench('sign', lambda: signer.sign(user_id), args.iterations)
+    bench('verify valid', lambda: signer.verify(valid), args.iterations)
+    bench('verify forged signature', rejects(signer, forged), args.iterations)
+    bench('verify wrong event', rejects(signer, wrong_event), args.iterations)
+    bench('verify garbage', rejects(signer, 'not a qr code'), args.iterations)
+    bench('verify unsigned (compat mode)', lambda: signer.verify(user_id), args.iterations)
+    if not args.skip_route:
+        bench_scan_route(args.requests)
+
+
+if __name__ == '__main__':
+    main()
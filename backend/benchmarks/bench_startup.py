@@ -0,0 +1,139 @@
+"""Measure how long a fresh process takes to import the app and start serving.
+
+Usage (from backend/):
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --db-latency 0.05 --messaging-start 20 --output startup.json
+
+Every run is a new interpreter, so module imports are measured cold the way
+a restarted gunicorn worker sees them. A run reports:
+
+    import        time to import the app and supabase packages
+    create_app    time for create_app() to return
+    ready         time until /readyz answers 200 (database reachable)
+    first_scan    time until a /qr_codes/scan request is answered
+    messaging     time until the messaging transport is started
+
+The Supabase tables are the in-process stand-in from benchmarks/stubs.py and
+messaging is the fake transport; --messaging-start simulates the seconds a
+headless Chrome session takes to come up.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PHASES = ('import', 'create_app', 'ready', 'first_scan', 'messaging')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--db-latency', type=float, default=0.0, help='Seconds added to every table call')
+    parser.add_argument('--users', type=int, default=2000, help='Registrations loaded by the startup caches')
+    parser.add_argument('--messaging-start', type=float, default=0.0, help='Seconds the transport takes to start')
+    parser.add_argument('--roster', action='store_true', help='Enable the in-memory check-in roster')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def child(args):
+    started = time.perf_counter()
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    os.environ.update({
+        'SUPABASE_URL': 'http://supabase.startup',
+        'SUPABASE_KEY': 'startup.key',  # Must look like a JWT
+        'SECRET_KEY': 'startup-secret-' + 'x' * 32,
+        'DATABASE_BACKEND': 'supabase',
+        'MESSAGING_TRANSPORT': 'fake',
+        'FAKE_TRANSPORT_START_DELAY': str(args.messaging_start),
+        'OUTBOX_DB_PATH': os.path.join(workdir, 'outbox.db'),
+        'ROSTER_CACHE_ENABLED': 'true' if args.roster else 'false',
+        'LOG_FILE': '',
+        'LOG_LEVEL': 'WARNING',
+    })
+    os.environ.pop('QR_CACHE_DIR', None)
+
+    from benchmarks.stubs import StubSupabaseClient
+
+    client = StubSupabaseClient()
+    for index in range(args.users):
+        client.table('users').insert({
+            'name': f'User {index}', 'batch': '2023', 'branch': 'CSE',
+            'phone_number': f'017{index:08d}', 'transaction_id': f'TXN{index}',
+            'approval_status': 'approved', 'check_in_status': 'not_checked_in',
+        }).execute()
+    user_id = client.table('users').select('user_id').limit(1).execute().data[0]['user_id']
+    client.latency = args.db_latency
+    setup = time.perf_counter() - started
+
+    timings = {}
+    t0 = time.perf_counter()
+    import supabase
+    import app
+    timings['import'] = time.perf_counter() - t0
+    # create_app() imports create_client from the supabase package when it runs
+    supabase.create_client = lambda url, key, *a, **k: client
+
+    t0 = time.perf_counter()
+    flask_app = app.create_app()
+    timings['create_app'] = time.perf_counter() - t0
+
+    test_client = flask_app.test_client()
+    while test_client.get('/readyz').status_code != 200:
+        time.sleep(0.005)
+    timings['ready'] = time.perf_counter() - t0
+
+    qr_data = flask_app.qr_signer.sign(user_id)
+    test_client.post('/qr_codes/scan', json={'qr_data': qr_data})
+    timings['first_scan'] = time.perf_counter() - t0
+
+    flask_app.subsystems.wait('messaging', timeout=args.messaging_start + 60)
+    timings['messaging'] = time.perf_counter() - t0
+    timings['setup'] = setup
+    print(json.dumps(timings))
+    sys.stdout.flush()
+    os._exit(0)  # Skip atexit shutdown; it is not part of startup
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        child(args)
+        return
+
+    command = [sys.executable, '-m', 'benchmarks.bench_startup', '--child',
+               '--db-latency', str(args.db_latency), '--users', str(args.users),
+               '--messaging-start', str(args.messaging_start)]
+    if args.roster:
+        command.append('--roster')
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    runs = []
+    for index in range(args.runs):
+        output = subprocess.run(command, cwd=backend_dir, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    results = {}
+    print(f"{'phase':<12} {'median':>9} {'min':>9} {'max':>9}")
+    for phase in PHASES:
+        values = [run[phase] for run in runs]
+        results[phase] = {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+        print(f"{phase:<12} {results[phase]['median'] * 1000:>7.1f}ms {results[phase]['min'] * 1000:>7.1f}ms "
+              f"{results[phase]['max'] * 1000:>7.1f}ms")
+    print('(create_app, ready, first_scan and messaging are measured from the start of create_app)')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': {key: value for key, value in vars(args).items() if key != 'child'},
+                       'runs': runs, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Compare per-message latency across messaging transports.
+
+Usage (from backend/):
+    python -m benchmarks.bench_transports --messages 200
+    python -m benchmarks.bench_transports --selenium --messages 5
+
+The http transport is measured against a local stub of the WhatsApp Cloud
+API, so the numbers show client-side overhead (connection reuse, encoding)
+rather than Meta's server time. Pass --api-latency to simulate that.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import socket
+import statistics
+import threading
+import time
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.transports import FakeTransport, HttpApiTransport, SeleniumTransport  # noqa: E402
+
+
+def start_stub_api(latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+        disable_nagle_algorithm = True
+
+        def handle_one_request(self):
+            # The client writes headers and body separately; ACK at once so Nagle's
+            # algorithm on the client side does not add a delayed-ACK stall per request
+            if hasattr(socket, 'TCP_QUICKACK'):
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+            super().handle_one_request()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if latency:
+                time.sleep(latency)
+            body = json.dumps({'messages': [{'id': 'wamid.stub'}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(transport, messages, phone_number):
+    latencies = []
+    started = time.perf_counter()
+    for index in range(messages):
+        t0 = time.perf_counter()
+        transport.send(phone_number, f'Benchmark message {index}')
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'transport': transport.name,
+        'messages': messages,
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'messages_per_second': round(messages / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='Simulated API latency in seconds')
+    parser.add_argument('--selenium', action='store_true', help='Also measure real WhatsApp Web sessions')
+    parser.add_argument('--phone-number', default='+8801700000000')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = [measure(FakeTransport(), args.messages, args.phone_number)]
+
+    server = start_stub_api(args.api_latency)
+    http_transport = HttpApiTransport(f'http://127.0.0.1:{server.server_port}', 'token', 'benchmark')
+    try:
+        results.append(measure(http_transport, args.messages, args.phone_number))
+    finally:
+        http_transport.close()
+        server.shutdown()
+
+    if args.selenium:
+        from app.utils.whatsapp import WhatsAppSessionPool
+        selenium_transport = SeleniumTransport(WhatsAppSessionPool(size=1, rate_per_minute=600))
+        selenium_transport.start()
+        try:
+            results.append(measure(selenium_transport, args.messages, args.phone_number))
+        finally:
+            selenium_transport.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'transport':<10} {'messages':>8} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'msg/s':>10}")
+    for r in results:
+        print(f"{r['transport']:<10} {r['messages']:>8} {r['p50_ms']:>10} {r['p95_ms']:>10} "
+              f"{r['max_ms']:>10} {r['messages_per_second']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Offline load test for the registration and check-in flow.
+
+Usage (from backend/):
+    python -m benchmarks.load_test --users 500 --concurrency 16
+    python -m benchmarks.load_test --db-latency 0.05 --output results.json
+    python -m benchmarks.load_test --baseline results.json --max-regression 0.2
+
+Runs the real create_app() against an in-process stand-in for the Supabase
+tables and storage (benchmarks/stubs.py) and the fake messaging transport in
+place of WhatsApp Web, each with configurable injected latency. Load is
+driven in phases: /auth/login, /auth/refresh, /users/register, /users/approve/<id>, then
+/qr_codes/scan for every approved user. Approval is timed end to end: the 202
+plus polling /jobs/<id> until the background job has finished, so every user
+is approved before the scans start. Each phase reports p50/p95/p99
+latency and throughput; --output writes them as JSON and --baseline
+compares against an earlier run, exiting with status 1 when p95 latency or
+throughput regressed by more than --max-regression.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADMIN_EMAIL = 'loadtest@example.com'
+ADMIN_PASSWORD = 'loadtest-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200, help='Users to register, approve and scan')
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads per phase')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='Seconds added to every table call')
+    parser.add_argument('--storage-latency', type=float, default=0.0, help='Seconds added to every upload')
+    parser.add_argument('--message-latency', type=float, default=0.0, help='Seconds added to every message send')
+    parser.add_argument('--roster', action='store_true', help='Enable the in-memory check-in roster')
+    parser.add_argument('--job-timeout', type=float, default=60.0, help='Seconds to wait for one approval job')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against a previous --output file')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Allowed fractional regression against --baseline (default 0.2)')
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    # Config reads the environment when the app package is imported
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ.update({
+        'SUPABASE_URL': 'http://supabase.loadtest',
+        'SUPABASE_KEY': 'loadtest.key',  # Must look like a JWT
+        'SECRET_KEY': 'loadtest-secret-' + 'x' * 32,
+        'DATABASE_BACKEND': 'supabase',
+        'MESSAGING_TRANSPORT': 'fake',
+        'FAKE_TRANSPORT_LATENCY': str(args.message_latency),
+        'OUTBOX_DB_PATH': os.path.join(workdir, 'outbox.db'),
+        'OUTBOX_RATE_PER_MINUTE': '1000000',
+        'OUTBOX_BURST': '1000',
+        'ROSTER_CACHE_ENABLED': 'true' if args.roster else 'false',
+        'LOG_FILE': '',
+        # Every simulated client shares one address and one admin account
+        'LOGIN_RATE_PER_IP': '1000000',
+        'LOGIN_BURST_PER_IP': '1000000',
+        'LOGIN_RATE_PER_EMAIL': '1000000',
+        'LOGIN_BURST_PER_EMAIL': '1000000',
+        'LOGIN_VERIFY_QUEUE': '1000',
+        # One job thread per client thread, so approvals are not capped by the default pool
+        'JOB_WORKERS': str(args.concurrency),
+    })
+    os.environ.pop('QR_CACHE_DIR', None)
+
+
+def build_app(args):
+    import bcrypt
+    import supabase
+    from benchmarks.stubs import StubSupabaseClient
+
+    client = StubSupabaseClient(latency=args.db_latency, storage_latency=args.storage_latency)
+    client.tables['admins'] = {}
+    admin_id = str(uuid.uuid4())
+    client.tables['admins'][admin_id] = {
+        'admin_id': admin_id,
+        'email': ADMIN_EMAIL,
+        'password': bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8'),
+    }
+    # create_app() imports create_client from the supabase package when it runs
+    supabase.create_client = lambda url, key, *a, **k: client
+
+    from app import create_app
+    app = create_app()
+    return app, client
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_phase(app, name, items, request_fn, concurrency, failed=lambda response: response.status_code >= 400):
+    """Call request_fn(client, item) for every item from `concurrency` threads."""
+    latencies, errors, results = [], [], []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def call(item):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        t0 = time.perf_counter()
+        response = request_fn(local.client, item)
+        elapsed = time.perf_counter() - t0
+        with lock:
+            latencies.append(elapsed)
+            if failed(response):
+                errors.append(response.status_code)
+            else:
+                results.append(response.get_json())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, items))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    summary = {
+        'endpoint': name,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'error_statuses': sorted(set(errors)),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else None,
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+    return summary, results
+
+
+def approve_and_wait(client, user_id, headers, timeout):
+    # Returns the last /jobs/<id> response, or the approve response if it was not a 202
+    response = client.patch(f'/users/approve/{user_id}', headers=headers)
+    if response.status_code != 202:
+        return response
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(response.headers['Location'], headers=headers)
+        if job.status_code >= 400 or job.get_json()['status'] in ('succeeded', 'failed'):
+            return job
+        if time.monotonic() > deadline:
+            return job
+        time.sleep(0.005)
+
+
+def run(args):
+    app, client = build_app(args)
+    from app.utils.qr_code import qr_code_payload
+
+    phases = []
+
+    summary, tokens = run_phase(
+        app, 'POST /auth/login', range(args.logins),
+        lambda c, _: c.post('/auth/login', json={'email': ADMIN_EMAIL, 'password': ADMIN_PASSWORD}),
+        args.concurrency,
+    )
+    phases.append(summary)
+    if not tokens:
+        raise SystemExit('Login failed, cannot continue')
+    headers = {'Authorization': f"Bearer {tokens[0]['access_token']}"}
+
+    refresh_headers = {'Authorization': f"Bearer {tokens[0]['refresh_token']}"}
+    summary, _ = run_phase(
+        app, 'POST /auth/refresh', range(args.logins),
+        lambda c, _: c.post('/auth/refresh', headers=refresh_headers),
+        args.concurrency,
+    )
+    phases.append(summary)
+
+    summary, registered = run_phase(
+        app, 'POST /users/register', range(args.users),
+        lambda c, i: c.post('/users/register', data={
+            'name': f'Load Test {i}',
+            'batch': '2020',
+            'branch': 'CSE',
+            'phone_number': f'017{i:08d}',
+            'transaction_id': f'LT{i:08d}',
+        }),
+        args.concurrency,
+    )
+    phases.append(summary)
+    user_ids = [result['user_id'] for result in registered]
+
+    summary, _ = run_phase(
+        app, 'PATCH /users/approve/<id>', user_ids,
+        lambda c, user_id: approve_and_wait(c, user_id, headers, args.job_timeout),
+        args.concurrency,
+        failed=lambda response: response.status_code >= 400 or response.get_json().get('status') != 'succeeded',
+    )
+    phases.append(summary)
+
+    with app.app_context():
+        payloads = [qr_code_payload(user_id) for user_id in user_ids]
+    summary, _ = run_phase(
+        app, 'POST /qr_codes/scan', payloads,
+        lambda c, payload: c.post('/qr_codes/scan', json={'qr_data': payload}),
+        args.concurrency,
+    )
+    phases.append(summary)
+
+    return {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'settings': {
+            'users': args.users,
+            'logins': args.logins,
+            'concurrency': args.concurrency,
+            'db_latency': args.db_latency,
+            'storage_latency': args.storage_latency,
+            'message_latency': args.message_latency,
+            'roster': args.roster,
+        },
+        'endpoints': phases,
+        'backend': {'table_round_trips': client.round_trips, 'storage_uploads': client.uploads},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, max_regression):
+    """Print p95 and throughput changes; return the endpoints that regressed."""
+    previous = {phase['endpoint']: phase for phase in baseline['endpoints']}
+    regressed = []
+    print(f"\n{'vs baseline':<28} {'p95 change':>12} {'req/s change':>14}")
+    for phase in results['endpoints']:
+        before = previous.get(phase['endpoint'])
+        if not before or not before['p95_ms'] or not before['requests_per_second'] or phase['p95_ms'] is None:
+            continue
+        p95_change = phase['p95_ms'] / before['p95_ms'] - 1
+        rps_change = phase['requests_per_second'] / before['requests_per_second'] - 1
+        flag = ''
+        if p95_change > max_regression or rps_change < -max_regression:
+            regressed.append(phase['endpoint'])
+            flag = '  REGRESSED'
+        print(f"{phase['endpoint']:<28} {p95_change:>+11.1%} {rps_change:>+13.1%}{flag}")
+    return regressed
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+    # Per-request INFO logging would dominate the measurements
+    logging.disable(logging.WARNING)
+
+    results = run(args)
+
+    print(f"{'endpoint':<28} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for r in results['endpoints']:
+        print(f"{r['endpoint']:<28} {r['requests']:>6} {r['errors']:>6} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['p99_ms']:>9} {r['requests_per_second']:>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(results, json.load(f), args.max_regression)
+        if regressed:
+            print(f"\nRegressed: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
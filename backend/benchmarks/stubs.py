@@ -0,0 +1,164 @@
+"""In-process stand-ins for the Supabase client, used by the load test.
+
+Only the query-builder calls made by app.backends.supabase_backend and the
+storage upload made by app.utils.qr_code are implemented. Every execute()
+and upload sleeps for the configured latency outside the table lock, so
+concurrent requests overlap the way they would against the real service.
+"""
+import datetime
+import itertools
+import threading
+import time
+import uuid
+
+PRIMARY_KEYS = {'users': 'user_id', 'admins': 'admin_id'}
+
+
+class StubResponse:
+    def __init__(self, data=None, status_code=200, content=b''):
+        self.data = data
+        self.status_code = status_code
+        self.content = content
+
+
+class StubQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.pk = PRIMARY_KEYS.get(table, 'id')
+        self.operation = 'select'
+        self.columns = '*'
+        self.payload = None
+        self.filters = []
+        self.key_filter = None
+        self.order_by = []
+        self.row_limit = None
+
+    def select(self, columns='*', **kwargs):
+        self.operation, self.columns = 'select', columns
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.operation, self.payload = 'insert', payload
+        return self
+
+    def upsert(self, payload, **kwargs):
+        self.operation, self.payload = 'upsert', payload
+        return self
+
+    def update(self, payload, **kwargs):
+        self.operation, self.payload = 'update', payload
+        return self
+
+    def eq(self, column, value):
+        if column == self.pk and self.key_filter is None:
+            self.key_filter = [str(value)]
+        else:
+            self.filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def in_(self, column, values):
+        if column == self.pk and self.key_filter is None:
+            self.key_filter = [str(value) for value in values]
+        else:
+            allowed = {str(value) for value in values}
+            self.filters.append(lambda row: str(row.get(column)) in allowed)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by.append(column)
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def _project(self, row):
+        if self.columns == '*':
+            return dict(row)
+        return {column.strip(): row.get(column.strip()) for column in self.columns.split(',')}
+
+    def execute(self):
+        if self.client.latency:
+            time.sleep(self.client.latency)
+        with self.client.lock:
+            self.client.round_trips += 1
+            return StubResponse(getattr(self, f'_{self.operation}')(self.client.tables.setdefault(self.table, {})))
+
+    def _matching(self, rows):
+        if self.key_filter is not None:
+            candidates = [rows[key] for key in self.key_filter if key in rows]
+        else:
+            candidates = list(rows.values())
+        return [row for row in candidates if all(check(row) for check in self.filters)]
+
+    def _select(self, rows):
+        matched = self._matching(rows)
+        for column in reversed(self.order_by):
+            matched.sort(key=lambda row: str(row.get(column)))
+        if self.row_limit is not None:
+            matched = matched[:self.row_limit]
+        return [self._project(row) for row in matched]
+
+    def _insert(self, rows):
+        inserted = []
+        for item in (self.payload if isinstance(self.payload, list) else [self.payload]):
+            row = dict(item)
+            row.setdefault(self.pk, str(uuid.uuid4()))
+            row.setdefault('created_at', self.client.timestamp())
+            if self.operation == 'upsert' and row[self.pk] in rows:
+                rows[row[self.pk]].update(item)
+                row = rows[row[self.pk]]
+            rows[row[self.pk]] = row
+            inserted.append(dict(row))
+        return inserted
+
+    _upsert = _insert
+
+    def _update(self, rows):
+        matched = self._matching(rows)
+        for row in matched:
+            row.update(self.payload)
+        return [dict(row) for row in matched]
+
+
+class StubBucket:
+    def __init__(self, client):
+        self.client = client
+
+    def upload(self, path, file, file_options=None):
+        if self.client.storage_latency:
+            time.sleep(self.client.storage_latency)
+        with self.client.lock:
+            self.client.uploads += 1
+        return StubResponse(status_code=200)
+
+
+class StubStorage:
+    def __init__(self, client):
+        self.client = client
+
+    def from_(self, bucket):
+        return StubBucket(self.client)
+
+
+class StubSupabaseClient:
+    def __init__(self, latency=0.0, storage_latency=0.0):
+        self.latency = latency
+        self.storage_latency = storage_latency
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        self.uploads = 0
+        self.storage = StubStorage(self)
+        self._sequence = itertools.count()
+
+    def timestamp(self):
+        # Unique and increasing, so keyset ordering stays stable
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return f'{now.isoformat()}{next(self._sequence):08d}'
+
+    def table(self, name):
+        return StubQuery(self, name)
+
+    from_ = table
@@ -0,0 +1,30 @@
+# Gunicorn settings for production:
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Each gevent worker serves many requests at once: Supabase, storage and Selenium
+# calls yield to other requests while they wait on the network, so one worker
+# keeps hundreds of scans and registrations in flight. CPU-bound work (bcrypt, QR
+# rendering) does not yield, so it runs on OS threads (app/utils/cpu.py); check with
+# python -m benchmarks.bench_gevent_cpu
+import os
+import sys
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '1000'))  # Concurrent requests per worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))  # Bulk approvals render and upload hundreds of QR codes
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+# create_app() opens HTTP pools, SQLite connections, threads and browser sessions, none of
+# which survive a fork, so every worker builds its own app after forking
+preload_app = False
+
+# The check-in roster answers scans from process memory; two workers would each accept
+# the same QR code once
+if os.environ.get('ROSTER_CACHE_ENABLED', 'false').lower() == 'true' and workers > 1:
+    print('ROSTER_CACHE_ENABLED needs a single worker, starting 1 instead of '
+          f'{workers}', file=sys.stderr)
+    workers = 1
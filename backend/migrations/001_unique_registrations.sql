@@ -0,0 +1,15 @@
+-- Unique registrations per transaction and per phone number.
+-- Backs the duplicate detection in /users/register and /users/import: when two
+-- processes race, the insert that loses fails with 23505 and the request
+-- returns the existing registration instead.
+--
+-- Run in the Supabase SQL editor. Existing duplicates must be resolved first:
+--   select transaction_id, count(*) from users group by 1 having count(*) > 1;
+--   select regexp_replace(regexp_replace(phone_number, '\D', '', 'g'), '^(88)?0?', '') as phone, count(*)
+--     from users group by 1 having count(*) > 1;
+
+create unique index if not exists users_transaction_id_key on users (transaction_id);
+
+-- Same normalization as app.utils.registrations.normalize_phone_number
+create unique index if not exists users_phone_key
+    on users ((regexp_replace(regexp_replace(phone_number, '\D', '', 'g'), '^(88)?0?', '')));
@@ -1,16 +1,12 @@
 from app import create_app
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler('app.log'), logging.StreamHandler()]
-)
 logger = logging.getLogger(__name__)
 
 app = create_app()
 
+# Development server only. In production use the gevent workers:
+#     gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == '__main__':
-    logger.info("Starting Flask application")
+    logger.info("Starting Flask development server")
     app.run(host='0.0.0.0', port=5000, debug=False)  # Debug=False for production
\ No newline at end of file
@@ -4,8 +4,18 @@ from app import create_app
 from supabase import create_client
 import bcrypt
 import time
+import gzip
+import json
+import base64
+import csv
 from io import BytesIO
+from collections import OrderedDict
 from dotenv import load_dotenv
+from app.utils.qr_signing import QRSigner
+from app.database import get_user_by_id, update_user
+import threading
+import subprocess
+import sys
 
 # Load environment variables from .env
 load_dotenv()
@@ -52,6 +62,15 @@ def admin_token(client, supabase):
     # Cleanup admin
     supabase.table('admins').delete().eq('admin_id', admin_id).execute()
 
+def wait_for_job(client, response, headers, timeout=30):
+    # Poll the job status URL returned with a 202 until the job finishes
+    deadline = time.time() + timeout
+    while True:
+        job = client.get(response.headers['Location'], headers=headers).get_json()
+        if job['status'] in ('succeeded', 'failed') or time.time() > deadline:
+            return job
+        time.sleep(0.1)
+
 def test_full_backend_flow(client, supabase, admin_token):
     # Step 1: Register a user
     user_data = {
@@ -78,10 +97,13 @@ def test_full_backend_flow(client, supabase, admin_token):
     pending_users = pending_response.get_json()
     assert any(u['user_id'] == user_id for u in pending_users)
 
-    # Step 3: Approve user (includes QR code generation and WhatsApp message)
+    # Step 3: Approve user (QR code generation, upload and WhatsApp message run as a background job)
     approve_response = client.patch(f'/users/approve/{user_id}', headers=admin_token)
-    assert approve_response.status_code == 200
-    assert approve_response.get_json()['message'] == 'User approved and QR code sent'
+    assert approve_response.status_code == 202
+    assert approve_response.get_json()['message'] == 'User approval queued'
+    job = wait_for_job(client, approve_response, admin_token)
+    assert job['status'] == 'succeeded', job
+    assert [stage['name'] for stage in job['stages'] if stage['status'] == 'done'] == ['render', 'upload', 'persist', 'notify']
 
     # Verify approval and QR code
     updated_user = supabase.table('users').select('*').eq('user_id', user_id).execute().data[0]
@@ -103,14 +125,18 @@ def test_full_backend_flow(client, supabase, admin_token):
     assert repeat_scan_response.status_code == 400
     assert 'already checked in' in repeat_scan_response.get_data(as_text=True)
 
-    # Step 6: Test WhatsApp manual message (assuming WhatsApp bot is mocked or functional)
+    # Step 6: Test WhatsApp manual message (queued in the outbox, delivered in the background)
     whatsapp_response = client.post(
         '/whatsapp/send_message',
         headers=admin_token,
         json={'phone_number': '+8801712345678', 'message': 'Test message'}
     )
-    assert whatsapp_response.status_code == 200
-    assert whatsapp_response.get_json()['message'] == 'Message sent successfully'
+    assert whatsapp_response.status_code == 202
+    assert whatsapp_response.get_json()['message'] == 'Message queued for delivery'
+
+    outbox_response = client.get('/whatsapp/outbox', headers=admin_token)
+    assert outbox_response.status_code == 200
+    assert 'queue_depth' in outbox_response.get_json()
 
     # Step 7: Test rejecting a new user
     new_user_data = {
@@ -148,7 +174,1022 @@ def test_auth(client, supabase):
     assert protected_response.status_code == 200
     assert 'Hello, admin' in protected_response.get_json()['message']
 
+    # Test refreshing the access token without logging in again
+    refresh_token = login_response.get_json()['refresh_token']
+    refresh_response = client.post('/auth/refresh', headers={'Authorization': f'Bearer {refresh_token}'})
+    assert refresh_response.status_code == 200
+    refreshed = refresh_response.get_json()['access_token']
+    assert client.get('/auth/protected', headers={'Authorization': f'Bearer {refreshed}'}).status_code == 200
+
+    # An access token cannot be used as a refresh token
+    assert client.post('/auth/refresh', headers={'Authorization': f'Bearer {token}'}).status_code == 422
+
     # Test invalid login
     invalid_login = client.post('/auth/login', json={'email': 'test@admin.com', 'password': 'wrongpass'})
     assert invalid_login.status_code == 401
-    assert 'Invalid credentials' in invalid_login.get_data(as_text=True)
\ No newline at end of file
+    assert 'Invalid credentials' in invalid_login.get_data(as_text=True)
+
+def test_scan_batch(client, supabase):
+    # Seed one approved and one pending user directly
+    approved = supabase.table('users').insert({
+        'name': 'Batch Approved', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01711111111',
+        'transaction_id': 'TXNB1', 'approval_status': 'approved', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id']
+    pending = supabase.table('users').insert({
+        'name': 'Batch Pending', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01722222222',
+        'transaction_id': 'TXNB2', 'approval_status': 'pending', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id']
+
+    response = client.post('/qr_codes/scan/batch', json={'scans': [
+        {'user_id': approved, 'scanned_at': '2025-03-20T18:01:00Z', 'gate_id': 'gate-2'},
+        {'user_id': approved, 'scanned_at': '2025-03-20T18:00:00Z', 'gate_id': 'gate-1'},
+        [pending, '2025-03-20T18:02:00Z', 'gate-1'],
+        ['00000000-0000-0000-0000-000000000001', '2025-03-20T18:03:00Z', 'gate-1'],
+    ]})
+    assert response.status_code == 200
+    results = [item['result'] for item in response.get_json()['results']]
+    assert results == ['duplicate', 'checked_in', 'not_approved', 'unknown']
+
+    checked_in_user = supabase.table('users').select('*').eq('user_id', approved).execute().data[0]
+    assert checked_in_user['check_in_status'] == 'checked_in'
+
+    # Times are compared as instants, whatever their format or offset
+    other = supabase.table('users').insert({
+        'name': 'Batch Mixed', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01733333333',
+        'transaction_id': 'TXNB3', 'approval_status': 'approved', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id']
+    response = client.post('/qr_codes/scan/batch', json={'scans': [
+        [other, 1742495400, 'gate-1'],
+        [other, '2025-03-20T18:10:00Z', 'gate-2'],
+        [other, '2025-03-20T20:00:00+02:00', 'gate-3'],
+        [other, 'yesterday', 'gate-4'],
+    ]})
+    assert response.status_code == 200
+    results = [item['result'] for item in response.get_json()['results']]
+    assert results == ['duplicate', 'duplicate', 'checked_in', 'invalid']
+
+def test_scan_rejects_forged_qr_code(client, app):
+    # Signed with the wrong key: must be rejected without a database lookup
+    forged = QRSigner('not-the-secret-key', app.config['EVENT_ID']).sign('00000000-0000-0000-0000-000000000001')
+    response = client.post('/qr_codes/scan', json={'qr_data': forged})
+    assert response.status_code == 400
+    assert 'Invalid QR code' in response.get_data(as_text=True)
+
+def test_register_is_idempotent(client, supabase):
+    user_data = {
+        'name': 'Retry User',
+        'batch': '2023',
+        'branch': 'CSE',
+        'phone_number': '01755555555',
+        'transaction_id': 'TXNR1'
+    }
+    first = client.post('/users/register', data=user_data, headers={'Idempotency-Key': 'retry-1'})
+    assert first.status_code == 201
+    user_id = first.get_json()['user_id']
+
+    # Same Idempotency-Key: the original response is replayed
+    replay = client.post('/users/register', data=user_data, headers={'Idempotency-Key': 'retry-1'})
+    assert replay.status_code == 201
+    assert replay.get_json()['user_id'] == user_id
+
+    # The same key with another person's form is refused, not answered with the first registration
+    reused = client.post('/users/register', data={**user_data, 'transaction_id': 'TXNR3', 'phone_number': '01755555556'},
+                         headers={'Idempotency-Key': 'retry-1'})
+    assert reused.status_code == 422
+
+    # Same phone number in another spelling, no key: the existing user is returned
+    duplicate = client.post('/users/register', data={**user_data, 'transaction_id': 'TXNR2', 'phone_number': '+881755555555'})
+    assert duplicate.status_code == 200
+    assert duplicate.get_json()['user_id'] == user_id
+    assert duplicate.get_json()['duplicate_of'] == 'phone_number'
+
+    rows = supabase.table('users').select('user_id').in_('transaction_id', ['TXNR1', 'TXNR2', 'TXNR3']).execute().data
+    assert len(rows) == 1
+
+def test_import_users(client, supabase, admin_token):
+    csv_data = (
+        'name,batch,branch,phone_number,transaction_id\n'
+        'Import One,2023,CSE,01733333333,TXNI1\n'
+        'Import Two,2024,EEE,+8801744444444,TXNI2\n'
+        'Bad Phone,2024,EEE,12345,TXNI3\n'
+    )
+    response = client.post(
+        '/users/import',
+        headers=admin_token,
+        data={'file': (BytesIO(csv_data.encode('utf-8')), 'registrations.csv')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 200
+    report = response.get_json()
+    assert report['imported'] == 2
+    assert report['errors'] == [{'row': 4, 'error': 'Invalid phone number format (e.g., 01712345678 or +8801712345678)'}]
+
+    imported = supabase.table('users').select('*').in_('transaction_id', ['TXNI1', 'TXNI2']).execute().data
+    assert {u['approval_status'] for u in imported} == {'pending'}
+
+def test_dashboard_stream(app, client, supabase, admin_token):
+    # The aggregates load in the background after startup
+    assert app.subsystems.wait('dashboard', timeout=30)
+    summary = client.get('/dashboard/summary', headers=admin_token).get_json()
+    total = summary['aggregates']['total']
+
+    # EventSource clients pass the token in the query string
+    token = admin_token['Authorization'].split()[1]
+    response = client.get(f'/dashboard/stream?jwt={token}', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = iter(response.response)
+    assert next(events) == b'retry: 3000\n\n'
+    assert b'event: snapshot' in next(events)
+
+    user_data = {
+        'name': 'Dashboard User',
+        'batch': '2022',
+        'branch': 'ME',
+        'phone_number': '01766666666',
+        'transaction_id': 'TXND1'
+    }
+    user_id = client.post('/users/register', data=user_data).get_json()['user_id']
+    event = next(events).decode('utf-8')
+    assert 'event: registered' in event
+    assert user_id in event
+    assert b'event: aggregates' in next(events)
+    response.close()
+
+    summary = client.get('/dashboard/summary', headers=admin_token).get_json()
+    assert summary['aggregates']['total'] == total + 1
+    assert summary['aggregates']['batch']['2022']['approval_status']['pending'] >= 1
+
+def test_health_probes(app, client):
+    # create_app() returns before the database has been checked; /healthz answers regardless
+    health = client.get('/healthz')
+    assert health.status_code == 200
+    assert set(health.get_json()['subsystems']) >= {'database', 'registration_index', 'messaging'}
+
+    assert app.subsystems.wait('database', timeout=30)
+    ready = client.get('/readyz')
+    assert ready.status_code == 200
+    assert ready.get_json()['subsystems']['database'] == 'ready'
+
+def test_search_and_desk_check_in(app, client, supabase, admin_token):
+    user_data = {
+        'name': 'Desk Lookup User',
+        'batch': '2021',
+        'branch': 'CE',
+        'phone_number': '01777778888',
+        'transaction_id': 'TXNS1'
+    }
+    user_id = client.post('/users/register', data=user_data).get_json()['user_id']
+    assert app.subsystems.wait('attendee_index', timeout=30)
+    approve_response = client.patch(f'/users/approve/{user_id}', headers=admin_token)
+    assert approve_response.status_code == 202
+    assert wait_for_job(client, approve_response, admin_token)['status'] == 'succeeded'
+
+    # Approved users are found by name prefix, misspelled name and the last phone digits
+    for query, match in [('desk look', 'name_prefix'), ('Lookpu', 'name_similar'), ('8888', 'phone_suffix')]:
+        results = client.get(f'/users/search?q={query}', headers=admin_token).get_json()['results']
+        assert [(r['user_id'], r['match']) for r in results if r['user_id'] == user_id] == [(user_id, match)]
+    assert client.get('/users/search?q=d', headers=admin_token).status_code == 400
+
+    assert client.post(f'/qr_codes/check_in/{user_id}', headers=admin_token).status_code == 200
+    assert client.post(f'/qr_codes/check_in/{user_id}', headers=admin_token).status_code == 400
+    results = client.get('/users/search?q=01777778888', headers=admin_token).get_json()['results']
+    assert results[0]['check_in_status'] == 'checked_in'
+
+def test_qr_code_image(client, supabase):
+    user_id = supabase.table('users').insert({
+        'name': 'Image User', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01799990000',
+        'transaction_id': 'TXNQ1', 'approval_status': 'approved', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id']
+
+    response = client.get(f'/qr_codes/{user_id}.png')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert 'max-age' in response.headers['Cache-Control']
+
+    # Revalidation with the strong ETag is answered without a body
+    revalidated = client.get(f'/qr_codes/{user_id}.png', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert client.get('/qr_codes/00000000-0000-0000-0000-000000000001.png').status_code == 404
+
+def test_broadcast_campaign(client, admin_token):
+    invalid = client.post('/whatsapp/broadcasts', headers=admin_token, json={'template': 'Hi {name.__class__}'})
+    assert invalid.status_code == 400
+
+    response = client.post('/whatsapp/broadcasts', headers=admin_token,
+                           json={'template': 'Dear {name}, gates open at 6pm', 'filters': {'batch': '2023'}})
+    assert response.status_code == 202
+    campaign_id = response.get_json()['campaign_id']
+
+    progress = client.get(response.headers['Location'], headers=admin_token).get_json()
+    assert progress['campaign_id'] == campaign_id
+    assert {'sent', 'failed', 'remaining'} <= set(progress)
+
+    assert client.get('/whatsapp/broadcasts/999999', headers=admin_token).status_code == 404
+
+def test_roster_feed(client, supabase, admin_token):
+    user_id = supabase.table('users').insert({
+        'name': 'Roster User', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01788880000',
+        'transaction_id': 'TXNF1', 'approval_status': 'approved', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id']
+
+    # New devices get a snapshot of every approved user
+    snapshot = client.get('/qr_codes/roster', headers={**admin_token, 'Accept-Encoding': 'gzip'})
+    assert snapshot.status_code == 200
+    assert snapshot.headers['Content-Encoding'] == 'gzip'
+    lines = [json.loads(line) for line in gzip.decompress(snapshot.data).decode('utf-8').splitlines()]
+    assert lines[0]['snapshot'] is True
+    assert [user_id, 'a'] in lines[1:]
+
+    # Then only what changed after their version
+    version = snapshot.headers['X-Roster-Version']
+    assert client.post('/qr_codes/scan', json={'user_id': user_id}).status_code == 200
+    delta = client.get(f'/qr_codes/roster?since={version}', headers=admin_token)
+    lines = [json.loads(line) for line in delta.get_data(as_text=True).splitlines()]
+    assert lines[0]['snapshot'] is False
+    assert lines[1:] == [[user_id, 'c']]
+
+def test_check_in_survives_failing_signal_receiver(app, client, supabase, monkeypatch):
+    user_id = supabase.table('users').insert({
+        'name': 'Receiver User', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01788880001',
+        'transaction_id': 'TXNF2', 'approval_status': 'approved', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id']
+
+    # The check-in is already committed when the signal runs, so a broken cache must not turn it into a 500
+    def broken(*args, **kwargs):
+        raise RuntimeError('feed unavailable')
+    monkeypatch.setattr(app.roster_feed, 'record', broken)
+    assert client.post('/qr_codes/scan', json={'user_id': user_id}).status_code == 200
+    assert client.post('/qr_codes/scan', json={'user_id': user_id}).status_code == 400
+
+def test_user_lookups_are_batched_and_cached(app, client, supabase, monkeypatch):
+    user_ids = [supabase.table('users').insert({
+        'name': f'Lookup User {i}', 'batch': '2023', 'branch': 'CSE', 'phone_number': f'0178888{i:04d}',
+        'transaction_id': f'TXNL{i}', 'approval_status': 'pending', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id'] for i in range(5)]
+    loader = app.user_loader
+
+    # Concurrent lookups share one query (the delay stands in for a database round trip,
+    # which is what lets the lookups overlap)
+    get_users = loader.store.get_users
+    monkeypatch.setattr(loader.store, 'get_users', lambda *args: time.sleep(0.05) or get_users(*args))
+    found = {}
+    def look_up(user_id):
+        with app.app_context():
+            found[user_id] = get_user_by_id(user_id, 'user_id, name')
+    before = loader.stats()['queries']
+    threads = [threading.Thread(target=look_up, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loader.stats()['queries'] - before < len(user_ids)
+    assert all(found[user_id] == {'user_id': user_id, 'name': found[user_id]['name']} for user_id in user_ids)
+
+    # Repeated lookups are served from memory until the user is written
+    with app.app_context():
+        assert get_user_by_id(user_ids[0])['approval_status'] == 'pending'
+        before = loader.stats()['queries']
+        assert get_user_by_id(user_ids[0], 'approval_status') == {'approval_status': 'pending'}
+        assert loader.stats()['queries'] == before
+        update_user(user_ids[0], {'approval_status': 'rejected'})
+        assert get_user_by_id(user_ids[0])['approval_status'] == 'rejected'
+        assert get_user_by_id('not-a-uuid') is None
+
+def test_export_users(client, supabase, admin_token):
+    for i in range(3):
+        supabase.table('users').insert({
+            'name': f'Export User {i}', 'batch': '2022', 'branch': 'EEE', 'phone_number': f'0179999{i:04d}',
+            'transaction_id': f'TXNE{i}', 'approval_status': 'approved' if i else 'pending',
+            'check_in_status': 'not_checked_in'
+        }).execute()
+
+    response = client.get('/users/export?batch=2022', headers=admin_token)
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].startswith('attachment')
+    rows = list(csv.DictReader(response.get_data(as_text=True).splitlines()))
+    assert sorted(row['name'] for row in rows) == ['Export User 0', 'Export User 1', 'Export User 2']
+
+    # Column selection, filters and gzip
+    response = client.get('/users/export?format=ndjson&columns=name,approval_status&batch=2022&approval_status=approved',
+                          headers={**admin_token, 'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    lines = [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+    assert sorted(line['name'] for line in lines) == ['Export User 1', 'Export User 2']
+    assert all(set(line) == {'name', 'approval_status'} for line in lines)
+
+    assert client.get('/users/export?format=xlsx', headers=admin_token).status_code == 400
+    assert client.get('/users/export?columns=password', headers=admin_token).status_code == 400
+    assert client.get('/users/export').status_code == 401
+
+def test_cpu_bound_work_does_not_stall_gevent():
+    # Runs in its own process, since it monkey-patches like a gevent gunicorn worker
+    result = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_gevent_cpu', '--logins', '4', '--renders', '4', '--rounds', '10',
+         '--max-stall-ms', '250'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+def test_approve_batch(app, client, supabase, admin_token, monkeypatch):
+    user_ids = [supabase.table('users').insert({
+        'name': f'Batch User {i}', 'batch': '2023', 'branch': 'CSE', 'phone_number': f'0176666{i:04d}',
+        'transaction_id': f'TXNB{i}', 'approval_status': status, 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id'] for i, status in enumerate(['pending', 'pending', 'rejected', 'pending'])]
+    unknown = '00000000-0000-0000-0000-000000000001'
+
+    # The last user is rejected after the route read it as pending: the write must not undo that
+    from app.routes import user as user_routes
+    read_users = user_routes.get_users_by_ids
+    def read_then_reject(*args, **kwargs):
+        users = read_users(*args, **kwargs)
+        supabase.table('users').update({'approval_status': 'rejected'}).eq('user_id', user_ids[3]).execute()
+        return users
+    monkeypatch.setattr(user_routes, 'get_users_by_ids', read_then_reject)
+
+    response = client.post('/users/approve/batch', json={'user_ids': user_ids + [unknown]}, headers=admin_token)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['approved'] == 2
+    results = {result['user_id']: result for result in body['results']}
+    assert [results[user_id]['status'] for user_id in user_ids] == ['approved', 'approved', 'failed', 'failed']
+    assert results[user_ids[3]]['error'] == 'User already processed'
+    assert results[unknown]['error'] == 'User not found'
+
+    rows = {row['user_id']: row for row in supabase.table('users').select('*').in_('user_id', user_ids).execute().data}
+    assert [rows[user_id]['approval_status'] for user_id in user_ids] == ['approved', 'approved', 'rejected', 'rejected']
+    assert rows[user_ids[0]]['qr_code_image_url'] and rows[user_ids[0]]['check_in_status'] == 'not_checked_in'
+
+    assert client.post('/users/approve/batch', json={'user_ids': []}, headers=admin_token).status_code == 400
+
+def test_approval_job_resumes_without_rendering_again(app, client, supabase, admin_token, monkeypatch):
+    from app.routes import user as user_routes
+    user_id = client.post('/users/register', data={
+        'name': 'Job User', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01755550000', 'transaction_id': 'TXNJ1'
+    }).get_json()['user_id']
+
+    renders = []
+    render = user_routes.generate_qr_code_image
+    monkeypatch.setattr(user_routes, 'generate_qr_code_image', lambda *args, **kwargs: renders.append(1) or render(*args, **kwargs))
+    def storage_down(*args, **kwargs):
+        raise RuntimeError('storage unavailable')
+    monkeypatch.setattr(user_routes, 'upload_file_to_supabase', storage_down)
+    monkeypatch.setitem(app.config, 'QR_STORAGE_UPLOAD_ENABLED', True)
+    monkeypatch.setattr(app.jobs, 'max_attempts', 1)
+
+    response = client.patch(f'/users/approve/{user_id}', headers=admin_token)
+    assert response.status_code == 202
+    job = wait_for_job(client, response, admin_token)
+    assert job['status'] == 'failed' and job['stage'] == 'upload'
+    assert supabase.table('users').select('approval_status').eq('user_id', user_id).execute().data[0]['approval_status'] == 'pending'
+
+    # Retried from the failed stage: the rendered image is reused, not rendered again
+    monkeypatch.setattr(user_routes, 'upload_file_to_supabase', lambda *args, **kwargs: 'https://storage.test/qr.png')
+    assert client.post(f"/jobs/{job['job_id']}/retry", headers=admin_token).status_code == 202
+    job = wait_for_job(client, response, admin_token)
+    assert job['status'] == 'succeeded'
+    assert len(renders) == 1
+    assert [stage['attempts'] for stage in job['stages'][:2]] == [1, 2]
+    row = supabase.table('users').select('*').eq('user_id', user_id).execute().data[0]
+    assert (row['approval_status'], row['qr_code_image_url']) == ('approved', 'https://storage.test/qr.png')
+
+def test_approval_job_does_not_undo_a_reject(app, supabase):
+    from app.routes.user import _persist_approval
+    from app.utils.jobs import JobFailed
+    user_id = supabase.table('users').insert({
+        'name': 'Rejected User', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01755550001',
+        'transaction_id': 'TXNJ2', 'approval_status': 'rejected', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id']
+
+    # The persist stage of a job queued before the reject
+    with app.app_context():
+        with pytest.raises(JobFailed, match='rejected'):
+            _persist_approval({'user_id': user_id, 'qr_code_url': 'https://storage.test/qr.png'})
+    row = supabase.table('users').select('*').eq('user_id', user_id).execute().data[0]
+    assert (row['approval_status'], row.get('qr_code_image_url')) == ('rejected', None)
+
+def test_approval_job_does_not_approve_twice(app, supabase):
+    from app.routes.user import _persist_approval
+    from app.utils.jobs import JobFailed
+    user_id = supabase.table('users').insert({
+        'name': 'Batch Approved User', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01755550003',
+        'transaction_id': 'TXNJ4', 'approval_status': 'approved', 'check_in_status': 'not_checked_in',
+        'qr_code_image_url': 'https://storage.test/batch.png'
+    }).execute().data[0]['user_id']
+    state = {'user_id': user_id, 'qr_code_url': 'https://storage.test/job.png'}
+
+    # Approved through /users/approve/batch while the job was queued: no second approval or message
+    with app.app_context():
+        with pytest.raises(JobFailed, match='already processed'):
+            _persist_approval({**state, '_attempt': 1})
+    row = supabase.table('users').select('*').eq('user_id', user_id).execute().data[0]
+    assert row['qr_code_image_url'] == 'https://storage.test/batch.png'
+
+    # A repeat of the stage may find the user approved by its own earlier attempt
+    with app.app_context():
+        assert _persist_approval({**state, '_attempt': 2})['approved']
+
+def test_reject_does_not_undo_an_approval(app, client, supabase, admin_token, monkeypatch):
+    import app.routes.user as user_routes
+    user = supabase.table('users').insert({
+        'name': 'Approved Meanwhile', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01755550002',
+        'transaction_id': 'TXNJ3', 'approval_status': 'approved', 'check_in_status': 'not_checked_in',
+        'qr_code_image_url': 'https://storage.test/qr.png'
+    }).execute().data[0]
+
+    # The route read the user while still pending; the approval job persisted before the write
+    monkeypatch.setattr(user_routes, 'get_user_by_id', lambda *args, **kwargs: {**user, 'approval_status': 'pending'})
+    queued = app.whatsapp_outbox.stats()['queue_depth'] + app.whatsapp_outbox.stats()['sent']
+    response = client.patch(f"/users/reject/{user['user_id']}", headers=admin_token)
+    assert response.status_code == 400
+    row = supabase.table('users').select('*').eq('user_id', user['user_id']).execute().data[0]
+    assert row['approval_status'] == 'approved'
+    assert app.whatsapp_outbox.stats()['queue_depth'] + app.whatsapp_outbox.stats()['sent'] == queued
+
+def test_request_log_records_are_not_rate_limited():
+    import logging
+    from app.utils.log import RateLimitFilter
+    rate_limit = RateLimitFilter(burst=1, interval=60)
+    def record(**extra):
+        record = logging.LogRecord('app.utils.log', logging.INFO, __file__, 1, 'GET /healthz 200', (), None)
+        record.__dict__.update(extra)
+        return record
+
+    # Ordinary records from one call site stop after the burst; per-request records never do
+    assert [rate_limit.filter(record()) for _ in range(3)] == [True, False, False]
+    assert all(rate_limit.filter(record(_no_rate_limit=True)) for _ in range(100))
+
+def test_pending_users_paging(client, supabase, admin_token, monkeypatch):
+    user_ids = {supabase.table('users').insert({
+        'name': f'Pending User {i}', 'batch': '2024', 'branch': 'ME', 'phone_number': f'0174444{i:04d}',
+        'transaction_id': f'TXNP{i}', 'approval_status': 'pending', 'check_in_status': 'not_checked_in'
+    }).execute().data[0]['user_id'] for i in range(5)}
+
+    # Keyset pages of two cover every user once; the last page has no next cursor
+    seen, url, pages = [], '/users/pending?batch=2024&limit=2&columns=user_id,name', 0
+    while url:
+        response = client.get(url, headers=admin_token)
+        assert response.status_code == 200
+        seen += [user['user_id'] for user in response.get_json()]
+        cursor = response.headers.get('X-Next-Cursor')
+        url = f'/users/pending?batch=2024&limit=2&columns=user_id,name&cursor={cursor}' if cursor else None
+        pages += 1
+    assert sorted(seen) == sorted(user_ids) and pages == 3
+
+    # An unchanged page is a bodiless 304, answered without a query
+    first = client.get('/users/pending?batch=2024&limit=2', headers=admin_token)
+    conditional = {**admin_token, 'If-None-Match': first.headers['ETag']}
+    monkeypatch.setattr('app.routes.user.get_pending_users', lambda *args, **kwargs: pytest.fail('Queried'))
+    again = client.get('/users/pending?batch=2024&limit=2', headers=conditional)
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+    monkeypatch.undo()
+
+    # A reject changes the pending list, so the same request gets the new page
+    assert client.patch(f'/users/reject/{first.get_json()[0]["user_id"]}', headers=admin_token).status_code == 200
+    changed = client.get('/users/pending?batch=2024&limit=2', headers=conditional)
+    assert changed.status_code == 200 and changed.headers['ETag'] != first.headers['ETag']
+    assert first.get_json()[0] not in changed.get_json()
+
+    # Cursors are decoded to a timestamp and a UUID; anything else could rewrite the filter
+    forged = [
+        'not-base64!',
+        base64.urlsafe_b64encode(b'{}').decode(),
+        base64.urlsafe_b64encode(json.dumps(['2024-01-01T00:00:00+00:00', 'x",user_id.neq."']).encode()).decode(),
+        base64.urlsafe_b64encode(json.dumps(['2024")', str(next(iter(user_ids)))]).encode()).decode(),
+    ]
+    for cursor in forged:
+        assert client.get(f'/users/pending?cursor={cursor}', headers=admin_token).status_code == 400
+
+def test_check_in_roster(tmp_path):
+    from app.backends.sqlite_backend import SQLiteStore
+    from app.utils.roster import CheckInRoster
+    store = SQLiteStore(str(tmp_path / 'roster.db'))
+    users = [store.insert_user({
+        'name': f'Roster User {i}', 'batch': '2023', 'branch': 'CSE', 'phone_number': f'0173333{i:04d}',
+        'transaction_id': f'TXNR{i}', 'approval_status': 'pending' if i == 5 else 'approved',
+        'check_in_status': 'checked_in' if i == 0 else 'not_checked_in'
+    })['user_id'] for i in range(6)]
+
+    # Loaded in pages smaller than the number of approved users
+    roster = CheckInRoster(store, flush_batch_size=2)
+    roster.load(page_size=2)
+    assert len(roster) == 5 and users[5] not in roster
+
+    assert roster.check_in(users[0]) == 'already_checked_in'
+    assert [roster.check_in(user_id) for user_id in users[1:4]] == ['checked_in'] * 3
+    assert roster.check_in(users[1]) == 'already_checked_in'
+    assert roster.check_in(users[5]) is None
+    assert roster.stats()['pending_sync'] == 3
+
+    # Written back in batches of flush_batch_size; the database is only touched by the flush
+    assert store.get_user(users[1])['check_in_status'] == 'not_checked_in'
+    assert roster.flush()
+    assert roster.stats()['pending_sync'] == 1
+    roster.stop()
+    assert roster.stats()['pending_sync'] == 0
+    assert [store.get_user(user_id)['check_in_status'] for user_id in users[1:5]] == \
+        ['checked_in', 'checked_in', 'checked_in', 'not_checked_in']
+
+
+def _sqlite_user(i, **fields):
+    return {'name': f'SQLite User {i}', 'batch': '2023', 'branch': 'CSE', 'phone_number': f'0174444{i:04d}',
+            'transaction_id': f'TXNS{i}', **fields}
+
+
+def test_sqlite_store(tmp_path):
+    from app.backends.base import DuplicateRecordError
+    from app.backends.sqlite_backend import SQLiteStore
+    store = SQLiteStore(str(tmp_path / 'store.db'))
+
+    # CRUD
+    user = store.insert_user(_sqlite_user(0))
+    assert user['approval_status'] == 'pending' and user['check_in_status'] == 'not_checked_in'
+    assert store.get_user(user['user_id'], 'name, batch') == {'name': 'SQLite User 0', 'batch': '2023'}
+    assert store.update_user(user['user_id'], {'branch': 'EEE'})['branch'] == 'EEE'
+    others = store.insert_users([_sqlite_user(i) for i in range(1, 4)])
+    assert {row['user_id'] for row in store.get_users([row['user_id'] for row in others])} == \
+        {row['user_id'] for row in others}
+    assert [row['user_id'] for row in store.list_users('user_id', filters={'branch': 'CSE'})] == \
+        [row['user_id'] for row in others]
+    with pytest.raises(ValueError):
+        store.get_user(user['user_id'], 'name, password')
+
+    # Unique transaction ID and phone number, the latter compared in its normalized form
+    with pytest.raises(DuplicateRecordError):
+        store.insert_user(_sqlite_user(9, transaction_id='TXNS0'))
+    with pytest.raises(DuplicateRecordError):
+        store.insert_user(_sqlite_user(9, phone_number='+88 0174444 0001'))
+    # A batch with a duplicate is rolled back as a whole
+    with pytest.raises(DuplicateRecordError):
+        store.insert_users([_sqlite_user(10), _sqlite_user(11, transaction_id='TXNS10')])
+    assert len(store.list_users('user_id')) == 4
+
+    # Check-in only succeeds once, and only for approved users
+    assert not store.check_in_user(user['user_id'])
+    approved = store.approve_users({row['user_id']: f'https://qr/{row["user_id"]}' for row in [user, *others[:2]]})
+    assert len(approved) == 3
+    assert store.approve_users({user['user_id']: 'https://qr/other'}) == []
+    assert store.get_user(user['user_id'])['qr_code_image_url'] == f'https://qr/{user["user_id"]}'
+    assert store.check_in_user(user['user_id'])
+    assert not store.check_in_user(user['user_id'])
+    assert store.check_in_users([row['user_id'] for row in [user, *others]]) == \
+        {others[0]['user_id'], others[1]['user_id']}
+    assert store.get_user(others[2]['user_id'])['check_in_status'] == 'not_checked_in'
+    store.close()
+
+
+def test_sqlite_store_opens_with_duplicate_registrations(tmp_path):
+    import sqlite3
+    from app.backends.sqlite_backend import SQLiteStore
+    from app.utils.registrations import normalize_phone_number
+    path = str(tmp_path / 'duplicates.db')
+    SQLiteStore(path).close()
+    conn = sqlite3.connect(path)
+    conn.create_function('phone_key', 1, normalize_phone_number, deterministic=True)
+    conn.execute('DROP INDEX idx_users_transaction_id_unique')
+    for i in range(2):
+        conn.execute("INSERT INTO users (user_id, name, batch, branch, phone_number, transaction_id, created_at) "
+                     "VALUES (?, 'Twice', '2023', 'CSE', ?, 'TXND1', '2026-01-01T00:00:00+00:00')",
+                     (f'00000000-0000-0000-0000-00000000000{i}', f'0175555000{i}'))
+    conn.commit()
+    conn.close()
+
+    # The unique index cannot be built yet; transaction lookups still use a plain one
+    store = SQLiteStore(path)
+    plan = store._conn.execute('EXPLAIN QUERY PLAN SELECT user_id FROM users WHERE transaction_id = ?',
+                               ('TXND1',)).fetchall()
+    assert any('idx_users_transaction_id' in row[-1] for row in plan)
+    assert len(store.list_users('user_id', filters={'transaction_id': 'TXND1'})) == 2
+    store.close()
+
+
+def test_export_import_round_trip(tmp_path):
+    from io import StringIO
+    from app.backends.sqlite_backend import SQLiteStore
+    from app.backends.transfer import export_data, import_data
+    main = SQLiteStore(str(tmp_path / 'main.db'))
+    users = main.insert_users([_sqlite_user(i, approval_status='approved') for i in range(5)])
+    main.upsert_admins([{'email': 'admin@test.com', 'password': 'hashed'}])
+
+    exported = StringIO()
+    assert export_data(main, exported, page_size=2) == {'users': 5, 'admins': 1}
+
+    # A gate starts from the export and checks people in offline
+    gate = SQLiteStore(str(tmp_path / 'gate.db'))
+    exported.seek(0)
+    assert import_data(gate, exported, mode='replace', chunk_size=2) == {'users': 5, 'admins': 1}
+    assert gate.list_users() == main.list_users()
+    assert gate.list_admins() == main.list_admins()
+    assert gate.check_in_users([users[0]['user_id'], users[1]['user_id']])
+
+    # Meanwhile the main database gets an edit and a new registration
+    main.update_user(users[2]['user_id'], {'branch': 'EEE'})
+    late = main.insert_user(_sqlite_user(5))
+
+    # Merging the gate back only carries over its check-ins
+    from_gate = StringIO()
+    export_data(gate, from_gate)
+    from_gate.seek(0)
+    assert import_data(main, from_gate) == {'users': 2, 'admins': 0}
+    rows = {row['user_id']: row for row in main.list_users()}
+    assert [rows[user['user_id']]['check_in_status'] for user in users] == \
+        ['checked_in', 'checked_in', 'not_checked_in', 'not_checked_in', 'not_checked_in']
+    assert rows[users[2]['user_id']]['branch'] == 'EEE'
+    assert late['user_id'] in rows
+
+    with pytest.raises(ValueError):
+        import_data(main, StringIO(), mode='overwrite')
+    main.close()
+    gate.close()
+
+
+def _wait_until(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'Timed out waiting for the outbox'
+        time.sleep(0.02)
+
+
+def test_outbox_with_fake_transport(tmp_path):
+    from app.utils.outbox import WhatsAppOutbox
+    from app.utils.transports import FakeTransport, create_transport
+    transport = FakeTransport(failures=3)
+    outbox = WhatsAppOutbox(transport.send, db_path=str(tmp_path / 'outbox.db'), rate_per_minute=6000, burst=10,
+                            max_attempts=2, retry_base_delay=0.05, retry_max_delay=0.1)
+    outbox.start()
+    try:
+        # Fails on both attempts and is dead-lettered with the last error
+        dead_id = outbox.enqueue('+8801711111111', 'first')
+        _wait_until(lambda: outbox.stats()['dead_letters'] == 1)
+        [dead] = outbox.dead_letters()
+        assert dead['id'] == dead_id and dead['attempts'] == 2
+        assert dead['last_error'] == 'Fake send failure 2 of 3'
+
+        # Fails once, then goes through on the retry
+        outbox.enqueue('+8801722222222', 'second')
+        _wait_until(lambda: outbox.stats()['sent'] == 1)
+        assert transport.messages == [('+8801722222222', 'second')]
+
+        # A dead letter sent again from the admin endpoint is delivered now that the transport works
+        assert outbox.retry_dead_letter(dead_id)
+        assert not outbox.retry_dead_letter(dead_id)
+        _wait_until(lambda: outbox.stats()['sent'] == 2)
+        assert transport.messages[-1] == ('+8801711111111', 'first')
+
+        stats = outbox.stats()
+        assert stats['queue_depth'] == 0 and stats['dead_letters'] == 0
+        assert stats['failed_attempts'] == 3 and stats['dead_lettered_this_process'] == 1
+        assert transport.attempts == 5
+    finally:
+        outbox.stop()
+
+    config = {'MESSAGING_TRANSPORT': 'fake', 'FAKE_TRANSPORT_LATENCY': 0.0, 'FAKE_TRANSPORT_START_DELAY': 0.0}
+    assert isinstance(create_transport(config), FakeTransport)
+    with pytest.raises(ValueError):
+        create_transport({**config, 'MESSAGING_TRANSPORT': 'http', 'WHATSAPP_API_TOKEN': ''})
+    with pytest.raises(ValueError):
+        create_transport({**config, 'MESSAGING_TRANSPORT': 'sms'})
+
+
+def test_outbox_requeues_only_expired_leases(tmp_path):
+    from app.utils.outbox import WhatsAppOutbox
+    from app.utils.transports import FakeTransport
+    path = str(tmp_path / 'outbox.db')
+    transport = FakeTransport()
+    leader = WhatsAppOutbox(transport.send, db_path=path, rate_per_minute=6000, lease_seconds=60)
+    in_flight = leader.enqueue('+8801711111111', 'in flight')
+    stale = leader.enqueue('+8801722222222', 'stale')
+    now = time.time()
+    with leader.transaction() as conn:
+        conn.execute("UPDATE outbox SET status = 'sending', claimed_at = ?, claimed_by = 'gate-1:100' WHERE id = ?",
+                     (now, in_flight))
+        conn.execute("UPDATE outbox SET status = 'sending', claimed_at = ?, claimed_by = 'gate-1:101' WHERE id = ?",
+                     (now - 120, stale))
+
+    # Another worker building its outbox leaves the leader's message alone
+    WhatsAppOutbox(transport.send, db_path=path)
+    assert leader.stats()['queue_depth'] == 2
+
+    # The process that starts sending only takes over the expired lease
+    leader.start()
+    try:
+        _wait_until(lambda: leader.stats()['sent'] == 1)
+        assert transport.messages == [('+8801722222222', 'stale')]
+        assert leader.stats()['queue_depth'] == 1
+    finally:
+        leader.stop()
+
+
+def test_roster_feed_records_while_snapshot_loads(tmp_path):
+    from app.backends.sqlite_backend import SQLiteStore
+    from app.utils.outbox import WhatsAppOutbox
+    from app.utils.roster_feed import RosterFeed, APPROVED, CHECKED_IN
+    store = SQLiteStore(str(tmp_path / 'feed.db'))
+    user = store.insert_user({'name': 'Feed User', 'batch': '2023', 'branch': 'CSE', 'phone_number': '01755556666',
+                              'transaction_id': 'TXNF1', 'approval_status': 'approved'})
+    paging, release = threading.Event(), threading.Event()
+    list_users = store.list_users
+
+    def slow_list_users(*args, **kwargs):
+        paging.set()
+        release.wait(10)
+        return list_users(*args, **kwargs)
+
+    store.list_users = slow_list_users
+    feed = RosterFeed(WhatsAppOutbox(lambda *args: None, db_path=str(tmp_path / 'outbox.db')), store)
+    snapshots = []
+    builder = threading.Thread(target=lambda: snapshots.append(feed.snapshot()))
+    builder.start()
+    assert paging.wait(10)
+
+    # A scan records its change while the base is still being paged in
+    started = time.monotonic()
+    feed.record(user['user_id'], CHECKED_IN)
+    assert time.monotonic() - started < 1
+    assert feed.stats()['pending'] == 1
+    release.set()
+    builder.join(10)
+    assert snapshots[0][1] == {user['user_id']: APPROVED}
+    assert feed.flush() == 1
+    assert feed.snapshot()[1] == {user['user_id']: CHECKED_IN}
+
+
+def test_job_reads_do_not_take_the_write_lock(tmp_path):
+    import sqlite3
+    from app.utils.jobs import JobQueue, Stage
+    from app.utils.outbox import WhatsAppOutbox
+    outbox = WhatsAppOutbox(lambda *args: None, db_path=str(tmp_path / 'outbox.db'))
+    jobs = JobQueue(None, outbox)
+    jobs.register('noop', [Stage('noop', lambda state: {})])
+    assert jobs._claim() is None
+    job_id, _ = jobs.submit('noop', 'subject')
+
+    # Another process holds the write lock, e.g. the leader sending a message
+    writer = sqlite3.connect(str(tmp_path / 'outbox.db'), isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        started = time.monotonic()
+        assert jobs.get(job_id)['status'] == 'queued'
+        assert jobs.stats()['queued'] == 1
+        assert time.monotonic() - started < 1
+    finally:
+        writer.execute('ROLLBACK')
+    assert jobs._claim()[0] == job_id
+    assert jobs._claim() is None
+
+
+def test_render_pool_spawns_workers():
+    from app.utils import qr_code
+    payloads = [f'render-pool-{i}' for i in range(3)]
+    images = qr_code.render_qr_code_images(payloads, 2, box_size=4, border=1, image_format='png')
+    try:
+        assert qr_code._render_pool._mp_context.get_start_method() == 'spawn'
+        assert images == {payload: qr_code._render_qr_code(payload, 4, 1, 'png') for payload in payloads}
+    finally:
+        qr_code._render_pool.shutdown()
+        qr_code._reset_render_pool()
+
+
+def test_whatsapp_session_pool_restarts_dead_sessions(tmp_path):
+    from selenium.common.exceptions import WebDriverException
+    from app.utils.whatsapp import WhatsAppSessionPool
+    bots, logins = [], []
+
+    class FakeBot:
+        def __init__(self, session_file, profile_dir, login_timeout):
+            logins.append(profile_dir)
+            if logins == [os.path.join(str(tmp_path), 'session_0'), os.path.join(str(tmp_path), 'session_1')]:
+                raise RuntimeError('Login timed out')
+            self.alive = True
+            self.crash_on_send = False
+            self.sent = []
+            bots.append(self)
+
+        def is_alive(self):
+            return self.alive
+
+        def send_message(self, phone_number, message):
+            if self.crash_on_send:
+                self.alive = False
+                raise WebDriverException('chrome not reachable')
+            self.sent.append((phone_number, message))
+
+        def close(self):
+            self.alive = False
+
+    pool = WhatsAppSessionPool(size=2, profile_root=str(tmp_path), rate_per_minute=6000000, health_check_interval=0.05,
+                               acquire_timeout=2, bot_factory=FakeBot)
+    # Session 1 fails to log in; the pool starts with the one that did
+    pool.start()
+    try:
+        assert [session['healthy'] for session in pool.stats()] == [True, False]
+        pool.send_message('+8801711111111', 'first')
+        assert pool.sessions[0].bot.sent == [('+8801711111111', 'first')]
+
+        # A retried start brings up the missing session and keeps the running one
+        running = pool.sessions[0].bot
+        pool.start()
+        assert [session['healthy'] for session in pool.stats()] == [True, True]
+        assert pool.sessions[0].bot is running
+
+        # A session that died while sending is restarted and the error goes back to the outbox
+        pool._next = 0
+        running.crash_on_send = True
+        with pytest.raises(WebDriverException):
+            pool.send_message('+8801722222222', 'second')
+        assert pool.sessions[0].bot is not running and pool.stats()[0]['restarts'] == 1
+
+        # One that died idle is restarted by the health check
+        idle = pool.sessions[1].bot
+        idle.alive = False
+        _wait_until(lambda: pool.sessions[1].bot is not idle, timeout=5)
+        assert pool.stats()[1]['restarts'] == 1 and pool.stats()[1]['healthy']
+        assert pool.stats()[0]['failures'] == 1
+    finally:
+        pool.close()
+    assert not any(bot.alive for bot in bots)
+
+
+def test_qr_code_cache(tmp_path, monkeypatch):
+    from app.utils import qr_code
+    renders = []
+    render = qr_code._render_qr_code
+    monkeypatch.setattr(qr_code, '_render_qr_code', lambda *args: renders.append(args[0]) or render(*args))
+    monkeypatch.setattr(qr_code, '_qr_cache', OrderedDict())
+    monkeypatch.setattr(qr_code, '_qr_cache_max_entries', 2)
+    options = {'box_size': 4, 'border': 1, 'image_format': 'png'}
+    first = qr_code.generate_qr_code_image('cache-a', **options)
+    qr_code.generate_qr_code_image('cache-b', **options)
+    assert qr_code.generate_qr_code_image('cache-a', **options) == first
+    # 'b' is now the least recently used, so it is the one evicted
+    qr_code.generate_qr_code_image('cache-c', **options)
+    qr_code.generate_qr_code_image('cache-a', **options)
+    qr_code.generate_qr_code_image('cache-b', **options)
+    assert renders == ['cache-a', 'cache-b', 'cache-c', 'cache-b']
+
+    # With a cache directory, a render survives the in-memory cache
+    qr_code.generate_qr_code_image('cache-d', cache_dir=str(tmp_path), **options)
+    qr_code._qr_cache.clear()
+    assert qr_code.generate_qr_code_image('cache-d', cache_dir=str(tmp_path), **options) == render('cache-d', 4, 1, 'png')
+    assert renders.count('cache-d') == 1
+
+
+def test_unchanged_qr_code_upload_is_skipped(tmp_path, monkeypatch):
+    from flask import Flask
+    from app.utils import qr_code
+    uploads = []
+
+    class Bucket:
+        def upload(self, file_name, content, options):
+            uploads.append((file_name, content))
+            return type('Response', (), {'status_code': 500 if content == b'broken' else 200, 'content': b''})()
+
+    app = Flask(__name__)
+    app.config.update(SUPABASE_URL='https://project.test', QR_CACHE_DIR=str(tmp_path))
+    app.supabase = type('Supabase', (), {'storage': type('Storage', (), {'from_': lambda self, name: Bucket()})()})()
+    monkeypatch.setattr(qr_code, '_uploaded_hashes', {})
+    with app.app_context():
+        url = qr_code.upload_file_to_supabase(b'image-1', 'qr_codes', 'user.png')
+        assert url == 'https://project.test/storage/v1/object/public/qr_codes/user.png'
+        assert qr_code.upload_file_to_supabase(b'image-1', 'qr_codes', 'user.png') == url
+        assert len(uploads) == 1
+
+        # The record on disk outlives the process
+        qr_code._uploaded_hashes.clear()
+        qr_code.upload_file_to_supabase(b'image-1', 'qr_codes', 'user.png')
+        assert len(uploads) == 1
+
+        # New bytes are uploaded; a failed upload is not recorded, so it is tried again
+        qr_code.upload_file_to_supabase(b'image-2', 'qr_codes', 'user.png')
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                qr_code.upload_file_to_supabase(b'broken', 'qr_codes', 'user.png')
+        assert [content for _, content in uploads] == [b'image-1', b'image-2', b'broken', b'broken']
+
+
+def test_metrics_endpoint(monkeypatch):
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+    from app.utils.metrics import init_metrics
+
+    class Outbox:
+        reads = 0
+
+        def stats(self):
+            Outbox.reads += 1
+            return {'queue_depth': 3, 'oldest_pending_age_seconds': 1.5, 'dead_letters': 0, 'sent': 7,
+                    'workers_running': 1}
+
+    app = Flask(__name__)
+    app.config.update(TESTING=True, JWT_SECRET_KEY='metrics-test-' * 4, METRICS_PUBLIC=False, SLOW_REQUEST_THRESHOLD_MS=0)
+    JWTManager(app)
+    app.whatsapp_outbox = Outbox()
+
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    init_metrics(app)
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    with app.app_context():
+        token = create_access_token(identity='admin')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # An unhandled exception skips after_request but must still count as a 5xx
+    with pytest.raises(RuntimeError):
+        client.get('/boom')
+    response = client.get('/metrics', headers=headers)
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'outbox_queue_depth 3' in body
+    assert 'outbox_sent 7' in body
+    assert 'http_request_errors_total{blueprint="",endpoint="boom",status="500"}' in body
+    assert Outbox.reads == 1
+
+    app.config['METRICS_PUBLIC'] = True
+    assert client.get('/metrics').status_code == 200
+
+
+def test_login_is_throttled_and_sheds_load(monkeypatch):
+    from flask import Flask
+    from flask_jwt_extended import JWTManager
+    from app import auth
+    from app.utils.passwords import PasswordVerifier
+    from app.utils.throttle import LoginThrottle
+
+    admin = {'admin_id': 1, 'password': bcrypt.hashpw(b'secret', bcrypt.gensalt(4)).decode('utf-8')}
+    monkeypatch.setattr(auth, 'get_admin_by_email', lambda email: admin)
+    app = Flask(__name__)
+    app.config.update(JWT_SECRET_KEY='login-test-' * 4, LOGIN_VERIFY_TIMEOUT=5)
+    JWTManager(app)
+    app.login_throttle = LoginThrottle(60, 10, 60, 2)
+    app.password_verifier = PasswordVerifier(max_workers=1, max_queue=0)
+    app.register_blueprint(auth.bp)
+    client = app.test_client()
+
+    def login(email='admin@example.com'):
+        return client.post('/auth/login', json={'email': email, 'password': 'secret'})
+
+    try:
+        assert login().status_code == 200
+        assert login().status_code == 200
+        # With the only verifier slot taken, a login is refused at once instead of queueing
+        app.password_verifier._slots.acquire()
+        response = login('other@example.com')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        app.password_verifier._slots.release()
+
+        # The per-account bucket (burst 2) is empty now, and a throttled attempt never reaches bcrypt
+        response = login()
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) >= 1
+        assert app.password_verifier.stats() == {'in_flight': 0, 'rejected': 1}
+    finally:
+        app.password_verifier.close()
+
+
+def test_user_loader_waits_only_when_lookups_overlap():
+    from app.database import UserLoader
+
+    class Store:
+        def __init__(self):
+            self.queries = []
+            self.querying = threading.Event()
+            self.release = threading.Event()
+            self.release.set()
+
+        def get_users(self, user_ids, columns):
+            self.queries.append(sorted(user_ids))
+            self.querying.set()
+            self.release.wait(5)
+            return [{'user_id': user_id, 'name': f'User {user_id}'} for user_id in user_ids]
+
+    store = Store()
+    loader = UserLoader(store, batch_window=0.5)
+
+    # A lone miss does not sit out the batching window
+    started = time.perf_counter()
+    assert loader.load_many([1], 'name') == {1: {'name': 'User 1'}}
+    assert time.perf_counter() - started < 0.25
+
+    # While a query is in flight, the next misses wait and share one query
+    store.querying.clear()
+    store.release.clear()
+    first = threading.Thread(target=loader.load_many, args=([2],))
+    first.start()
+    assert store.querying.wait(5)
+    found = {}
+    leader = threading.Thread(target=lambda: found.update(loader.load_many([3])))
+    leader.start()
+    _wait_until(lambda: loader._pending is not None, 5)
+    joiner = threading.Thread(target=lambda: found.update(loader.load_many([4])))
+    joiner.start()
+    store.release.set()
+    for thread in (first, leader, joiner):
+        thread.join(5)
+    assert store.queries == [[1], [2], [3, 4]]
+    assert sorted(found) == [3, 4]
+    assert loader.stats()['joined_batches'] == 1
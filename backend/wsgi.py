@@ -0,0 +1,5 @@
+# Production entry point, served by gunicorn with gevent workers:
+#     gunicorn -c gunicorn.conf.py wsgi:app
+from app import create_app
+
+app = create_app()